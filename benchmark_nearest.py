@@ -0,0 +1,87 @@
+import time
+import numpy as np
+from nyc_transit import GTFSLoader, StationLocator
+from nyc_transit.spatial import haversine, latlng_to_cell, grid_ring
+
+# Configuration
+NUM_QUERIES = 2000  # Random user locations
+K_STATIONS = 4
+SEED = 42
+
+# Same bounding box as simulation_cost_analysis.py
+LAT_MIN, LAT_MAX = 40.57, 40.91
+LON_MIN, LON_MAX = -74.04, -73.75
+
+def heuristic_h3(locator, lat, lon, k):
+    """
+    The simulation_cost_analysis.py H3 search, with the same stopping rule: expand while there are
+    fewer than 3k candidates and fewer than 10 rings, but stop as soon as there are more than 2k,
+    however far away they are.
+    """
+    center = latlng_to_cell(lat, lon, locator.h3_resolution)
+    candidates = []
+    ring = 0
+    while len(candidates) < k * 3 and ring < 10:
+        cells = [center] if ring == 0 else grid_ring(center, ring)
+        candidates.extend(i for cell in cells for i in locator.stations_in_cell(cell))
+        if len(candidates) > k * 2:
+            break
+        ring += 1
+    if not candidates:
+        return np.array([]), np.array([], dtype=int)
+    distances = haversine(lat, lon, locator.lats[candidates], locator.lons[candidates])
+    order = np.argsort(distances)[:k]
+    return distances[order], np.array(candidates)[order]
+
+def report(name, latencies, found, truth):
+    """Latency percentiles and the share of queries whose k nearest match brute force exactly."""
+    latencies = np.array(latencies) * 1000
+    exact = sum(
+        len(d) == len(t) and np.allclose(d, t)
+        for d, t in zip(found, truth)
+    )
+    print(f"{name:<18} p50 {np.percentile(latencies, 50):.3f} ms  "
+          f"p99 {np.percentile(latencies, 99):.3f} ms  "
+          f"exact top-{K_STATIONS}: {exact / len(truth):.1%}")
+
+def timed(fn, points):
+    latencies, found = [], []
+    for lat, lon in points:
+        t0 = time.perf_counter()
+        distances = fn(lat, lon)
+        latencies.append(time.perf_counter() - t0)
+        found.append(distances)
+    return latencies, found
+
+def main():
+    loader = GTFSLoader(optimize_memory=True)
+    loader.load_data()
+    locator = StationLocator(loader)
+
+    rng = np.random.default_rng(SEED)
+    lats = rng.uniform(LAT_MIN, LAT_MAX, NUM_QUERIES)
+    lons = rng.uniform(LON_MIN, LON_MAX, NUM_QUERIES)
+    points = list(zip(lats.tolist(), lons.tolist()))
+
+    # Ground truth: every station, every query
+    all_distances = haversine(lats[:, None], lons[:, None], locator.lats[None, :], locator.lons[None, :])
+    truth = np.sort(all_distances, axis=1)[:, :K_STATIONS]
+
+    print(f"\n--- {NUM_QUERIES} queries, k={K_STATIONS}, {len(locator)} stations ---")
+    report("KD-tree", *timed(lambda a, b: locator.nearest_batch([a], [b], K_STATIONS)[0][0], points), truth)
+
+    rings = []
+    def exact_h3(a, b):
+        distances, _, ring = locator._nearest_h3(a, b, K_STATIONS)
+        rings.append(ring)
+        return distances
+    report("H3 ring expansion", *timed(exact_h3, points), truth)
+    report("H3 heuristic", *timed(lambda a, b: heuristic_h3(locator, a, b, K_STATIONS)[0], points), truth)
+    print(f"Rings expanded (exact): mean {np.mean(rings):.1f}, max {max(rings)}")
+
+    t0 = time.perf_counter()
+    locator.nearest_batch(lats, lons, K_STATIONS)
+    print(f"KD-tree batch:     {(time.perf_counter() - t0) / NUM_QUERIES * 1000:.4f} ms/query")
+
+if __name__ == "__main__":
+    main()
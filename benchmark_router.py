@@ -0,0 +1,255 @@
+import random
+import time
+from nyc_transit import GTFSLoader, TransitGraph, Router
+from nyc_transit.router import ROUTE_CACHE_SIZE
+from nyc_transit.contraction import ContractionHierarchy
+
+# Configuration
+NUM_QUERIES = 200  # Number of random origin-destination pairs
+SEED = 42
+
+def scan_station_name(stops, stop_id):
+    """The old GTFSLoader.get_station_name: a boolean-mask scan of the whole stops table."""
+    station = stops[stops['stop_id'] == stop_id]
+    if not station.empty:
+        return station.iloc[0]['stop_name']
+    return "Unknown Station"
+
+def sample_pairs(loader, n, seed=SEED):
+    rng = random.Random(seed)
+    station_ids = list(loader.parent_stations['stop_id'])
+    return [(rng.choice(station_ids), rng.choice(station_ids)) for _ in range(n)]
+
+def bench_reconstruction(loader, router, pairs):
+    """Times journey reconstruction (station name lookups) with the old scan vs the stop index."""
+    print("\n--- Journey reconstruction ---")
+    paths = [router.get_shortest_path(a, b) for a, b in pairs]
+    paths = [p for p in paths if p]
+    num_steps = sum(len(p['steps']) for p in paths)
+
+    start_time = time.perf_counter()
+    for path in paths:
+        for step in path['steps']:
+            scan_station_name(loader.stops, step['from_id'])
+            scan_station_name(loader.stops, step['to_id'])
+    scan_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for path in paths:
+        for step in path['steps']:
+            loader.get_station_name(step['from_id'])
+            loader.get_station_name(step['to_id'])
+    index_time = time.perf_counter() - start_time
+
+    print(f"{len(paths)} routes, {num_steps} steps")
+    print(f"DataFrame scan: {scan_time / len(paths) * 1000:.3f} ms/route")
+    print(f"Stop index:     {index_time / len(paths) * 1000:.3f} ms/route")
+
+def bench_route_cache(graph, pairs, seed=SEED):
+    """Replays a skewed (Zipf-like) stream of queries over the pairs, uncached and through the route cache."""
+    print("\n--- Route cache ---")
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(pairs))]
+    stream = rng.choices(pairs, weights=weights, k=NUM_QUERIES * 10)
+
+    for name, cache_size in (("Uncached", 0), ("LRU cache", ROUTE_CACHE_SIZE)):
+        router = Router(graph, cache_size=cache_size)
+        start_time = time.perf_counter()
+        for a, b in stream:
+            router.get_shortest_path(a, b)
+        elapsed = time.perf_counter() - start_time
+        print(f"{name:<10} {elapsed / len(stream) * 1000:.3f} ms/query")
+    print(f"Cache: {router.cache.stats()}")
+
+def bench_matrix(graph, loader, num_stations=50):
+    """All-pairs travel times over a station sample: one search per pair vs one tree per origin."""
+    print("\n--- Travel time matrix ---")
+    stations = list(loader.parent_stations['stop_id'])[:num_stations]
+
+    router = Router(graph, cache_size=0)
+    start_time = time.perf_counter()
+    for a in stations:
+        for b in stations:
+            router.get_shortest_path(a, b)
+    pairwise_time = time.perf_counter() - start_time
+
+    router = Router(graph, cache_size=0)
+    start_time = time.perf_counter()
+    router.travel_time_matrix(stations, stations)
+    tree_time = time.perf_counter() - start_time
+
+    print(f"{len(stations)}x{len(stations)} stations")
+    print(f"Pairwise searches:   {pairwise_time:.3f} s")
+    print(f"Shortest-path trees: {tree_time:.3f} s")
+
+def bench_astar(graph, pairs):
+    """Settled nodes and latency of A* vs Dijkstra on the compact graph, checking they agree on travel time."""
+    print("\n--- A* vs Dijkstra ---")
+    compact = graph.compact
+    index = compact.node_index
+    node_pairs = [(index[a], index[b]) for a, b in pairs if a in index and b in index]
+    print(f"Max transit speed: {compact.max_speed():.1f} m/s, transfer head start: {compact.head_start():.0f} s")
+
+    def dijkstra(source, target, stats):
+        # A* without a heuristic
+        speed, compact._max_speed = compact._max_speed, 0.0
+        try:
+            return compact.astar_path(source, target, stats)
+        finally:
+            compact._max_speed = speed
+
+    searches = (
+        ("Dijkstra", dijkstra),
+        ("Bidirectional", compact.shortest_path),
+        ("A*", compact.astar_path),
+    )
+    costs = {}
+    for name, search in searches:
+        settled = 0
+        costs[name] = []
+        start_time = time.perf_counter()
+        for source, target in node_pairs:
+            stats = {}
+            path = search(source, target, stats)
+            settled += stats['settled']
+            costs[name].append(None if path is None else sum(compact.weights[e] for e in path))
+        elapsed = time.perf_counter() - start_time
+        print(f"{name:<14} {elapsed / len(node_pairs) * 1000:.3f} ms/query, {settled / len(node_pairs):.0f} settled nodes/query")
+
+    mismatches = sum(
+        (a is None) != (b is None) or (a is not None and abs(a - b) > 1e-6)
+        for a, b in zip(costs["Dijkstra"], costs["A*"])
+    )
+    print(f"Travel time mismatches (A* vs Dijkstra): {mismatches}")
+
+def bench_contraction(graph, pairs):
+    """Preprocessing cost and query latency of the contraction hierarchy vs bidirectional Dijkstra."""
+    print("\n--- Contraction hierarchy vs bidirectional Dijkstra ---")
+    compact = graph.compact
+    start_time = time.perf_counter()
+    ch = ContractionHierarchy.build(compact)
+    print(f"Preprocessing: {time.perf_counter() - start_time:.2f}s, "
+          f"{ch.number_of_shortcuts()} shortcuts over {compact.number_of_edges()} edges")
+    graph.build_contraction() # Saves it on the first run
+    start_time = time.perf_counter()
+    graph.build_contraction()
+    print(f"Loading the saved hierarchy: {time.perf_counter() - start_time:.3f}s")
+
+    index = compact.node_index
+    node_pairs = [(index[a], index[b]) for a, b in pairs if a in index and b in index]
+    costs = {}
+    for name, search in (("Bidirectional", compact.shortest_path), ("CH", ch.shortest_path)):
+        settled = 0
+        latencies = []
+        costs[name] = []
+        for source, target in node_pairs:
+            stats = {}
+            start_time = time.perf_counter()
+            path = search(source, target, stats)
+            latencies.append(time.perf_counter() - start_time)
+            settled += stats['settled']
+            costs[name].append(None if path is None else sum(compact.weights[e] for e in path))
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        print(f"{name:<14} p50 {p50:.3f} ms, p99 {p99:.3f} ms, {settled / len(node_pairs):.0f} settled nodes/query")
+
+    mismatches = sum(
+        (a is None) != (b is None) or (a is not None and abs(a - b) > 1e-6)
+        for a, b in zip(costs["Bidirectional"], costs["CH"])
+    )
+    print(f"Travel time mismatches (CH vs Dijkstra): {mismatches}")
+
+    # End to end, including unpacking shortcuts and building the journey steps
+    for backend in ('compact', 'ch'):
+        router = Router(graph, backend=backend, cache_size=0)
+        start_time = time.perf_counter()
+        for a, b in pairs:
+            router.get_shortest_path(a, b)
+        elapsed = time.perf_counter() - start_time
+        print(f"Router '{backend}': {elapsed / len(pairs) * 1000:.3f} ms/route")
+
+def bench_station_graph(graph, pairs):
+    """Size and query cost of the collapsed (platform, route) graph vs the stop-level graph."""
+    print("\n--- Station-level vs stop-level graph ---")
+    station_graph = graph.station_graph or graph.build_station_graph()
+    compact = graph.compact
+    print(f"Stop-level: {compact.number_of_nodes()} nodes, {compact.number_of_edges()} edges; "
+          f"station-level: {station_graph.number_of_nodes()} nodes, {station_graph.number_of_edges()} edges")
+
+    index = compact.node_index
+    entry = station_graph.entry_costs
+    # Searches only; both routers then spend about the same building the steps
+    searches = (
+        ("Stop-level", lambda a, b, stats: compact.shortest_path(index[a], index[b], stats)),
+        ("Station-level", lambda a, b, stats: station_graph.compact.shortest_path_multi(entry(a), entry(b), stats)),
+    )
+    for name, search in searches:
+        settled = 0
+        start_time = time.perf_counter()
+        for a, b in pairs:
+            stats = {}
+            search(a, b, stats)
+            settled += stats.get('settled', 0)
+        elapsed = time.perf_counter() - start_time
+        print(f"{name:<14} {elapsed / len(pairs) * 1000:.3f} ms/query, {settled / len(pairs):.0f} settled nodes/query")
+
+    # Leaving a platform for the parent and entering another one mid-journey
+    def parent_hops(journey):
+        steps = journey['steps']
+        return sum(a['type'] == 'child_parent' and b['type'] == 'parent_child' for a, b in zip(steps, steps[1:]))
+
+    for backend in ('compact', 'stations'):
+        router = Router(graph, backend=backend, cache_size=0)
+        journeys = [j for j in (router.get_shortest_path(a, b) for a, b in pairs) if j]
+        hops = sum(parent_hops(j) for j in journeys)
+        transfers = sum(sum(step['type'] == 'transfer' for step in j['steps']) for j in journeys)
+        print(f"Router '{backend}': {len(journeys)} journeys, {hops} trips through a parent node, "
+              f"{transfers / max(len(journeys), 1):.2f} transfer steps/journey")
+
+def bench_pareto(graph, pairs):
+    """Latency of Pareto (time, transfers) routing vs the single-criterion search on the station graph."""
+    print("\n--- Pareto (time vs transfers) vs single-criterion ---")
+    station_graph = graph.station_graph or graph.build_station_graph()
+    # Stations without trains are answered instantly by both and would flatter the percentiles
+    served = station_graph.station_nodes
+    pairs = [(a, b) for a, b in pairs if a in served and b in served]
+    searches = (
+        ("Single", station_graph.shortest_path),
+        ("Pareto", station_graph.pareto_paths),
+    )
+    options = []
+    for name, search in searches:
+        latencies = []
+        for a, b in pairs:
+            start_time = time.perf_counter()
+            result = search(a, b)
+            latencies.append(time.perf_counter() - start_time)
+            if name == "Pareto":
+                options.append(len(result) if result else 0)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        print(f"{name:<8} p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+    found = [n for n in options if n]
+    print(f"{sum(n > 1 for n in found)} of {len(found)} journeys have a slower option with fewer transfers, "
+          f"{sum(found) / max(len(found), 1):.2f} options on average")
+
+def main():
+    loader = GTFSLoader(optimize_memory=True)
+    loader.load_data()
+    graph = TransitGraph(loader, compact=True)
+    router = Router(graph)
+
+    pairs = sample_pairs(loader, NUM_QUERIES)
+    print(f"\n--- Benchmarking {NUM_QUERIES} queries ---")
+    bench_reconstruction(loader, router, pairs)
+    bench_route_cache(graph, pairs)
+    bench_matrix(graph, loader)
+    bench_astar(graph, pairs)
+    bench_contraction(graph, pairs)
+    bench_station_graph(graph, pairs)
+    bench_pareto(graph, pairs)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import argparse
+import time
+from nyc_transit import GTFSLoader, StationLocator, CellTable
+from nyc_transit.cell_table import DEFAULT_K
+from nyc_transit.config import PROCESSED_DATA_DIR
+
+# Precomputes the H3 cell -> nearest stations tables the API serves from /nearby/cell.
+#   python build_cell_table.py --resolutions 9 10 --k 4
+# The API builds a missing table for its own resolution at startup; this is for doing it ahead of time
+# (e.g. in the image build) or for other resolutions.
+
+def main():
+    parser = argparse.ArgumentParser(description="Build H3 cell -> nearest stations tables")
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[9])
+    parser.add_argument("--k", type=int, default=DEFAULT_K, help="Stations stored per cell")
+    parser.add_argument("--out", default=PROCESSED_DATA_DIR)
+    args = parser.parse_args()
+
+    loader = GTFSLoader(optimize_memory=True)
+    loader.load_data()
+    locator = StationLocator(loader)
+
+    for resolution in args.resolutions:
+        start = time.perf_counter()
+        table = CellTable.load_or_build(loader, locator, resolution, args.k, table_dir=args.out)
+        print(f"Resolution {resolution}: {len(table)} cells, {table.slots.nbytes / 1e6:.1f} MB, "
+              f"{time.perf_counter() - start:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
-from nyc_transit import GTFSLoader, TransitGraph, Router, RealTimeHandler
+from nyc_transit import GTFSLoader, TransitGraph, Router, RaptorRouter, RealTimeHandler
 import time
+import datetime
+from nyc_transit.raptor import AGENCY_TIMEZONE
 
 def check_trip():
     print("Loading data...")
@@ -7,7 +9,7 @@ def check_trip():
     loader.load_data()
     graph = TransitGraph(loader)
     router = Router(graph)
-    rt = RealTimeHandler()
+    rt = RealTimeHandler(loader=loader)
     
     start_id = "R21" # 8 St-NYU
     end_id = "R16"   # Times Sq-42 St (N/Q/R/W platform)
@@ -37,7 +39,22 @@ def check_trip():
             # We want Northbound (N) trains usually
             direction_str = "Uptown/Queens" if a['direction'] == 'N' else "Downtown/Brooklyn"
             print(f"  {a['route']} Train ({direction_str}) in {a['minutes_away']} mins")
-            
+
+        # The same trip on the timetable with the live predictions applied
+        raptor = RaptorRouter(loader)
+        rt.update_feeds({feed_id: feed for feed_id in rt.feeds_for_station(start_id) if (feed := rt.get_feed(feed_id))})
+        updated = raptor.apply_realtime(rt.trip_predictions())
+        now = datetime.datetime.now(AGENCY_TIMEZONE).strftime("%H:%M:%S")
+        journey = raptor.get_earliest_arrival(start_id, end_id, now)
+        print(f"\nLeaving now ({now}), with live predictions for {updated} trips:")
+        if journey:
+            print(f"  Arrive {journey['arrival_time']} ({journey['total_time_seconds'] // 60} mins)")
+            for step in journey['steps']:
+                if step['type'] == 'transit':
+                    print(f"  {step['routes']} {step['from']} {step['departure_time']} -> {step['to']} {step['arrival_time']} "
+                          f"(delay {step['delay_seconds']}s)")
+        else:
+            print("  No timetable journey found.")
     else:
         print("No path found.")
 
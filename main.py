@@ -10,7 +10,7 @@ def interactive_mode():
     graph = TransitGraph(loader)
     router = Router(graph)
     searcher = StationSearch(loader)
-    rt_handler = RealTimeHandler()
+    rt_handler = RealTimeHandler(loader=loader)
     print("Ready!")
 
     while True:
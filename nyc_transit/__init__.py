@@ -1,7 +1,13 @@
 from .data_loader import GTFSLoader
 from .graph import TransitGraph
+from .compact import CompactGraph
+from .contraction import ContractionHierarchy
+from .station_graph import StationGraph
 from .router import Router
+from .raptor import RaptorRouter
 from .realtime import RealTimeHandler
 from .search import StationSearch
+from .spatial import StationLocator
+from .cell_table import CellTable
 
-__all__ = ["GTFSLoader", "TransitGraph", "Router", "RealTimeHandler", "StationSearch"]
+__all__ = ["GTFSLoader", "TransitGraph", "CompactGraph", "ContractionHierarchy", "StationGraph", "Router", "RaptorRouter", "RealTimeHandler", "StationSearch", "StationLocator", "CellTable"]
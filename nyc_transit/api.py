@@ -1,16 +1,36 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from .data_loader import GTFSLoader
 from .graph import TransitGraph
 from .router import Router
-from .realtime import RealTimeHandler
+from .raptor import RaptorRouter, AGENCY_TIMEZONE
+from .realtime import RealTimeHandler, FeedPoller, station_of, build_station_feeds
+from .config import RAW_DATA_DIR, PROCESSED_DATA_DIR, GTFS_REALTIME_URLS
 from .search import StationSearch
+from .spatial import StationLocator
+from .cell_table import CellTable
 import os
+import json
+import asyncio
+import concurrent.futures
+import datetime
+import functools
+import gzip
+import hashlib
 
 app = FastAPI(title="NYC Transit API")
 
+# Seconds between keep-alive comments on idle event streams
+STREAM_KEEPALIVE = 15
+
+# Distinct autocomplete queries kept as ready-to-send bytes
+AUTOCOMPLETE_CACHE_SIZE = 4096
+
+# Seconds between checks for a new service day
+SERVICE_DAY_CHECK_INTERVAL = 60
+
 # Add CORS
 app.add_middleware(
     CORSMiddleware,
@@ -28,61 +48,326 @@ app.mount("/static", StaticFiles(directory=static_dir), name="static")
 async def read_index():
     return FileResponse(os.path.join(static_dir, "index.html"))
 
+def accepts_gzip(accept_encoding):
+    """True if an Accept-Encoding header allows gzip (explicitly or through '*') with a nonzero q-value."""
+    allowed = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            allowed[coding.strip().lower()] = q
+    return allowed.get("gzip", allowed.get("*", 0.0)) > 0
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match uses weak comparison: W/"x" matches "x"."""
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+class StaticPayload:
+    """
+    A JSON response that only changes when the GTFS data does: serialized and gzipped once,
+    then served from bytes with an ETag so repeat clients get a 304.
+    The gzipped and plain bodies are different representations, so each has its own ETag.
+    """
+
+    def __init__(self, data):
+        self.body = json.dumps(data, separators=(',', ':')).encode()
+        self.gzipped = gzip.compress(self.body, compresslevel=9)
+        digest = hashlib.sha1(self.body).hexdigest()[:16]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gz"'
+
+    def response(self, request):
+        use_gzip = accepts_gzip(request.headers.get("accept-encoding", ""))
+        etag = self.gzip_etag if use_gzip else self.etag
+        # no-cache: browsers may keep it but must revalidate, which costs a 304
+        headers = {"ETag": etag, "Cache-Control": "public, no-cache", "Vary": "Accept-Encoding"}
+        if etag_matches(request.headers.get("if-none-match", ""), etag):
+            return Response(status_code=304, headers=headers)
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+            return Response(self.gzipped, media_type="application/json", headers=headers)
+        return Response(self.body, media_type="application/json", headers=headers)
+
 # Global instances
-loader = None
-graph = None
-router = None
+service_day = None
 rt_handler = None
-searcher = None
+feed_poller = None
+locator = None
+cell_table = None
+all_stations = None
+service_day_task = None
+# Re-applying predictions copies the timetable arrays, so it runs off the event loop; one
+# worker keeps the updates in order
+realtime_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+def service_today():
+    """The current service date in the agency's timezone, whatever the server's is."""
+    return datetime.datetime.now(AGENCY_TIMEZONE).date()
+
+class ServiceDay:
+    """
+    Everything built from one service day's trips: the loader, graph, routers, station search
+    (ranked by the day's train counts) and the station -> realtime feed map.
+    Stops don't change from day to day, so the nearby lookups, cell table and station list
+    are built once at startup instead.
+    """
+
+    def __init__(self, service_date, data_dir=RAW_DATA_DIR, cache_dir=PROCESSED_DATA_DIR, feed_urls=GTFS_REALTIME_URLS):
+        # Workers only need the columns the graph and router use
+        self.loader = GTFSLoader(data_dir, snapshot_dir=cache_dir, optimize_memory=True, service_date=service_date)
+        self.loader.load_data()
+        self.graph = TransitGraph(self.loader, compact=True, stations=True)
+        self.graph.build_contraction(cache_dir)
+        self.router = Router(self.graph)
+        self.raptor = RaptorRouter(self.loader)
+        self.searcher = StationSearch(self.loader)
+        self.station_feeds = build_station_feeds(self.loader, feed_urls)
+
+async def watch_service_day():
+    """
+    Reloads the timetable once the service day rolls over, so a worker started on a Friday
+    doesn't keep serving Friday's trips on Saturday.
+    """
+    while True:
+        await asyncio.sleep(SERVICE_DAY_CHECK_INTERVAL)
+        today = service_today()
+        if today != service_day.loader.service_date:
+            await roll_over(today)
+
+async def roll_over(service_date):
+    """
+    Builds service_date's ServiceDay from the same files off the event loop, then swaps it in
+    whole. Requests use the old day until the new one is ready. Returns False if the build failed.
+    """
+    global service_day
+    print(f"Service day rolled over to {service_date}, reloading the timetable...")
+    current = service_day.loader
+    try:
+        day = await asyncio.to_thread(ServiceDay, service_date, current.data_dir, current.snapshot_dir, rt_handler.urls)
+    except Exception as e:
+        print(f"Reloading the timetable failed: {e!r}")
+        return False
+    service_day = day
+    rt_handler.station_feeds = day.station_feeds
+    autocomplete_payload.cache_clear()
+    apply_live_predictions(rt_handler, [])
+    return True
+
+def apply_live_predictions(handler, deltas):
+    """Feed listener: queues the current predictions for the current day's timetable."""
+    predictions = handler.trip_predictions()
+
+    def apply():
+        try:
+            service_day.raptor.apply_realtime(predictions)
+        except Exception as e:
+            print(f"Applying live predictions failed: {e!r}")
+
+    realtime_executor.submit(apply)
 
 @app.on_event("startup")
 async def startup_event():
-    global loader, graph, router, rt_handler, searcher
+    global service_day, rt_handler, feed_poller, locator, cell_table, all_stations, service_day_task
     print("Initializing NYC Transit API...")
-    loader = GTFSLoader()
     # Check if data exists, if not download (or use local)
     # In this env, we expect data to be present or config handles it
-    loader.load_data()
-    
-    graph = TransitGraph(loader)
-    router = Router(graph)
+    service_day = ServiceDay(service_today())
+    loader = service_day.loader
     rt_handler = RealTimeHandler()
-    searcher = StationSearch(loader)
+    rt_handler.station_feeds = service_day.station_feeds
+    # Every poll that changes a feed re-applies the live predictions to the timetable
+    rt_handler.add_listener(apply_live_predictions)
+    # One background fetch per feed per cache_ttl, however many requests come in
+    feed_poller = FeedPoller(rt_handler)
+    await feed_poller.start()
+    service_day_task = asyncio.create_task(watch_service_day())
+    locator = StationLocator(loader)
+    # Built once per GTFS version, then memory-mapped by every worker
+    cell_table = CellTable.load_or_build(loader, locator)
+    all_stations = StaticPayload(build_all_stations(loader))
     print("Initialization complete.")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if service_day_task:
+        service_day_task.cancel()
+    if feed_poller:
+        await feed_poller.stop()
+    if rt_handler:
+        await rt_handler.aclose()
+    realtime_executor.shutdown(wait=False, cancel_futures=True)
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to NYC Transit API"}
 
 @app.get("/stations")
 def search_stations(q: str = Query(..., min_length=2)):
-    results = searcher.search(q)
+    results = service_day.searcher.search(q)
     return {"results": results}
 
-@app.get("/all_stations")
-def get_all_stations():
-    """Returns a list of all parent stations for dropdowns."""
-    if not loader or loader.parent_stations is None:
+@functools.lru_cache(maxsize=AUTOCOMPLETE_CACHE_SIZE)
+def autocomplete_payload(searcher, query, limit):
+    # Keyed by the day's searcher too, so a request racing a rollover can't cache the old day
+    return json.dumps(searcher.autocomplete(query, limit), separators=(',', ':')).encode()
+
+@app.get("/autocomplete")
+def autocomplete(q: str = Query(..., min_length=1, max_length=64), limit: int = Query(8, ge=1, le=20)):
+    """
+    Stations whose name, or a word in it, starts with q, as compact [id, name] pairs.
+    Rankings follow the service day's train counts, so browsers may cache answers for an hour.
+    """
+    body = autocomplete_payload(service_day.searcher, q.strip().lower(), limit)
+    return Response(body, media_type="application/json", headers={"Cache-Control": "public, max-age=3600"})
+
+def build_all_stations(loader):
+    """All parent stations for dropdowns, sorted by name. Rebuild whenever the loader's data changes."""
+    if loader.parent_stations is None:
         return {"stations": []}
-    
+
     stations = []
-    for _, row in loader.parent_stations.iterrows():
+    for stop_id in loader.parent_stations['stop_id']:
         stations.append({
-            "id": str(row['stop_id']),
-            "name": row['stop_name']
+            "id": str(stop_id),
+            "name": loader.get_station_name(stop_id)
         })
     # Sort by name
     stations.sort(key=lambda x: x['name'])
     return {"stations": stations}
 
+@app.get("/all_stations")
+def get_all_stations(request: Request):
+    """Returns a list of all parent stations for dropdowns."""
+    if all_stations is None:
+        return {"stations": []}
+    return all_stations.response(request)
+
+@app.get("/nearby")
+def get_nearby(lat: float, lon: float, k: int = Query(5, ge=1, le=50), radius: float = Query(None, gt=0)):
+    """
+    Nearest stations to a point by great-circle distance.
+    With radius (meters), returns the stations within it (at most k), closest first.
+    """
+    if radius is not None:
+        stations = locator.within(lat, lon, radius)[:k]
+    else:
+        stations = locator.nearest(lat, lon, k)
+    return {"stations": stations}
+
+@app.get("/nearby/cell")
+def get_nearby_cell(lat: float, lon: float, response: Response):
+    """
+    Precomputed nearest stations for the H3 cell containing a point (distances from the cell's center).
+    Every point in a cell gets the same answer, so clients and proxies can cache it by cell.
+    """
+    cell, stations = cell_table.lookup(lat, lon)
+    if stations is None:
+        raise HTTPException(status_code=404, detail="Point is outside the service area")
+    response.headers["Cache-Control"] = "public, max-age=3600"
+    return {"cell": cell, "resolution": cell_table.resolution, "stations": stations}
+
 @app.get("/route")
-def get_route(start: str, end: str):
-    path = router.get_shortest_path(start, end)
+def get_route(start: str, end: str, depart: str = None, live: bool = True):
+    """
+    Without depart, returns the static average-time route.
+    With depart ("HH:MM" or "HH:MM:SS"), returns the earliest-arrival timetable journey,
+    including live delays and cancellations from the feeds unless live=false.
+    """
+    if depart:
+        try:
+            path = service_day.raptor.get_earliest_arrival(start, end, depart, live=live)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="depart must be HH:MM or HH:MM:SS")
+    else:
+        path = service_day.router.get_shortest_path(start, end)
     if not path:
         raise HTTPException(status_code=404, detail="No path found")
     return path
 
+@app.get("/route/options")
+def get_route_options(start: str, end: str, max_transfers: int = Query(4, ge=0, le=6),
+                      max_transfer_minutes: float = Query(None, gt=0)):
+    """
+    Static routes trading time against transfers: the fastest first, then slower ones with
+    fewer transfers. max_transfer_minutes leaves out longer walks between stations.
+    """
+    max_transfer_time = max_transfer_minutes * 60 if max_transfer_minutes is not None else None
+    options = service_day.router.get_pareto_paths(start, end, max_transfers=max_transfers, max_transfer_time=max_transfer_time)
+    if not options:
+        raise HTTPException(status_code=404, detail="No path found")
+    return {"options": options}
+
+@app.get("/stats")
+def get_stats():
+    """Route cache counters, for checking hit rates in production."""
+    cache = service_day.router.cache
+    return {"route_cache": cache.stats() if cache else None}
+
+@app.get("/travel_times/{station_id}")
+def get_travel_times(station_id: str, max_minutes: float = Query(None, gt=0)):
+    """
+    Static travel time from a station to every reachable station (an isochrone), fastest first.
+    One cached single-source search answers the whole list.
+    """
+    day = service_day
+    loader = day.loader
+    station_ids = [str(stop_id) for stop_id in loader.parent_stations['stop_id']]
+    times = day.router.travel_times(station_id, station_ids)
+    if times is None:
+        raise HTTPException(status_code=404, detail="Unknown station")
+    stations = [
+        {"id": stop_id, "name": loader.get_station_name(stop_id), "seconds": seconds}
+        for stop_id, seconds in sorted(times.items(), key=lambda item: item[1])
+        if max_minutes is None or seconds <= max_minutes * 60
+    ]
+    return {"station_id": station_id, "stations": stations}
+
 @app.get("/arrivals/{station_id}")
-def get_arrivals(station_id: str):
-    arrivals = rt_handler.get_arrivals(station_id)
+async def get_arrivals(station_id: str):
+    arrivals = await rt_handler.get_arrivals_async(station_id)
     return {"station_id": station_id, "arrivals": arrivals}
+
+@app.get("/stream/arrivals")
+async def stream_arrivals(request: Request, stations: str = Query(..., min_length=1)):
+    """
+    Server-sent events for live arrivals at one or more comma-separated stations.
+    Sends the current arrivals for each station first, then a new event for a station
+    only when a feed poll changes its arrivals. All streams share the one FeedPoller.
+    """
+    station_ids = [station_id.strip() for station_id in stations.split(',') if station_id.strip()]
+    watched = {station_of(station_id) for station_id in station_ids}
+
+    def event(station_id):
+        payload = {"station_id": station_id, "arrivals": rt_handler.lookup_arrivals(station_id)}
+        return f"event: arrivals\ndata: {json.dumps(payload)}\n\n"
+
+    async def events():
+        queue = rt_handler.ingestor.subscribe()
+        try:
+            if rt_handler.arrivals_index is not None:
+                for station_id in station_ids:
+                    yield event(station_id)
+            while not await request.is_disconnected():
+                try:
+                    delta = await asyncio.wait_for(queue.get(), timeout=STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                changed = watched & delta.stations
+                for station_id in station_ids:
+                    if station_of(station_id) in changed:
+                        yield event(station_id)
+        finally:
+            rt_handler.ingestor.unsubscribe(queue)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
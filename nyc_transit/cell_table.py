@@ -0,0 +1,180 @@
+import os
+import json
+import numpy as np
+import h3
+from .config import PROCESSED_DATA_DIR
+from .data_loader import prune_artifacts
+from .spatial import H3_RESOLUTION, latlng_to_cell, cell_center
+
+# Bump when the artifact layout changes so old files are rebuilt instead of misread
+TABLE_VERSION = 1
+
+# Stations stored per cell
+DEFAULT_K = 4
+
+# Degrees added around the stations' bounding box (~2km) so riders just outside it still hit
+BOUNDS_PADDING = 0.02
+
+# At most half the slots are used, so a lookup almost always needs a single probe
+LOAD_FACTOR = 0.5
+
+# Fibonacci hashing; the low bits of H3 ids at one resolution are constant, so they can't be used directly
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+MASK_64 = (1 << 64) - 1
+
+def cell_to_int(cell):
+    # h3.string_to_h3 is the old (v3) name of str_to_int
+    try:
+        return h3.str_to_int(cell)
+    except AttributeError:
+        return h3.string_to_h3(cell)
+
+def cells_in_bounds(lat_min, lat_max, lon_min, lon_max, res):
+    """All H3 cells whose centers fall inside a lat/lon box."""
+    corners = [(lat_min, lon_min), (lat_min, lon_max), (lat_max, lon_max), (lat_max, lon_min)]
+    try:
+        return list(h3.polygon_to_cells(h3.LatLngPoly(corners), res))
+    except AttributeError:
+        geojson = {'type': 'Polygon', 'coordinates': [[[lon, lat] for lat, lon in corners + corners[:1]]]}
+        return list(h3.polyfill(geojson, res, geo_json_conformant=True))
+
+def slot_dtype(k):
+    # cell 0 marks an empty slot; it is never a valid H3 index
+    return np.dtype([('cell', '<u8'), ('stations', '<i2', (k,)), ('distances', '<f4', (k,))])
+
+class CellTable:
+    """
+    Precomputed H3 cell -> k nearest stations, as an open-addressing hash table.
+    Stations and distances are exact for the cell's center, so a lookup is a hash probe
+    with no distance math. The table is a plain .npy file (memory-mapped on load, so every
+    API worker shares one copy through the page cache) with a small .json sidecar holding
+    the resolution, k and the stations the table entries index into.
+    """
+
+    def __init__(self, slots, meta):
+        self.slots = slots
+        self.meta = meta
+        self.resolution = meta['resolution']
+        self.k = meta['k']
+        self.stations = meta['stations']
+        self._shift = 64 - int(np.log2(len(slots)))
+        self._mask = len(slots) - 1
+
+    def __len__(self):
+        return self.meta['cells']
+
+    @classmethod
+    def build(cls, locator, resolution=H3_RESOLUTION, k=DEFAULT_K, bounds=None, fingerprint=None):
+        """
+        Covers bounds (lat_min, lat_max, lon_min, lon_max), by default the stations' bounding box
+        plus BOUNDS_PADDING, and stores the exact k nearest stations for each cell center.
+        """
+        k = min(k, len(locator))
+        if bounds is None:
+            bounds = (
+                locator.lats.min() - BOUNDS_PADDING, locator.lats.max() + BOUNDS_PADDING,
+                locator.lons.min() - BOUNDS_PADDING, locator.lons.max() + BOUNDS_PADDING,
+            )
+        cells = cells_in_bounds(*map(float, bounds), resolution)
+        centers = np.array([cell_center(cell) for cell in cells])
+        distances, indices = locator.nearest_batch(centers[:, 0], centers[:, 1], k)
+
+        # Smallest power of two that keeps the load factor
+        bits = max(1, int(np.ceil(np.log2(len(cells) / LOAD_FACTOR))))
+        slots = np.zeros(1 << bits, dtype=slot_dtype(k))
+        shift, mask = 64 - bits, (1 << bits) - 1
+        for cell, row_stations, row_distances in zip(cells, indices, distances):
+            key = cell_to_int(cell)
+            slot = ((key * HASH_MULTIPLIER) & MASK_64) >> shift
+            while slots['cell'][slot]:
+                slot = (slot + 1) & mask # Linear probing
+            slots[slot] = (key, row_stations, row_distances)
+
+        meta = {
+            'version': TABLE_VERSION,
+            'resolution': resolution,
+            'k': k,
+            'cells': len(cells),
+            'bounds': [float(b) for b in bounds],
+            'fingerprint': fingerprint,
+            'stations': [
+                {'id': str(locator.station_ids[i]), 'name': str(locator.names[i]),
+                 'lat': float(locator.lats[i]), 'lon': float(locator.lons[i])}
+                for i in range(len(locator))
+            ],
+        }
+        return cls(slots, meta)
+
+    def save(self, path):
+        """Writes path.npy and path.json, each through a temp file so readers never see a partial artifact."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f".{os.getpid()}.tmp"
+        with open(f"{path}.npy{tmp}", 'wb') as f:
+            np.save(f, np.asarray(self.slots))
+        with open(f"{path}.json{tmp}", 'w') as f:
+            json.dump(self.meta, f)
+        # Table first: a sidecar only ever appears next to its finished table
+        os.replace(f"{path}.npy{tmp}", f"{path}.npy")
+        os.replace(f"{path}.json{tmp}", f"{path}.json")
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Opens an artifact written by save(). Returns None if it is missing, unreadable or from an older version."""
+        if not os.path.exists(f"{path}.json"):
+            return None
+        try:
+            with open(f"{path}.json") as f:
+                meta = json.load(f)
+            if meta.get('version') != TABLE_VERSION:
+                return None
+            slots = np.load(f"{path}.npy", mmap_mode='r' if mmap else None)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable cell table {path}: {e}")
+            return None
+        return cls(slots, meta)
+
+    @classmethod
+    def load_or_build(cls, loader, locator, resolution=H3_RESOLUTION, k=DEFAULT_K, table_dir=PROCESSED_DATA_DIR):
+        """
+        Loads the table for the loader's current GTFS files, building and saving it first if needed.
+        Only the most recent tables for other GTFS files (or loader settings) at the same resolution and k are kept.
+        """
+        fingerprint = loader.source_fingerprint()
+        prefix = f"h3_r{resolution}_k{k}_"
+        path = os.path.join(table_dir, prefix + fingerprint)
+        table = cls.load(path)
+        if table is not None:
+            return table
+
+        table = cls.build(locator, resolution, k, fingerprint=fingerprint)
+        try:
+            table.save(path)
+        except OSError as e:
+            print(f"Could not write cell table: {e}")
+            return table
+
+        prune_artifacts(table_dir, prefix, fingerprint)
+        print(f"Wrote H3 cell table ({len(table)} cells at resolution {resolution}) to {path}.npy")
+        return table
+
+    def lookup_cell(self, cell):
+        """Precomputed stations for an H3 cell at this table's resolution, or None if it is outside the table."""
+        key = cell_to_int(cell)
+        slot = ((key * HASH_MULTIPLIER) & MASK_64) >> self._shift
+        cells = self.slots['cell']
+        while True:
+            found = int(cells[slot])
+            if found == key:
+                entry = self.slots[slot]
+                return [
+                    dict(self.stations[i], distance_m=round(float(d), 1))
+                    for i, d in zip(entry['stations'].tolist(), entry['distances'].tolist())
+                ]
+            if found == 0:
+                return None
+            slot = (slot + 1) & self._mask
+
+    def lookup(self, lat, lon):
+        """(cell, stations) for a point; stations is None outside the table's bounds."""
+        cell = latlng_to_cell(lat, lon, self.resolution)
+        return cell, self.lookup_cell(cell)
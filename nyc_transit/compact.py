@@ -0,0 +1,328 @@
+import heapq
+import numpy as np
+from .spatial import haversine
+
+# Edge types are stored as small ints; this maps them back to the names used by TransitGraph.
+EDGE_TYPES = ('transit', 'transfer', 'parent_child', 'child_parent', 'unknown')
+
+INF = float('inf')
+
+# Headroom on the A* speed bound so float rounding can't make the heuristic overestimate
+SPEED_MARGIN = 1.0 + 1e-9
+
+class CompactGraph:
+    """
+    Array-backed copy of the transit graph.
+    Nodes are integers 0..n-1 (node_ids maps them back to stop ids) and the
+    adjacency is stored in CSR form: the edges leaving node i are
+    offsets[i]:offsets[i+1] in targets/weights/edge_types/route_bits.
+    route_bits holds one bitset per edge over route_ids.
+    """
+
+    def __init__(self, node_ids, lat, lon, offsets, targets, weights, edge_types, route_bits, route_ids):
+        self.node_ids = node_ids
+        self.lat = lat
+        self.lon = lon
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.edge_types = edge_types
+        self.route_bits = route_bits
+        self.route_ids = route_ids
+        self.node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+
+        # Plain lists are much faster than numpy scalars in the Python search loop
+        self._offsets = offsets.tolist()
+        self._targets = targets.tolist()
+        self._weights = weights.tolist()
+        # Source node of every edge, for walking predecessor edges back
+        sources = np.repeat(np.arange(len(node_ids), dtype=np.int32), np.diff(offsets))
+        self._sources = sources.tolist()
+        # Reverse adjacency (edges grouped by target) for the backward half of the search
+        by_target = np.argsort(targets, kind='stable')
+        self._rev_offsets = np.concatenate(([0], np.cumsum(np.bincount(targets, minlength=len(node_ids))))).tolist()
+        self._rev_edges = by_target.tolist()
+        self._max_speed = None
+        self._head_start = None
+
+    @classmethod
+    def from_networkx(cls, graph):
+        """Builds a CompactGraph from the nx.DiGraph produced by TransitGraph."""
+        node_ids = list(graph.nodes)
+        index = {node_id: i for i, node_id in enumerate(node_ids)}
+
+        route_ids = sorted({r for _, _, routes in graph.edges(data='routes') if routes for r in routes}, key=str)
+        route_bit = {r: i for i, r in enumerate(route_ids)}
+        n_words = max(1, (len(route_ids) + 63) // 64)
+        type_codes = {name: i for i, name in enumerate(EDGE_TYPES)}
+
+        offsets = np.zeros(len(node_ids) + 1, dtype=np.int32)
+        targets = np.empty(graph.number_of_edges(), dtype=np.int32)
+        weights = np.empty(graph.number_of_edges(), dtype=np.float64)
+        edge_types = np.empty(graph.number_of_edges(), dtype=np.int8)
+        route_bits = np.zeros((graph.number_of_edges(), n_words), dtype=np.uint64)
+
+        e = 0
+        for i, u in enumerate(node_ids):
+            for v, data in graph[u].items():
+                targets[e] = index[v]
+                weights[e] = data['weight']
+                edge_types[e] = type_codes.get(data.get('type', 'unknown'), type_codes['unknown'])
+                for r in data.get('routes', ()):
+                    bit = route_bit[r]
+                    route_bits[e, bit // 64] |= np.uint64(1 << (bit % 64))
+                e += 1
+            offsets[i + 1] = e
+
+        lat = np.array([graph.nodes[n].get('lat', np.nan) for n in node_ids], dtype=np.float64)
+        lon = np.array([graph.nodes[n].get('lon', np.nan) for n in node_ids], dtype=np.float64)
+        return cls(np.array(node_ids, dtype=object), lat, lon, offsets, targets, weights, edge_types, route_bits, route_ids)
+
+    def number_of_nodes(self):
+        return len(self.node_ids)
+
+    def number_of_edges(self):
+        return len(self.targets)
+
+    def nbytes(self):
+        """Approximate memory held by the graph arrays (excluding the id lookup dict)."""
+        return sum(a.nbytes for a in (self.lat, self.lon, self.offsets, self.targets,
+                                      self.weights, self.edge_types, self.route_bits))
+
+    def edge_type(self, edge):
+        return EDGE_TYPES[self.edge_types[edge]]
+
+    def edge_routes(self, edge):
+        """Decodes the route bitset of an edge into a list of route ids."""
+        routes = []
+        for word_index, word in enumerate(self.route_bits[edge].tolist()):
+            while word:
+                low = word & -word
+                routes.append(self.route_ids[word_index * 64 + low.bit_length() - 1])
+                word ^= low
+        return routes
+
+    def max_speed(self):
+        """
+        Fastest straight-line speed (meters per second) of a timed transit edge, the A* heuristic's bound.
+        0 if it can't bound the graph (a node without coordinates, or no timed transit edge).
+        """
+        if self._max_speed is None:
+            self._max_speed, self._head_start = self._heuristic_bounds()
+        return self._max_speed
+
+    def head_start(self):
+        """
+        Seconds that edges faster than max_speed() (walks and free transfers, which aren't
+        vehicles) can save on a journey in total: the A* heuristic subtracts it.
+        """
+        if self._max_speed is None:
+            self._max_speed, self._head_start = self._heuristic_bounds()
+        return self._head_start
+
+    def _heuristic_bounds(self):
+        if np.isnan(self.lat).any() or np.isnan(self.lon).any():
+            print("A* heuristic disabled: some stops have no coordinates")
+            return 0.0, 0.0
+        sources = np.array(self._sources, dtype=np.int64)
+        distances = haversine(self.lat[sources], self.lon[sources], self.lat[self.targets], self.lon[self.targets])
+        timed = self.weights > 0
+        transit = timed & (self.edge_types == EDGE_TYPES.index('transit'))
+        speed = float((distances[transit] / self.weights[transit]).max(initial=0.0)) * SPEED_MARGIN
+        if speed <= 0:
+            print("A* heuristic disabled: no timed transit edges to bound the speed")
+            return 0.0, 0.0
+        # A walk or free transfer beating the trains covers its ground up to this much sooner.
+        # A shortest path uses each edge at most once, so their sum is a safe total.
+        saved = np.maximum(distances / speed - np.maximum(self.weights, 0.0), 0.0)
+        saved[transit] = 0.0
+        head_start = float(saved.sum()) * SPEED_MARGIN
+        span = haversine(self.lat.min(), self.lon.min(), self.lat.max(), self.lon.max()) / speed
+        if head_start >= span:
+            print(f"A* heuristic is no better than Dijkstra: fast transfers save {head_start:.0f} s, more than crossing the network takes")
+        return speed, head_start
+
+    def astar_path(self, source, target, stats=None):
+        """
+        A* from source to target (both integer node ids). The heuristic is the great-circle distance
+        to target divided by max_speed(), less head_start(): no train covers ground faster and the
+        faster walks can't save more, so it never overestimates and the path is as short as Dijkstra's. Returns edge indices like shortest_path().
+        stats, if given, gets the number of 'settled' nodes.
+        """
+        if source == target:
+            if stats is not None:
+                stats['settled'] = 0
+            return []
+
+        offsets, targets, weights = self._offsets, self._targets, self._weights
+        n = len(offsets) - 1
+        speed = self.max_speed()
+        if speed > 0:
+            h = haversine(self.lat, self.lon, self.lat[target], self.lon[target]) / speed
+            h = np.maximum(h - self.head_start(), 0.0).tolist()
+        else:
+            h = [0.0] * n # Plain Dijkstra
+        dist = [INF] * n
+        dist[source] = 0.0
+        pred = {}
+        heap = [(h[source], source)]
+        settled = 0
+
+        while heap:
+            f, u = heapq.heappop(heap)
+            d = dist[u]
+            if f > d + h[u]:
+                continue # Stale heap entry
+            settled += 1
+            if u == target:
+                break
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                nd = d + weights[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = e
+                    heapq.heappush(heap, (nd + h[v], v))
+
+        if stats is not None:
+            stats['settled'] = settled
+        if dist[target] == INF:
+            return None
+        return self._unwind(pred, target)
+
+    def shortest_path(self, source, target, stats=None):
+        """
+        Bidirectional Dijkstra from source to target (both integer node ids).
+        Returns the list of edge indices along the path, or None if target is unreachable.
+        stats, if given, gets the number of 'settled' nodes (both directions).
+        """
+        if source == target:
+            if stats is not None:
+                stats['settled'] = 0
+            return []
+        return self.shortest_path_multi({source: 0.0}, {target: 0.0}, stats)
+
+    def shortest_path_multi(self, sources, targets, stats=None):
+        """
+        Bidirectional Dijkstra from any of sources to any of targets, both {node: starting cost}.
+        Returns the edge indices of the cheapest path including those costs (the first edge leaves
+        the source used, the last reaches the target used), or None if no target is reachable.
+        """
+        offsets, edge_targets, weights = self._offsets, self._targets, self._weights
+        rev_offsets, rev_edges, edge_sources = self._rev_offsets, self._rev_edges, self._sources
+        n = len(offsets) - 1
+        dist_f = [INF] * n
+        dist_b = [INF] * n
+        for node, cost in sources.items():
+            dist_f[node] = cost
+        for node, cost in targets.items():
+            dist_b[node] = cost
+        pred_f = {} # node -> edge used to reach it from source
+        succ_b = {} # node -> edge used to reach target from it
+        heap_f = [(cost, node) for node, cost in sources.items()]
+        heap_b = [(cost, node) for node, cost in targets.items()]
+        heapq.heapify(heap_f)
+        heapq.heapify(heap_b)
+        best = INF
+        meeting = None
+        for node in sources.keys() & targets.keys():
+            if dist_f[node] + dist_b[node] < best:
+                best = dist_f[node] + dist_b[node]
+                meeting = node
+        settled = 0
+
+        while heap_f and heap_b:
+            # Stop once no path through an unsettled node can beat the best one found
+            if heap_f[0][0] + heap_b[0][0] >= best:
+                break
+
+            if heap_f[0][0] <= heap_b[0][0]:
+                d, u = heapq.heappop(heap_f)
+                if d > dist_f[u]:
+                    continue # Stale heap entry
+                settled += 1
+                for e in range(offsets[u], offsets[u + 1]):
+                    v = edge_targets[e]
+                    nd = d + weights[e]
+                    if nd < dist_f[v]:
+                        dist_f[v] = nd
+                        pred_f[v] = e
+                        heapq.heappush(heap_f, (nd, v))
+                    if nd + dist_b[v] < best:
+                        best = nd + dist_b[v]
+                        meeting = v
+            else:
+                d, u = heapq.heappop(heap_b)
+                if d > dist_b[u]:
+                    continue
+                settled += 1
+                for i in range(rev_offsets[u], rev_offsets[u + 1]):
+                    e = rev_edges[i]
+                    v = edge_sources[e]
+                    nd = d + weights[e]
+                    if nd < dist_b[v]:
+                        dist_b[v] = nd
+                        succ_b[v] = e
+                        heapq.heappush(heap_b, (nd, v))
+                    if nd + dist_f[v] < best:
+                        best = nd + dist_f[v]
+                        meeting = v
+
+        if stats is not None:
+            stats['settled'] = settled
+        if meeting is None:
+            return None
+
+        # Nodes reached at their starting cost have no predecessor/successor: the ends of the path
+        path = self._unwind(pred_f, meeting)
+        node = meeting
+        while node in succ_b:
+            e = succ_b[node]
+            path.append(e)
+            node = edge_targets[e]
+        return path
+
+    def shortest_path_tree(self, source):
+        """
+        Dijkstra from source (an integer node id) to every node.
+        Returns (distances, pred_edges): per node, the travel time from source (INF if unreachable)
+        and the edge used to reach it on a shortest path (-1 for source and unreachable nodes).
+        """
+        return self.shortest_path_tree_multi({source: 0.0})
+
+    def shortest_path_tree_multi(self, sources):
+        """shortest_path_tree() from several sources at once, given as {node: starting cost}."""
+        offsets, targets, weights = self._offsets, self._targets, self._weights
+        n = len(offsets) - 1
+        dist = [INF] * n
+        pred = [-1] * n
+        for node, cost in sources.items():
+            dist[node] = cost
+        heap = [(cost, node) for node, cost in sources.items()]
+        heapq.heapify(heap)
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue # Stale heap entry
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                nd = d + weights[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = e
+                    heapq.heappush(heap, (nd, v))
+        return dist, pred
+
+    def _unwind(self, pred_edge, target):
+        """Follows predecessor edges back from target and returns them in travel order."""
+        edges = []
+        node = target
+        while node in pred_edge:
+            e = pred_edge[node]
+            edges.append(e)
+            node = self._sources[e]
+        edges.reverse()
+        return edges
+
+    def edge_source(self, edge):
+        return self._sources[edge]
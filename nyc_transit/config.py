@@ -16,6 +16,16 @@ GTFS_REALTIME_URLS = {
     'SIR': "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-si"
 }
 
+# Most routes are served by the feed whose key contains the route's first character
+# (e.g. 'A' -> 'ACE', '6X' -> '1234567'). These are the exceptions.
+ROUTE_FEED_OVERRIDES = {
+    'GS': '1234567', # 42 St Shuttle
+    'FS': 'ACE',     # Franklin Av Shuttle
+    'H': 'ACE',      # Rockaway Park Shuttle
+    'SI': 'SIR',
+    'SS': 'SIR',
+}
+
 # Local Data Paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Use the provided local GTFS directory
@@ -0,0 +1,332 @@
+import os
+import time
+import heapq
+import hashlib
+import numpy as np
+from .config import PROCESSED_DATA_DIR
+from .compact import INF
+from .data_loader import prune_artifacts
+
+# Bump when the saved layout changes so old files are rebuilt instead of misread
+CH_VERSION = 1
+
+# Nodes a witness search may settle before giving up and keeping the shortcut (always safe)
+WITNESS_SETTLE_LIMIT = 200
+
+def graph_fingerprint(compact):
+    """Hash of a CompactGraph's structure and weights; a saved hierarchy is only valid for that exact graph."""
+    h = hashlib.sha1(f"v{CH_VERSION};".encode())
+    for array in (compact.offsets, compact.targets, compact.weights):
+        h.update(np.ascontiguousarray(array).tobytes())
+    return h.hexdigest()[:16]
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy over a CompactGraph.
+    Nodes are contracted one at a time (least important first); whenever removing a node would
+    lengthen a shortest path between two of its neighbors, a shortcut edge replaces it. A query
+    is then a bidirectional Dijkstra that only ever climbs to more important nodes, which
+    settles a few dozen nodes instead of a large part of the city.
+
+    Edges (original and shortcut) live in flat arrays: edge_src/edge_dst/edge_weight, plus
+    edge_orig (the CompactGraph edge, or -1 for a shortcut) and edge_children (the two edges a
+    shortcut stands for), so paths unpack back into CompactGraph edges.
+    """
+
+    def __init__(self, rank, edge_src, edge_dst, edge_weight, edge_orig, edge_children, fingerprint=None):
+        self.rank = rank
+        self.edge_src = edge_src
+        self.edge_dst = edge_dst
+        self.edge_weight = edge_weight
+        self.edge_orig = edge_orig
+        self.edge_children = edge_children
+        self.fingerprint = fingerprint
+
+        n = len(rank)
+        up = rank[edge_dst] > rank[edge_src]
+        # Forward search: edges towards more important nodes, grouped by source
+        up_edges = np.flatnonzero(up)
+        up_edges = up_edges[np.argsort(edge_src[up_edges], kind='stable')]
+        self._up_offsets = np.concatenate(([0], np.cumsum(np.bincount(edge_src[up_edges], minlength=n)))).tolist()
+        self._up_edges = up_edges.tolist()
+        # Backward search: edges coming from more important nodes, grouped by target
+        down_edges = np.flatnonzero(~up)
+        down_edges = down_edges[np.argsort(edge_dst[down_edges], kind='stable')]
+        self._down_offsets = np.concatenate(([0], np.cumsum(np.bincount(edge_dst[down_edges], minlength=n)))).tolist()
+        self._down_edges = down_edges.tolist()
+
+        # Plain lists for the Python search loop
+        self._src = edge_src.tolist()
+        self._dst = edge_dst.tolist()
+        self._weight = edge_weight.tolist()
+        self._orig = edge_orig.tolist()
+        self._children = edge_children.tolist()
+
+    def number_of_shortcuts(self):
+        return int((self.edge_orig < 0).sum())
+
+    @classmethod
+    def build(cls, compact):
+        """Contracts every node of a CompactGraph, ordered by edge difference, contracted neighbors and depth."""
+        start = time.perf_counter()
+        n = compact.number_of_nodes()
+        sources = compact._sources
+        targets = compact._targets
+        weights = compact._weights
+
+        # Edge arrays grow as shortcuts are added; out_edges/in_edges index them for uncontracted nodes
+        edge_src, edge_dst, edge_weight, edge_orig, edge_children = [], [], [], [], []
+        out_edges = [{} for _ in range(n)] # u -> {v: edge}
+        in_edges = [{} for _ in range(n)]  # v -> {u: edge}
+        for e in range(compact.number_of_edges()):
+            u, v = sources[e], targets[e]
+            if u == v:
+                continue
+            edge_src.append(u)
+            edge_dst.append(v)
+            edge_weight.append(weights[e])
+            edge_orig.append(e)
+            edge_children.append((-1, -1))
+            out_edges[u][v] = len(edge_src) - 1
+            in_edges[v][u] = len(edge_src) - 1
+
+        contracted = [False] * n
+        contracted_neighbors = [0] * n
+        # Hierarchy depth below each node; keeps contraction spread evenly over the graph
+        level = [0] * n
+
+        def witness(u, excluded, limit):
+            """Distances from u within limit over uncontracted nodes, avoiding excluded."""
+            dist = {u: 0.0}
+            heap = [(0.0, u)]
+            settled = 0
+            while heap and settled < WITNESS_SETTLE_LIMIT:
+                d, x = heapq.heappop(heap)
+                if d > limit:
+                    break
+                if d > dist[x]:
+                    continue # Stale heap entry
+                settled += 1
+                for y, edge in out_edges[x].items():
+                    if y == excluded or contracted[y]:
+                        continue
+                    nd = d + edge_weight[edge]
+                    if nd < dist.get(y, INF):
+                        dist[y] = nd
+                        heapq.heappush(heap, (nd, y))
+            return dist
+
+        def shortcuts_for(x):
+            """(u, v, weight, in edge, out edge) shortcuts needed if x were contracted now."""
+            needed = []
+            outgoing = [(v, edge) for v, edge in out_edges[x].items() if not contracted[v]]
+            if not outgoing:
+                return needed
+            max_out = max(edge_weight[edge] for _, edge in outgoing)
+            for u, in_edge in in_edges[x].items():
+                if contracted[u]:
+                    continue
+                through = edge_weight[in_edge]
+                dist = witness(u, x, through + max_out)
+                for v, out_edge in outgoing:
+                    if v == u:
+                        continue
+                    if through + edge_weight[out_edge] < dist.get(v, INF):
+                        needed.append((u, v, through + edge_weight[out_edge], in_edge, out_edge))
+            return needed
+
+        def priority(x):
+            removed = sum(1 for v in out_edges[x] if not contracted[v]) + sum(1 for u in in_edges[x] if not contracted[u])
+            return 2 * (len(shortcuts_for(x)) - removed) + contracted_neighbors[x] + level[x]
+
+        heap = [(priority(x), x) for x in range(n)]
+        heapq.heapify(heap)
+        rank = np.empty(n, dtype=np.int32)
+        order = 0
+        while heap:
+            _, x = heapq.heappop(heap)
+            # Lazy update: priorities go stale as neighbors are contracted
+            current = priority(x)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, x))
+                continue
+
+            for u, v, weight, in_edge, out_edge in shortcuts_for(x):
+                existing = out_edges[u].get(v)
+                if existing is not None:
+                    if weight >= edge_weight[existing]:
+                        continue
+                    # Replace the longer edge in place; nothing refers to it until u or v is contracted
+                    edge_weight[existing] = weight
+                    edge_orig[existing] = -1
+                    edge_children[existing] = (in_edge, out_edge)
+                    continue
+                edge_src.append(u)
+                edge_dst.append(v)
+                edge_weight.append(weight)
+                edge_orig.append(-1)
+                edge_children.append((in_edge, out_edge))
+                out_edges[u][v] = len(edge_src) - 1
+                in_edges[v][u] = len(edge_src) - 1
+
+            contracted[x] = True
+            rank[x] = order
+            order += 1
+            for y in out_edges[x].keys() | in_edges[x].keys():
+                if not contracted[y]:
+                    contracted_neighbors[y] += 1
+                    level[y] = max(level[y], level[x] + 1)
+
+        ch = cls(
+            rank,
+            np.array(edge_src, dtype=np.int32),
+            np.array(edge_dst, dtype=np.int32),
+            np.array(edge_weight, dtype=np.float64),
+            np.array(edge_orig, dtype=np.int64),
+            np.array(edge_children, dtype=np.int64).reshape(-1, 2),
+            graph_fingerprint(compact),
+        )
+        print(f"Contraction hierarchy built: {n} nodes, {ch.number_of_shortcuts()} shortcuts "
+              f"in {time.perf_counter() - start:.2f}s.")
+        return ch
+
+    def save(self, path):
+        """Writes the hierarchy as an .npz, through a temp file so readers never see a partial one."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=CH_VERSION, fingerprint=self.fingerprint, rank=self.rank,
+                     edge_src=self.edge_src, edge_dst=self.edge_dst, edge_weight=self.edge_weight,
+                     edge_orig=self.edge_orig, edge_children=self.edge_children)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a hierarchy written by save(). Returns None if it is missing, unreadable or outdated."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if int(data['version']) != CH_VERSION:
+                    return None
+                return cls(data['rank'], data['edge_src'], data['edge_dst'], data['edge_weight'],
+                           data['edge_orig'], data['edge_children'], str(data['fingerprint']))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable contraction hierarchy {path}: {e}")
+            return None
+
+    @classmethod
+    def load_or_build(cls, compact, directory=PROCESSED_DATA_DIR):
+        """
+        Loads the saved hierarchy for this exact graph, or builds and saves it.
+        Only the hierarchies of the few most recently built graphs are kept in directory.
+        """
+        fingerprint = graph_fingerprint(compact)
+        path = os.path.join(directory, f"ch_{fingerprint}.npz")
+        ch = cls.load(path)
+        if ch is not None:
+            return ch
+
+        ch = cls.build(compact)
+        try:
+            ch.save(path)
+        except OSError as e:
+            print(f"Could not write contraction hierarchy: {e}")
+            return ch
+        prune_artifacts(directory, 'ch_', fingerprint)
+        return ch
+
+    def shortest_path(self, source, target, stats=None):
+        """
+        Bidirectional upward search from source to target (CompactGraph node ids).
+        Returns the CompactGraph edge indices along the path, or None if target is unreachable.
+        stats, if given, gets the number of 'settled' nodes (both directions).
+        """
+        if source == target:
+            if stats is not None:
+                stats['settled'] = 0
+            return []
+
+        src, dst, weight = self._src, self._dst, self._weight
+        up_offsets, up_edges = self._up_offsets, self._up_edges
+        down_offsets, down_edges = self._down_offsets, self._down_edges
+        dist_f = {source: 0.0}
+        dist_b = {target: 0.0}
+        pred_f = {} # node -> edge reaching it from source
+        succ_b = {} # node -> edge leaving it towards target
+        heap_f = [(0.0, source)]
+        heap_b = [(0.0, target)]
+        best = INF
+        meeting = None
+        settled = 0
+
+        # Each side stops once its closest unsettled node can't improve on the best meeting
+        while (heap_f and heap_f[0][0] < best) or (heap_b and heap_b[0][0] < best):
+            forward = heap_f and heap_f[0][0] < best and (not heap_b or heap_b[0][0] >= best or heap_f[0][0] <= heap_b[0][0])
+            if forward:
+                d, u = heapq.heappop(heap_f)
+                if d > dist_f[u]:
+                    continue # Stale heap entry
+                settled += 1
+                if u in dist_b and d + dist_b[u] < best:
+                    best = d + dist_b[u]
+                    meeting = u
+                for i in range(up_offsets[u], up_offsets[u + 1]):
+                    e = up_edges[i]
+                    v = dst[e]
+                    nd = d + weight[e]
+                    if nd < dist_f.get(v, INF):
+                        dist_f[v] = nd
+                        pred_f[v] = e
+                        heapq.heappush(heap_f, (nd, v))
+            else:
+                d, u = heapq.heappop(heap_b)
+                if d > dist_b[u]:
+                    continue
+                settled += 1
+                if u in dist_f and d + dist_f[u] < best:
+                    best = d + dist_f[u]
+                    meeting = u
+                for i in range(down_offsets[u], down_offsets[u + 1]):
+                    e = down_edges[i]
+                    v = src[e]
+                    nd = d + weight[e]
+                    if nd < dist_b.get(v, INF):
+                        dist_b[v] = nd
+                        succ_b[v] = e
+                        heapq.heappush(heap_b, (nd, v))
+
+        if stats is not None:
+            stats['settled'] = settled
+        if meeting is None:
+            return None
+
+        ch_edges = []
+        node = meeting
+        while node != source:
+            e = pred_f[node]
+            ch_edges.append(e)
+            node = src[e]
+        ch_edges.reverse()
+        node = meeting
+        while node != target:
+            e = succ_b[node]
+            ch_edges.append(e)
+            node = dst[e]
+
+        path = []
+        for e in ch_edges:
+            self._unpack(e, path)
+        return path
+
+    def _unpack(self, edge, path):
+        """Appends the CompactGraph edges a hierarchy edge stands for, in travel order."""
+        stack = [edge]
+        while stack:
+            e = stack.pop()
+            if self._orig[e] >= 0:
+                path.append(self._orig[e])
+            else:
+                first, second = self._children[e]
+                stack.append(second)
+                stack.append(first)
@@ -1,18 +1,134 @@
 import os
+import time
+import contextlib
+import datetime
+import hashlib
+import pickle
 import requests
 import zipfile
+import numpy as np
 import pandas as pd
 import io
-from .config import GTFS_STATIC_URL, RAW_DATA_DIR
+from .config import GTFS_STATIC_URL, RAW_DATA_DIR, PROCESSED_DATA_DIR
+
+# GTFS files that make up a snapshot. Optional ones are skipped if absent.
+SOURCE_FILES = ['stops.txt', 'routes.txt', 'trips.txt', 'stop_times.txt', 'transfers.txt',
+                'calendar.txt', 'calendar_dates.txt']
+
+# Loader attributes saved in a snapshot
+SNAPSHOT_TABLES = ['stops', 'routes', 'trips', 'stop_times', 'transfers', 'calendar', 'calendar_dates']
+
+# Bump this whenever the layout of the cached tables changes,
+# so old snapshots are ignored instead of loaded with the wrong shape.
+SNAPSHOT_VERSION = 3
+
+# stop_times columns the graph and router actually use (memory-optimized mode only).
+STOP_TIMES_COLUMNS = ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence']
+
+# Placeholder for stop_times rows with no time (non-timepoint stops).
+MISSING_TIME = -1
+
+# Artifacts of each kind (snapshots, cell tables, hierarchies) kept in a directory. Loaders with
+# different settings (the API's memory-optimized one, the scripts') each have their own fingerprint.
+KEEP_ARTIFACTS = 4
+
+# Separates a trip_id from the service date of a carried-over overnight trip ('..._1..S03R@20261016')
+OVERNIGHT_MARK = '@'
+
+SECONDS_PER_DAY = 24 * 3600
+
+WEEKDAY_COLUMNS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+def to_service_date(value):
+    """Accepts a date, datetime or "YYYYMMDD"/"YYYY-MM-DD" string and returns a date."""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    text = str(value).replace('-', '')
+    return datetime.datetime.strptime(text, '%Y%m%d').date()
+
+def prune_artifacts(directory, prefix, current, keep=KEEP_ARTIFACTS):
+    """
+    Removes artifacts named prefix + fingerprint (+ extensions) beyond the `keep` most recently
+    written fingerprints. The current one is always kept, and temp files of writes in progress are
+    left alone. Workers booting together may prune the same files, so ones already gone are skipped.
+    """
+    written = {} # fingerprint -> (latest mtime, file names)
+    for name in os.listdir(directory):
+        if not name.startswith(prefix) or name.endswith('.tmp'):
+            continue
+        fingerprint = name[len(prefix):].split('.', 1)[0]
+        try:
+            mtime = os.path.getmtime(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        latest, names = written.get(fingerprint, (0.0, []))
+        written[fingerprint] = (max(latest, mtime), names + [name])
+
+    others = sorted((fp for fp in written if fp != current), key=lambda fp: written[fp][0], reverse=True)
+    for fingerprint in others[max(0, keep - 1):]:
+        for name in written[fingerprint][1]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(directory, name))
+
+def split_overnight_trip_id(trip_id):
+    """
+    (trip_id, service date) of a trip id kept by filter_service_date. The date is None for the
+    filtered day's own trips and set for the previous day's trips that run past midnight.
+    """
+    if OVERNIGHT_MARK in trip_id:
+        base, day = trip_id.rsplit(OVERNIGHT_MARK, 1)
+        return base, to_service_date(day)
+    return trip_id, None
+
+def parse_gtfs_times(times):
+    """
+    Converts a Series of GTFS "HH:MM:SS" strings to int32 seconds since the start of the service day.
+    GTFS times can go past 24:00:00 (e.g., 25:30:00), so hours are not wrapped.
+    Missing times become MISSING_TIME.
+    """
+    # A feed only has a few thousand distinct times, so parse each one once.
+    codes, uniques = pd.factorize(times)
+    parsed = np.full(len(uniques) + 1, MISSING_TIME, dtype='int32')
+    if len(uniques):
+        parts = pd.Series(uniques).astype('string').str.split(':', expand=True)
+        if parts.shape[1] >= 3:
+            seconds = (
+                pd.to_numeric(parts[0], errors='coerce') * 3600
+                + pd.to_numeric(parts[1], errors='coerce') * 60
+                + pd.to_numeric(parts[2], errors='coerce')
+            )
+            parsed[:-1] = seconds.fillna(MISSING_TIME).to_numpy()
+    # factorize marks missing values with -1, which picks the trailing MISSING_TIME slot
+    return pd.Series(parsed[codes], index=times.index)
+
+def format_gtfs_times(seconds):
+    """Inverse of parse_gtfs_times: a Series of "HH:MM:SS" strings, NaN where the time is MISSING_TIME."""
+    seconds = pd.Series(seconds)
+    parts = [seconds // 3600, seconds % 3600 // 60, seconds % 60]
+    text = parts[0].astype(str).str.zfill(2) + ':' + parts[1].astype(str).str.zfill(2) + ':' + parts[2].astype(str).str.zfill(2)
+    return text.where(seconds != MISSING_TIME)
 
 class GTFSLoader:
-    def __init__(self, data_dir=RAW_DATA_DIR):
+    def __init__(self, data_dir=RAW_DATA_DIR, snapshot_dir=PROCESSED_DATA_DIR, optimize_memory=False, service_date=None):
         self.data_dir = data_dir
+        self.snapshot_dir = snapshot_dir
+        # When set, stop_times keeps only STOP_TIMES_COLUMNS, ids are categoricals
+        # and arrival/departure times are int32 seconds (see parse_gtfs_times).
+        self.optimize_memory = optimize_memory
+        # When set, load_data keeps only the trips running on this service day
+        self.service_date = to_service_date(service_date) if service_date is not None else None
+        self.active_services = None
         self.stops = None
         self.routes = None
         self.trips = None
         self.stop_times = None
         self.transfers = None
+        self.calendar = None
+        self.calendar_dates = None
+        # stop_id -> {'name', 'lat', 'lon', 'parent', 'children'}, built by _preprocess_stops
+        self.stop_index = {}
 
     def download_static_data(self):
         """Downloads and extracts the latest GTFS static data."""
@@ -24,8 +140,29 @@ class GTFSLoader:
             z.extractall(self.data_dir)
         print("Download and extraction complete.")
 
-    def load_data(self):
-        """Loads GTFS data into Pandas DataFrames."""
+    def load_data(self, use_snapshot=True):
+        """
+        Loads GTFS data into Pandas DataFrames.
+        If use_snapshot is set, a binary snapshot keyed by the source files is
+        read instead of the CSVs when available, and written after a CSV load.
+        """
+        start = time.perf_counter()
+        fingerprint = self.source_fingerprint() if use_snapshot else None
+
+        if fingerprint and self._load_snapshot(fingerprint):
+            print(f"Loaded GTFS snapshot in {time.perf_counter() - start:.2f}s.")
+        else:
+            self._load_csv()
+            print(f"Parsed GTFS CSVs in {time.perf_counter() - start:.2f}s.")
+            if fingerprint:
+                self._write_snapshot(fingerprint)
+
+        if self.service_date is not None:
+            self.filter_service_date(self.service_date)
+        self._preprocess_stops()
+
+    def _load_csv(self):
+        """Parses the GTFS text files into DataFrames."""
         print("Loading GTFS data into memory...")
         
         # Load stops
@@ -39,14 +176,193 @@ class GTFSLoader:
         
         # Load stop_times (this is VERY large, might need optimization for prod)
         # For now, we'll load it all. In a real app, we might filter by active trips.
-        self.stop_times = pd.read_csv(os.path.join(self.data_dir, 'stop_times.txt'))
+        self.stop_times = self._read_stop_times()
         
         # Load transfers
         if os.path.exists(os.path.join(self.data_dir, 'transfers.txt')):
             self.transfers = pd.read_csv(os.path.join(self.data_dir, 'transfers.txt'))
+
+        # Load service calendar (either file may be missing)
+        if os.path.exists(os.path.join(self.data_dir, 'calendar.txt')):
+            self.calendar = pd.read_csv(os.path.join(self.data_dir, 'calendar.txt'), dtype={'service_id': str})
+        if os.path.exists(os.path.join(self.data_dir, 'calendar_dates.txt')):
+            self.calendar_dates = pd.read_csv(os.path.join(self.data_dir, 'calendar_dates.txt'), dtype={'service_id': str})
         
         print("Data loaded.")
-        self._preprocess_stops()
+
+    def _read_stop_times(self):
+        """Reads stop_times.txt, pruned and typed if optimize_memory is set."""
+        path = os.path.join(self.data_dir, 'stop_times.txt')
+        if not self.optimize_memory:
+            return pd.read_csv(path)
+
+        stop_times = pd.read_csv(
+            path,
+            usecols=STOP_TIMES_COLUMNS,
+            dtype={
+                'trip_id': 'category',
+                'stop_id': 'category',
+                'arrival_time': str,
+                'departure_time': str,
+                'stop_sequence': 'int16',
+            },
+        )
+        # Parse times once here instead of per row when building the graph
+        stop_times['arrival_time'] = parse_gtfs_times(stop_times['arrival_time'])
+        stop_times['departure_time'] = parse_gtfs_times(stop_times['departure_time'])
+        return stop_times
+
+    def source_fingerprint(self):
+        """
+        Returns a hash identifying the current GTFS source files.
+        Uses name, size and modification time so we don't have to read stop_times.txt to hash it.
+        """
+        h = hashlib.sha1(f"v{SNAPSHOT_VERSION}:optimize_memory={self.optimize_memory};".encode())
+        for name in SOURCE_FILES:
+            path = os.path.join(self.data_dir, name)
+            if os.path.exists(path):
+                st = os.stat(path)
+                h.update(f"{name}:{st.st_size}:{st.st_mtime_ns};".encode())
+        return h.hexdigest()[:16]
+
+    def _snapshot_path(self, fingerprint):
+        return os.path.join(self.snapshot_dir, f"gtfs_{fingerprint}.pkl")
+
+    def _load_snapshot(self, fingerprint):
+        """Restores the tables from a snapshot. Returns False if there is no usable one."""
+        path = self._snapshot_path(fingerprint)
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'rb') as f:
+                tables = pickle.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable snapshot {path}: {e}")
+            return False
+
+        for name in SNAPSHOT_TABLES:
+            setattr(self, name, tables[name])
+        return True
+
+    def _write_snapshot(self, fingerprint):
+        """Writes the loaded tables to disk and removes all but the most recent other snapshots."""
+        tables = {name: getattr(self, name) for name in SNAPSHOT_TABLES}
+        path = self._snapshot_path(fingerprint)
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            # Write to a temp file first so a concurrently booting worker never sees a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write GTFS snapshot: {e}")
+            return
+
+        prune_artifacts(self.snapshot_dir, 'gtfs_', fingerprint)
+        print(f"Wrote GTFS snapshot to {path}.")
+
+    def active_service_ids(self, service_date):
+        """
+        Returns the set of service_ids running on service_date, from calendar.txt
+        weekday patterns plus calendar_dates.txt exceptions.
+        Returns None if the feed has no calendar files.
+        """
+        if self.calendar is None and self.calendar_dates is None:
+            return None
+
+        day = to_service_date(service_date)
+        ymd = int(day.strftime('%Y%m%d'))
+        active = set()
+
+        if self.calendar is not None:
+            cal = self.calendar
+            running = (cal[WEEKDAY_COLUMNS[day.weekday()]] == 1) & (cal['start_date'] <= ymd) & (cal['end_date'] >= ymd)
+            active.update(cal.loc[running, 'service_id'].astype(str))
+
+        if self.calendar_dates is not None:
+            exceptions = self.calendar_dates[self.calendar_dates['date'] == ymd]
+            # exception_type 1 adds service on this date, 2 removes it
+            active.update(exceptions.loc[exceptions['exception_type'] == 1, 'service_id'].astype(str))
+            active.difference_update(exceptions.loc[exceptions['exception_type'] == 2, 'service_id'].astype(str))
+
+        return active
+
+    def filter_service_date(self, service_date, overnight=True):
+        """
+        Drops trips (and their stop_times) that don't run on service_date.
+        Trips after midnight (e.g. 25:10:00) belong to the previous service date, as in GTFS.
+        With overnight set, the previous date's trips still running after midnight are kept too,
+        from their first stop after midnight on: their times move onto service_date's clock
+        (25:10:00 becomes 01:10:00) and their ids get the previous date (see split_overnight_trip_id).
+        """
+        active = self.active_service_ids(service_date)
+        if active is None:
+            print("No calendar.txt/calendar_dates.txt found, keeping all trips.")
+            return
+
+        self.service_date = to_service_date(service_date)
+        self.active_services = active
+        before = len(self.trips)
+        trips = self.trips[self.trips['service_id'].astype(str).isin(active)]
+        stop_times = self.stop_times[self.stop_times['trip_id'].isin(trips['trip_id'])]
+        carried = 0
+        if overnight:
+            late_trips, late_stop_times = self._overnight_trips(self.service_date - datetime.timedelta(days=1))
+            carried = len(late_trips)
+            if carried:
+                trip_ids = stop_times['trip_id']
+                trips = pd.concat([trips, late_trips])
+                stop_times = pd.concat([stop_times, late_stop_times])
+                if isinstance(trip_ids.dtype, pd.CategoricalDtype):
+                    stop_times['trip_id'] = stop_times['trip_id'].astype(str).astype('category')
+        self.trips = trips.reset_index(drop=True)
+        self.stop_times = stop_times.reset_index(drop=True)
+
+        # Shrink categoricals so the dropped trips don't keep their labels in memory
+        for column in ('trip_id', 'stop_id'):
+            if isinstance(self.stop_times[column].dtype, pd.CategoricalDtype):
+                self.stop_times[column] = self.stop_times[column].cat.remove_unused_categories()
+
+        print(f"Service {self.service_date}: kept {len(self.trips) - carried} of {before} trips ({', '.join(sorted(active))})"
+              f" and {carried} still running from the day before.")
+
+    def _overnight_trips(self, previous_date):
+        """
+        (trips, stop_times) of previous_date's trips from their first stop after midnight on,
+        re-timed a day earlier and renamed for filter_service_date.
+        """
+        active = self.active_service_ids(previous_date) or set()
+        trips = self.trips[self.trips['service_id'].astype(str).isin(active)]
+        stop_times = self.stop_times[self.stop_times['trip_id'].isin(trips['trip_id'])]
+        stop_times = stop_times.sort_values(['trip_id', 'stop_sequence'], kind='stable')
+
+        parsed = not pd.api.types.is_integer_dtype(stop_times['departure_time'])
+        arrivals = stop_times['arrival_time']
+        departures = stop_times['departure_time']
+        if parsed:
+            arrivals = parse_gtfs_times(arrivals)
+            departures = parse_gtfs_times(departures)
+        arrivals = arrivals.to_numpy()
+        departures = departures.to_numpy()
+
+        # A trip is kept from the first stop it reaches after midnight (rows without times stay in place)
+        reached = np.where(arrivals == MISSING_TIME, departures, arrivals)
+        trip_ids = stop_times['trip_id'].astype(str)
+        after = pd.Series(reached >= SECONDS_PER_DAY, index=stop_times.index).groupby(trip_ids.to_numpy()).cummax().to_numpy()
+        if not after.any():
+            return trips.iloc[:0], stop_times.iloc[:0]
+
+        suffix = f"{OVERNIGHT_MARK}{previous_date:%Y%m%d}"
+        late = stop_times[after].copy()
+        late['trip_id'] = (trip_ids[after] + suffix).to_numpy()
+        for column, times in (('arrival_time', arrivals[after]), ('departure_time', departures[after])):
+            times = np.where(times == MISSING_TIME, MISSING_TIME, times - SECONDS_PER_DAY)
+            late[column] = format_gtfs_times(times).to_numpy() if parsed else times.astype(late[column].dtype)
+
+        late_trips = trips[trips['trip_id'].astype(str).isin(set(trip_ids[after]))].copy()
+        late_trips['trip_id'] = late_trips['trip_id'].astype(str) + suffix
+        return late_trips, late
 
     def _preprocess_stops(self):
         """
@@ -62,16 +378,54 @@ class GTFSLoader:
         self.parent_stations = self.stops[self.stops['location_type'] == 1].copy()
         
         print(f"Loaded {len(self.parent_stations)} parent stations.")
+        self._build_stop_index()
+
+    def _build_stop_index(self):
+        """Builds the stop_id -> metadata index used for O(1) lookups."""
+        stops = self.stops
+        parents = stops['parent_station'].astype(object).where(stops['parent_station'].notna(), None)
+        index = {}
+        for stop_id, name, lat, lon, parent in zip(stops['stop_id'], stops['stop_name'], stops['stop_lat'], stops['stop_lon'], parents):
+            index[stop_id] = {
+                'name': name,
+                'lat': lat,
+                'lon': lon,
+                'parent': str(parent) if parent is not None else None,
+                'children': [],
+            }
+        for stop_id, entry in index.items():
+            parent = entry['parent']
+            if parent in index:
+                index[parent]['children'].append(stop_id)
+        self.stop_index = index
+
+    def get_stop(self, stop_id):
+        """Returns the indexed metadata of a stop, or None if it is unknown."""
+        return self.stop_index.get(stop_id)
 
     def get_station_name(self, stop_id):
         """Returns the name of a station given its ID."""
         # Handle both parent and child IDs
-        if not self.stops is None:
-            station = self.stops[self.stops['stop_id'] == stop_id]
-            if not station.empty:
-                return station.iloc[0]['stop_name']
+        stop = self.stop_index.get(stop_id)
+        if stop is not None:
+            return stop['name']
         return "Unknown Station"
 
+    def usable_transfers(self, default_time):
+        """
+        (from_stop_id, to_stop_id, seconds) for every transfers.txt row a rider can take:
+        recommended (0), timed (1) and minimum-time (2) transfers. Trains wait for a timed
+        transfer, so it takes no time unless min_transfer_time says otherwise; the others
+        take default_time without one.
+        """
+        if self.transfers is None:
+            return []
+        usable = self.transfers[self.transfers['transfer_type'].isin([0, 1, 2])]
+        given = usable['min_transfer_time'].astype(float)
+        fallback = np.where(usable['transfer_type'] == 1, 0.0, float(default_time))
+        times = np.where(given.notna(), given, fallback)
+        return list(zip(usable['from_stop_id'], usable['to_stop_id'], times.tolist()))
+
 if __name__ == "__main__":
     loader = GTFSLoader()
     loader.download_static_data()
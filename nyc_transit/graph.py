@@ -1,146 +1,247 @@
+import time
+import itertools
 import networkx as nx
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from .config import PROCESSED_DATA_DIR
+from .data_loader import parse_gtfs_times, MISSING_TIME
+from .compact import CompactGraph
+from .contraction import ContractionHierarchy
+from .station_graph import StationGraph
+
+# Source of TransitGraph.version stamps, unique across all graphs in the process
+_versions = itertools.count(1)
 
 class TransitGraph:
-    def __init__(self, loader):
+    def __init__(self, loader, compact=False, keep_networkx=True, contract=False, stations=False):
+        """
+        compact: also build an array-backed CompactGraph (self.compact) for the router.
+        keep_networkx: set to False with compact=True to drop the nx graph after
+        compaction and keep only the arrays in memory.
+        contract: also load or build a contraction hierarchy (self.ch) over the
+        compact graph for the 'ch' router backend. Implies compact=True.
+        stations: also build the collapsed (platform, route) StationGraph
+        (self.station_graph) for the 'stations' router backend.
+        """
         self.loader = loader
-        self.graph = nx.DiGraph()
+        self.graph = None
+        self.compact = None
+        self.ch = None
+        self.station_graph = None
+        self.keep_networkx = keep_networkx
+        # Derived structures build_graph() (re)builds along with the graph
+        self._with_compact = compact or contract
+        self._with_contraction = contract
+        self._with_stations = stations
+        self._ch_directory = PROCESSED_DATA_DIR
+        # Changes on every (re)build, so caches of routes over this graph know when they are stale
+        self.version = None
+        # Seconds spent in each build stage, filled by build_graph()
+        self.build_timings = {}
         self.build_graph()
 
+    def build_compact(self):
+        """Builds the CSR copy of the graph used by the 'compact' router backend."""
+        start = time.perf_counter()
+        self.compact = CompactGraph.from_networkx(self.graph)
+        self._with_compact = True
+        self.ch = None
+        self.version = next(_versions)
+        self.build_timings['compact'] = time.perf_counter() - start
+        print(f"Compact graph built: {self.compact.nbytes() / 1e6:.1f} MB of arrays in {self.build_timings['compact']:.2f}s.")
+        return self.compact
+
+    def build_contraction(self, directory=PROCESSED_DATA_DIR):
+        """
+        Loads the contraction hierarchy saved for this exact compact graph from directory
+        building and saving it first if there is none.
+        """
+        start = time.perf_counter()
+        self.ch = ContractionHierarchy.load_or_build(self.compact, directory)
+        self._with_contraction = True
+        self._ch_directory = directory
+        self.build_timings['contraction'] = time.perf_counter() - start
+        return self.ch
+
+    def build_station_graph(self, segments=None):
+        """
+        Builds the (platform, route) graph used by the 'stations' router backend.
+        segments: the _segment_durations() of the loader, if already computed.
+        """
+        start = time.perf_counter()
+        if segments is None:
+            segments = self._segment_durations()
+        self.station_graph = StationGraph.build(self.loader, segments)
+        self._with_stations = True
+        self.version = next(_versions)
+        self.build_timings['stations'] = time.perf_counter() - start
+        print(f"Station graph built: {self.station_graph.number_of_nodes()} nodes, "
+              f"{self.station_graph.number_of_edges()} edges in {self.build_timings['stations']:.2f}s.")
+        return self.station_graph
+
     def build_graph(self):
-        """Builds the transit graph from loaded GTFS data."""
+        """
+        Builds the transit graph from loaded GTFS data, then rebuilds the compact graph,
+        contraction hierarchy and station graph if they were asked for or built before, so a
+        Router on any backend keeps working across a rebuild.
+        """
+        # Both graphs are built from the same trip segments, the slowest step of the build
+        segments = self._build_networkx()
+        if self._with_stations:
+            self.build_station_graph(segments)
+        if self._with_compact:
+            self.build_compact()
+            if self._with_contraction:
+                self.build_contraction(self._ch_directory)
+            if not self.keep_networkx:
+                self.graph = None
+
+    def _build_networkx(self):
+        """Builds the networkx transit graph from loaded GTFS data. Returns the trip segments it used."""
         print("Building transit graph...")
-        
+        self.graph = nx.DiGraph()
+        # A compact copy (or hierarchy) of the previous graph would no longer match
+        self.compact = None
+        self.ch = None
+        self.station_graph = None
+        self.version = next(_versions)
+        self.build_timings = {}
+        build_start = time.perf_counter()
+        stage_start = build_start
+
+        def end_stage(name):
+            nonlocal stage_start
+            now = time.perf_counter()
+            self.build_timings[name] = now - stage_start
+            stage_start = now
+
+        stops = self.loader.stops
+        has_parent = stops['parent_station'].notna()
+
         # Add nodes (stops)
         # We use stop_id as the node identifier.
-        # We might want to use parent_station for a simplified graph, 
+        # We might want to use parent_station for a simplified graph,
         # but for accurate routing (including specific platforms), we use all stops.
-        for _, stop in self.loader.stops.iterrows():
-            self.graph.add_node(
-                stop['stop_id'], 
-                name=stop['stop_name'], 
-                lat=stop['stop_lat'], 
-                lon=stop['stop_lon'],
-                parent=stop['parent_station'] if pd.notna(stop['parent_station']) else None
+        parents = stops['parent_station'].astype(object).where(has_parent, None)
+        self.graph.add_nodes_from(
+            (stop_id, {'name': name, 'lat': lat, 'lon': lon, 'parent': parent})
+            for stop_id, name, lat, lon, parent in zip(
+                stops['stop_id'], stops['stop_name'], stops['stop_lat'], stops['stop_lon'], parents
             )
+        )
+        end_stage('nodes')
 
         # Add edges from stop_times (Trip segments)
-        # This is the heavy part. We need to connect consecutive stops in trips.
-        # To speed this up, we can group by trip_id and sort by stop_sequence.
-        
-        # Optimization: We don't need EVERY trip. Many trips have identical patterns.
-        # But for a full schedule-aware router, we do. 
-        # For a simplified "average time" router, we can average the times.
-        # Let's do a simplified version first: Average travel time between adjacent stops.
-        
+        # For a simplified "average time" router, we aggregate the travel time
+        # of every trip over each (stop, next_stop) segment.
         print("Processing stop_times for edges...")
-        stop_times = self.loader.stop_times.sort_values(['trip_id', 'stop_sequence'])
-        
-        # Create a shifted dataframe to get previous stop info
-        stop_times['next_stop_id'] = stop_times.groupby('trip_id')['stop_id'].shift(-1)
-        stop_times['next_arrival_time'] = stop_times.groupby('trip_id')['arrival_time'].shift(-1)
-        
-        # Filter out the last stop of each trip
-        edges_df = stop_times.dropna(subset=['next_stop_id'])
-        
-        # Calculate travel time (simplified, assuming valid H:M:S)
-        # Note: GTFS times can go past 24:00:00 (e.g., 25:30:00).
-        def parse_time(t_str):
-            h, m, s = map(int, t_str.split(':'))
-            return h * 3600 + m * 60 + s
-
-        # We can't easily vectorize the time diff because of the 24h wrap, but let's try a rough approx
-        # For now, let's just take unique edges and assign a default weight if we want to be fast,
-        # or do it properly. Let's do it properly but aggregated.
-        
-        # Group by (stop_id, next_stop_id) to find average travel time
-        # This avoids adding millions of edges for every single trip.
-        
-        # First, we need to compute duration for each segment.
-        # This is slow in pure Python loop. Let's try to do it with pandas if possible, 
-        # but the time parsing is tricky.
-        
-        # Let's iterate over unique route segments instead.
-        # A "route segment" is defined by a unique sequence of stops.
-        
-        # Actually, for a MVP, let's just iterate and add edges. 
-        # If an edge exists, we update the weight (average).
-        
-        edge_weights = {} # (u, v) -> [times]
-        
-        # Taking a sample or just processing all might be slow.
-        # Let's try processing a subset or using a faster method.
-        # We will use the 'trips' to get the route_id for the edge.
-        
-        # Let's merge trips to get route_id
-        edges_df = edges_df.merge(self.loader.trips[['trip_id', 'route_id']], on='trip_id')
-        
-        # We only care about unique (stop_id, next_stop_id, route_id) tuples for the graph structure
-        # But we need average time.
-        
-        # Let's just take the first occurrence for now to speed up build time for this demo.
-        # In a real app, we'd pre-calculate this.
-        unique_segments = edges_df.drop_duplicates(subset=['stop_id', 'next_stop_id', 'route_id'])
-        
-        count = 0
-        for _, row in unique_segments.iterrows():
-            u = row['stop_id']
-            v = row['next_stop_id']
-            route_id = row['route_id']
-            
-            # Rough estimate of travel time: difference in arrival times
-            # This is tricky without parsing all times. 
-            # Let's assume 2 minutes (120s) for intra-station, unless we parse.
-            t1 = parse_time(row['departure_time'])
-            t2 = parse_time(row['next_arrival_time'])
-            duration = t2 - t1
-            
-            if duration < 0: duration += 24*3600 # Handle day wrap
-            
-            # Add edge
-            # We might have multiple edges between nodes (different lines).
-            # NetworkX MultiDiGraph could work, or just store list of lines in edge data.
-            if self.graph.has_edge(u, v):
-                self.graph[u][v]['routes'].add(route_id)
-                # Update average time? For now keep the first one found or min?
-                # Let's keep min time (fastest line).
-                self.graph[u][v]['weight'] = min(self.graph[u][v]['weight'], duration)
-            else:
-                self.graph.add_edge(u, v, weight=duration, routes={route_id}, type='transit')
-            
-            count += 1
-            
-        print(f"Added {count} transit edges.")
+        segments = self._segment_durations()
+        end_stage('segments')
+
+        edges = self._aggregate_segments(segments)
+        end_stage('aggregate')
+
+        self.graph.add_edges_from(
+            (u, v, {
+                'weight': weight,
+                'min_time': min_time,
+                'median_time': median_time,
+                'p90_time': p90_time,
+                'routes': routes,
+                'type': 'transit',
+            })
+            for u, v, weight, min_time, median_time, p90_time, routes in zip(
+                edges['stop_id'], edges['next_stop_id'], edges['weight'], edges['min_time'],
+                edges['median_time'], edges['p90_time'], edges['routes']
+            )
+        )
+        print(f"Added {len(edges)} transit edges.")
+        end_stage('transit_edges')
 
         # Add transfers
         # 1. Explicit transfers from transfers.txt
         if self.loader.transfers is not None:
             print("Processing transfers...")
-            for _, row in self.loader.transfers.iterrows():
-                u = row['from_stop_id']
-                v = row['to_stop_id']
-                t_type = row['transfer_type']
-                min_time = row['min_transfer_time']
-                
-                weight = float(min_time) if pd.notna(min_time) else 180 # Default 3 mins
-                
-                if t_type == 2: # Requires min time
-                    self.graph.add_edge(u, v, weight=weight, type='transfer')
-                elif t_type == 0: # Recommended transfer point
-                    self.graph.add_edge(u, v, weight=weight, type='transfer')
-                    
+            self.graph.add_edges_from(
+                (u, v, {'weight': w, 'type': 'transfer'})
+                for u, v, w in self.loader.usable_transfers(180) # Default 3 mins
+            )
+        end_stage('transfers')
+
         # 2. Implicit transfers (Parent Station <-> Child Stop)
         # This allows routing from "Times Sq" (Parent) to specific platform "127N" (Child)
+        # Walking between the platform and the station costs 30s each way.
         print("Adding parent-child connections...")
-        for _, stop in self.loader.stops.iterrows():
-            if pd.notna(stop['parent_station']):
-                parent = stop['parent_station']
-                child = stop['stop_id']
-                # Parent -> Child (0 cost, or small cost to represent walking to platform)
-                self.graph.add_edge(parent, child, weight=30, type='parent_child')
-                # Child -> Parent
-                self.graph.add_edge(child, parent, weight=30, type='child_parent')
+        children = stops.loc[has_parent, ['parent_station', 'stop_id']]
+        pairs = list(zip(children['parent_station'], children['stop_id']))
+        self.graph.add_edges_from(pairs, weight=30, type='parent_child')
+        self.graph.add_edges_from(((c, p) for p, c in pairs), weight=30, type='child_parent')
+        end_stage('parent_child')
+
+        total = time.perf_counter() - build_start
+        self.build_timings['total'] = total
+        stages = ", ".join(f"{name} {secs:.2f}s" for name, secs in self.build_timings.items() if name != 'total')
+        print(f"Graph built: {self.graph.number_of_nodes()} nodes, {self.graph.number_of_edges()} edges in {total:.2f}s ({stages}).")
+        return segments
+
+    def _segment_durations(self):
+        """
+        Returns one row per consecutive stop pair of every trip:
+        stop_id, next_stop_id, route_id and the travel time in seconds.
+        """
+        stop_times = self.loader.stop_times[['trip_id', 'stop_id', 'stop_sequence', 'arrival_time', 'departure_time']]
+        stop_times = stop_times.sort_values(['trip_id', 'stop_sequence'], kind='stable')
+
+        # Times are already int seconds if the loader ran with optimize_memory
+        departures = stop_times['departure_time']
+        arrivals = stop_times['arrival_time']
+        if not pd.api.types.is_integer_dtype(departures):
+            departures = parse_gtfs_times(departures)
+            arrivals = parse_gtfs_times(arrivals)
+
+        # After sorting, row i+1 is the next stop of row i unless the trip changes there.
+        trip_codes = stop_times['trip_id'].astype('category').cat.codes.to_numpy()
+        same_trip = trip_codes[:-1] == trip_codes[1:]
+
+        # Non-timepoint rows have no time; an arrival-only or departure-only row uses the other one,
+        # and segments still missing an end are dropped rather than timed against the placeholder
+        arrivals = arrivals.to_numpy()
+        departures = departures.to_numpy()
+        arrivals = np.where(arrivals == MISSING_TIME, departures, arrivals)
+        departures = np.where(departures == MISSING_TIME, arrivals, departures)
+        same_trip &= (departures[:-1] != MISSING_TIME) & (arrivals[1:] != MISSING_TIME)
+
+        stop_ids = stop_times['stop_id'].to_numpy()
+        durations = arrivals[1:] - departures[:-1]
+        durations = np.where(durations < 0, durations + 24 * 3600, durations) # Handle day wrap
+
+        segments = pd.DataFrame({
+            'trip_id': stop_times['trip_id'].to_numpy()[:-1][same_trip],
+            'stop_id': stop_ids[:-1][same_trip],
+            'next_stop_id': stop_ids[1:][same_trip],
+            'duration': durations[same_trip],
+        })
+
+        # We will use the 'trips' to get the route_id for the edge.
+        route_by_trip = self.loader.trips.set_index('trip_id')['route_id']
+        segments['route_id'] = segments['trip_id'].map(route_by_trip)
+        return segments.dropna(subset=['route_id'])
 
-        print(f"Graph built: {self.graph.number_of_nodes()} nodes, {self.graph.number_of_edges()} edges.")
+    def _aggregate_segments(self, segments):
+        """
+        Collapses per-trip segments into one row per (stop_id, next_stop_id) edge.
+        The edge weight is the median time of the fastest route on that segment;
+        min/median/p90 are taken over every trip.
+        """
+        keys = ['stop_id', 'next_stop_id']
+        per_route = segments.groupby(keys + ['route_id'], sort=False)['duration'].median()
 
+        grouped = segments.groupby(keys, sort=False)['duration']
+        edges = pd.DataFrame({
+            'weight': per_route.groupby(level=keys, sort=False).min(),
+            'min_time': grouped.min(),
+            'median_time': grouped.median(),
+            'p90_time': grouped.quantile(0.9),
+            'routes': per_route.reset_index().groupby(keys, sort=False)['route_id'].agg(set),
+        })
+        return edges.reset_index()
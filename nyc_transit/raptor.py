@@ -0,0 +1,644 @@
+import time
+import datetime
+from zoneinfo import ZoneInfo
+import numpy as np
+import pandas as pd
+from .data_loader import parse_gtfs_times, to_service_date, split_overnight_trip_id, MISSING_TIME
+
+# Time to change platforms inside one station when transfers.txt has no entry for it
+# (matches the 30s child->parent + 30s parent->child walk of TransitGraph).
+PLATFORM_CHANGE_TIME = 60
+
+# Same default as TransitGraph for transfers.txt rows without min_transfer_time
+DEFAULT_TRANSFER_TIME = 180
+
+INF = float('inf')
+
+# Live time of a trip that won't serve a stop (canceled trip or skipped stop); later than any real time
+NO_SERVICE = int(np.iinfo(np.int32).max)
+
+# GTFS times count from the start of the service day in the agency's timezone
+AGENCY_TIMEZONE = ZoneInfo('America/New_York')
+
+def service_day_start(service_date):
+    """POSIX time of midnight at the start of a service day."""
+    return int(datetime.datetime.combine(service_date, datetime.time(0), tzinfo=AGENCY_TIMEZONE).timestamp())
+
+def realtime_trip_key(trip_id):
+    """
+    Key shared by a static trip and its GTFS-RT updates. MTA static ids carry a schedule prefix
+    ('AFA23GEN-1037-Weekday-00_000600_1..S03R') that the feeds leave out ('000600_1..S03R').
+    """
+    trip_id, _ = split_overnight_trip_id(trip_id)
+    return trip_id.split('_', 1)[1] if '_' in trip_id and '-' in trip_id.split('_', 1)[0] else trip_id
+
+def to_seconds(t):
+    """Accepts seconds since the start of the service day or an "HH:MM[:SS]" string."""
+    if isinstance(t, str):
+        parts = [int(x) for x in t.split(':')]
+        while len(parts) < 3:
+            parts.append(0)
+        return parts[0] * 3600 + parts[1] * 60 + parts[2]
+    return int(t)
+
+def format_time(seconds):
+    """Formats seconds since the start of the service day as GTFS "HH:MM:SS" (hours may pass 24)."""
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+class RaptorRouter:
+    """
+    Round-based public transit routing (RAPTOR) over the loader's timetable.
+    Round k finds the earliest arrival at every stop using at most k trips,
+    so each round adds one transfer.
+
+    Trips with the same stop sequence are grouped into patterns. All timetable
+    data lives in flat arrays:
+      - pattern p visits pattern_stops[pattern_stop_offsets[p]:pattern_stop_offsets[p+1]]
+        and runs trips pattern_trip_offsets[p]:pattern_trip_offsets[p+1], sorted by departure.
+      - arrivals/departures hold each pattern's block stop-major, so the times of every
+        trip at one stop are contiguous: pattern_time_offsets[p] + pos * n_trips + trip.
+    """
+
+    def __init__(self, loader, max_transfers=4):
+        self.loader = loader
+        self.max_transfers = max_transfers
+        # (version, arrivals, departures, unordered patterns) with live predictions applied, see apply_realtime
+        self.live = None
+        self.live_version = 0
+        self.build_timetable()
+
+    def build_timetable(self):
+        """Builds the flat pattern/trip/transfer arrays from loader.stop_times and loader.trips."""
+        print("Building RAPTOR timetable...")
+        start = time.perf_counter()
+
+        stop_times = self.loader.stop_times[['trip_id', 'stop_id', 'stop_sequence', 'arrival_time', 'departure_time']]
+        stop_times = stop_times.sort_values(['trip_id', 'stop_sequence'], kind='stable')
+        arrivals = stop_times['arrival_time']
+        departures = stop_times['departure_time']
+        if not pd.api.types.is_integer_dtype(departures):
+            arrivals = parse_gtfs_times(arrivals)
+            departures = parse_gtfs_times(departures)
+        arrivals = arrivals.to_numpy(dtype=np.int32)
+        departures = departures.to_numpy(dtype=np.int32)
+
+        # Non-timepoint rows have no time; an arrival-only or departure-only row uses the other one
+        arrivals = np.where(arrivals == MISSING_TIME, departures, arrivals)
+        departures = np.where(departures == MISSING_TIME, arrivals, departures)
+
+        stop_codes, stop_ids = pd.factorize(stop_times['stop_id'].astype(str))
+        trip_codes, trip_ids = pd.factorize(stop_times['trip_id'].astype(str))
+        self.stop_ids = list(stop_ids)
+        self.stop_lookup = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+
+        # Split rows per trip (rows are sorted, so each trip is one contiguous run)
+        bounds = np.flatnonzero(np.diff(trip_codes)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(trip_codes)]))
+
+        # Group trips by their stop sequence
+        by_sequence = {}
+        for s, e in zip(starts.tolist(), ends.tolist()):
+            if (arrivals[s:e] == MISSING_TIME).any():
+                continue # Can't schedule a trip with unknown times
+            by_sequence.setdefault(tuple(stop_codes[s:e].tolist()), []).append(s)
+
+        trips_by_id = self.loader.trips.assign(trip_id=self.loader.trips['trip_id'].astype(str)).set_index('trip_id')
+        route_by_trip = trips_by_id['route_id']
+        service_by_trip = trips_by_id['service_id'].astype(str)
+
+        pattern_stops = []
+        pattern_stop_offsets = [0]
+        pattern_trip_offsets = [0]
+        pattern_time_offsets = [0]
+        trip_services = []
+        trip_names = []
+        trip_routes = []
+        flat_arr = []
+        flat_dep = []
+
+        for sequence, trip_starts in by_sequence.items():
+            n = len(sequence)
+            # Trips sorted by first departure; trips that overtake another go into their own pattern
+            # so boarding can binary search on departures at any stop.
+            trip_starts.sort(key=lambda s: departures[s])
+            for group in self._fifo_groups(trip_starts, departures, arrivals, n):
+                arr_block = np.stack([arrivals[s:s + n] for s in group], axis=1) # (n stops, n trips)
+                dep_block = np.stack([departures[s:s + n] for s in group], axis=1)
+                pattern_stops.extend(sequence)
+                pattern_stop_offsets.append(len(pattern_stops))
+                for s in group:
+                    trip_id = trip_ids[trip_codes[s]]
+                    trip_names.append(trip_id)
+                    trip_routes.append(route_by_trip.get(trip_id))
+                    trip_services.append(service_by_trip.get(trip_id))
+                pattern_trip_offsets.append(len(trip_names))
+                flat_arr.append(arr_block.ravel())
+                flat_dep.append(dep_block.ravel())
+                pattern_time_offsets.append(pattern_time_offsets[-1] + arr_block.size)
+
+        self.pattern_stops = np.array(pattern_stops, dtype=np.int32)
+        self.pattern_stop_offsets = np.array(pattern_stop_offsets, dtype=np.int32)
+        self.pattern_trip_offsets = np.array(pattern_trip_offsets, dtype=np.int32)
+        self.pattern_time_offsets = np.array(pattern_time_offsets, dtype=np.int64)
+        self.arrivals = np.concatenate(flat_arr) if flat_arr else np.empty(0, dtype=np.int32)
+        self.departures = np.concatenate(flat_dep) if flat_dep else np.empty(0, dtype=np.int32)
+        self.trip_ids = trip_names
+        self.trip_routes = trip_routes
+        # service_id of each trip, to tell apart the schedules' copies of a trip in an unfiltered timetable
+        self.trip_services = trip_services
+        self.trip_keys = {}
+        # Service date of each trip when the loader keeps a single day (carried-over trips run the day before)
+        self.trip_dates = []
+        for trip, trip_id in enumerate(trip_names):
+            self.trip_keys.setdefault(realtime_trip_key(trip_id), []).append(trip)
+            self.trip_dates.append(split_overnight_trip_id(trip_id)[1] or self.loader.service_date)
+        self._pattern_positions = {}
+        self.live = None # The overlay indexes the old arrays
+
+        self._build_stop_patterns()
+        self._build_transfers()
+
+        # Lists of plain ints for the Python scan loop
+        self._pattern_stops = self.pattern_stops.tolist()
+        self._pattern_stop_offsets = self.pattern_stop_offsets.tolist()
+        self._pattern_trip_offsets = self.pattern_trip_offsets.tolist()
+        self._pattern_time_offsets = self.pattern_time_offsets.tolist()
+
+        n_patterns = len(self.pattern_stop_offsets) - 1
+        print(f"RAPTOR timetable built: {len(self.stop_ids)} stops, {n_patterns} patterns, "
+              f"{len(self.trip_ids)} trips in {time.perf_counter() - start:.2f}s.")
+
+    @staticmethod
+    def _fifo_groups(trip_starts, departures, arrivals, n):
+        """Splits trips (sorted by first departure) into groups where no trip overtakes an earlier one."""
+        groups = []
+        for s in trip_starts:
+            for group in groups:
+                last = group[-1]
+                if (departures[s:s + n] >= departures[last:last + n]).all() and (arrivals[s:s + n] >= arrivals[last:last + n]).all():
+                    group.append(s)
+                    break
+            else:
+                groups.append([s])
+        return groups
+
+    def _build_stop_patterns(self):
+        """CSR index of (pattern, position) pairs serving each stop."""
+        n_stops = len(self.stop_ids)
+        pattern_of_slot = np.repeat(np.arange(len(self.pattern_stop_offsets) - 1), np.diff(self.pattern_stop_offsets))
+        pos_of_slot = np.arange(len(self.pattern_stops)) - self.pattern_stop_offsets[pattern_of_slot]
+        order = np.argsort(self.pattern_stops, kind='stable')
+        counts = np.bincount(self.pattern_stops, minlength=n_stops)
+        self._stop_pattern_offsets = np.concatenate(([0], np.cumsum(counts))).tolist()
+        self._stop_pattern_ids = pattern_of_slot[order].tolist()
+        self._stop_pattern_pos = pos_of_slot[order].tolist()
+
+    def _build_transfers(self):
+        """
+        Footpaths between platforms: transfers.txt rows (expanded from parent stations to their
+        platforms) plus platform changes inside the same station.
+        """
+        loader = self.loader
+        best = {}
+
+        def add(p, q, seconds):
+            if p != q and seconds < best.get((p, q), INF):
+                best[(p, q)] = seconds
+
+        def platforms(stop_id):
+            stop_id = str(stop_id)
+            if stop_id in self.stop_lookup:
+                return [self.stop_lookup[stop_id]]
+            stop = loader.get_stop(stop_id)
+            children = stop['children'] if stop else []
+            return [self.stop_lookup[c] for c in children if c in self.stop_lookup]
+
+        # Platforms of the same station
+        by_parent = {}
+        for i, stop_id in enumerate(self.stop_ids):
+            stop = loader.get_stop(stop_id)
+            parent = stop['parent'] if stop else None
+            if parent:
+                by_parent.setdefault(parent, []).append(i)
+        for group in by_parent.values():
+            for p in group:
+                for q in group:
+                    add(p, q, PLATFORM_CHANGE_TIME)
+
+        for u, v, t in loader.usable_transfers(DEFAULT_TRANSFER_TIME):
+            for p in platforms(u):
+                for q in platforms(v):
+                    if (p, q) in best and str(u) == str(v):
+                        # An explicit same-station row replaces the platform change default
+                        best[(p, q)] = int(t)
+                    else:
+                        add(p, q, int(t))
+
+        pairs = sorted(best.items())
+        n_stops = len(self.stop_ids)
+        sources = [p for (p, _), _ in pairs]
+        self._transfer_offsets = np.concatenate(([0], np.cumsum(np.bincount(np.array(sources, dtype=np.int64), minlength=n_stops)))).astype(int).tolist()
+        self._transfer_targets = [q for (_, q), _ in pairs]
+        self._transfer_times = [t for _, t in pairs]
+
+    def _trip_slots(self, trip):
+        """(pattern, indices of the trip's times in arrivals/departures, one per stop of the pattern)."""
+        pattern = int(np.searchsorted(self.pattern_trip_offsets, trip, side='right')) - 1
+        n_trips = self._pattern_trip_offsets[pattern + 1] - self._pattern_trip_offsets[pattern]
+        n_stops = self._pattern_stop_offsets[pattern + 1] - self._pattern_stop_offsets[pattern]
+        local = trip - self._pattern_trip_offsets[pattern]
+        return pattern, self._pattern_time_offsets[pattern] + np.arange(n_stops) * n_trips + local
+
+    def _positions(self, pattern):
+        """stop -> position within a pattern (the first visit if a stop repeats)."""
+        positions = self._pattern_positions.get(pattern)
+        if positions is None:
+            stops = self._pattern_stops[self._pattern_stop_offsets[pattern]:self._pattern_stop_offsets[pattern + 1]]
+            positions = {}
+            for pos, stop in enumerate(stops):
+                positions.setdefault(stop, pos)
+            self._pattern_positions[pattern] = positions
+        return positions
+
+    def _is_fifo(self, pattern, arrivals, departures):
+        """True if, at every stop, the pattern's trips still depart and arrive in order."""
+        n_trips = self._pattern_trip_offsets[pattern + 1] - self._pattern_trip_offsets[pattern]
+        n_stops = self._pattern_stop_offsets[pattern + 1] - self._pattern_stop_offsets[pattern]
+        start = self._pattern_time_offsets[pattern]
+        end = start + n_stops * n_trips
+        for times in (arrivals, departures):
+            block = times[start:end].reshape(n_stops, n_trips).astype(np.int64)
+            if (np.diff(block, axis=1) < 0).any():
+                return False
+        return True
+
+    def apply_realtime(self, predictions, service_date=None):
+        """
+        Overlays live predictions ({trip_id: (start_date, canceled, stops)} as returned by
+        RealTimeHandler.trip_predictions) on the static timetable, replacing the previous overlay.
+        Each call is a full re-overlay: both timetable arrays are copied and every prediction is
+        applied again (patterns, trips and transfers are shared, so it is still no rebuild).
+        A prediction only applies to the copy of its trip running on its start date (or
+        service_date): in a timetable that isn't filtered to one day, the copy whose service
+        runs that day. A stop's delay carries on to the following stops until the next
+        prediction; canceled trips and skipped stops become unboardable.
+        Returns the number of static trips updated.
+        """
+        # A timetable filtered to one service day holds only that day's trips (and the previous
+        # day's still running after midnight), all timed on that day's clock
+        filtered_date = self.loader.service_date
+        if service_date is None:
+            service_date = filtered_date or datetime.datetime.now(AGENCY_TIMEZONE).date()
+        day_starts = {}
+        active_services = {}
+        arrivals = self.arrivals.copy()
+        departures = self.departures.copy()
+        touched = set()
+        updated = 0
+
+        for rt_trip_id, (start_date, canceled, stops) in predictions.items():
+            trips = self.trip_keys.get(realtime_trip_key(rt_trip_id))
+            if not trips:
+                continue
+            trip_date = to_service_date(start_date) if start_date else service_date
+            if filtered_date is not None:
+                # Only the copy of the trip that runs on the predicted day, on the timetable's clock
+                trips = [trip for trip in trips if self.trip_dates[trip] == trip_date]
+                trip_date = filtered_date
+            else:
+                # The Weekday, Saturday and Sunday copies of a trip share its realtime id
+                if trip_date not in active_services:
+                    active_services[trip_date] = self.loader.active_service_ids(trip_date)
+                active = active_services[trip_date]
+                if active is not None:
+                    trips = [trip for trip in trips if self.trip_services[trip] in active]
+            if trip_date not in day_starts:
+                day_starts[trip_date] = service_day_start(trip_date)
+            day_start = day_starts[trip_date]
+
+            updated += len(trips)
+            for trip in trips:
+                pattern, slots = self._trip_slots(trip)
+                touched.add(pattern)
+                if canceled:
+                    arrivals[slots] = NO_SERVICE
+                    departures[slots] = NO_SERVICE
+                    continue
+                self._apply_trip(pattern, slots, stops, day_start, arrivals, departures)
+
+        unordered = {pattern for pattern in touched if not self._is_fifo(pattern, arrivals, departures)}
+        self.live_version += 1
+        self.live = (self.live_version, arrivals, departures, unordered)
+        return updated
+
+    def _apply_trip(self, pattern, slots, stops, day_start, arrivals, departures):
+        """Writes one trip's predicted times (and the delays they imply downstream) into the live arrays."""
+        positions = self._positions(pattern)
+        updates = {}
+        for stop_id, arrival, departure, skipped in stops:
+            pos = positions.get(self.stop_lookup.get(stop_id))
+            if pos is not None:
+                updates[pos] = (arrival - day_start if arrival else None,
+                                departure - day_start if departure else None,
+                                skipped)
+        if not updates:
+            return
+        timed = [pos for pos in sorted(updates) if not updates[pos][2] and updates[pos][:2] != (None, None)]
+
+        scheduled_arr = self.arrivals[slots].tolist()
+        scheduled_dep = self.departures[slots].tolist()
+
+        def predicted(pos):
+            arrival, departure, _ = updates[pos]
+            arrival = arrival if arrival is not None else departure
+            if departure is None:
+                departure = max(arrival, scheduled_dep[pos] + arrival - scheduled_arr[pos])
+            return arrival, departure
+
+        # Stops before the first prediction (usually already passed) share its delay
+        delay = predicted(timed[0])[1] - scheduled_dep[timed[0]] if timed else 0
+        live_arr = []
+        live_dep = []
+        for pos in range(len(slots)):
+            update = updates.get(pos)
+            if update is not None and update[2]:
+                live_arr.append(NO_SERVICE)
+                live_dep.append(NO_SERVICE)
+                continue
+            if update is not None and update[:2] != (None, None):
+                arrival, departure = predicted(pos)
+                # Until the next prediction, later stops run with this delay
+                delay = departure - scheduled_dep[pos]
+            else:
+                arrival = scheduled_arr[pos] + delay
+                departure = scheduled_dep[pos] + delay
+            live_arr.append(arrival)
+            live_dep.append(departure)
+
+        arrivals[slots] = live_arr
+        departures[slots] = live_dep
+
+    def _timetable(self, live):
+        """(arrivals, departures, unordered patterns, live version) to route on."""
+        if live and self.live is not None:
+            version, arrivals, departures, unordered = self.live
+            return arrivals, departures, unordered, version
+        return self.arrivals, self.departures, frozenset(), None
+
+    def stops_for(self, stop_id):
+        """Timetable stops for a station or platform id."""
+        stop_id = str(stop_id)
+        if stop_id in self.stop_lookup:
+            return [self.stop_lookup[stop_id]]
+        stop = self.loader.get_stop(stop_id)
+        if stop is None:
+            return []
+        return [self.stop_lookup[c] for c in stop['children'] if c in self.stop_lookup]
+
+    def get_earliest_arrival(self, start_stop_id, end_stop_id, departure_time, max_transfers=None, live=True):
+        """Returns the earliest-arriving journey, or None if the target can't be reached."""
+        journeys = self.get_journeys(start_stop_id, end_stop_id, departure_time, max_transfers, live)
+        return journeys[-1] if journeys else None
+
+    def get_journeys(self, start_stop_id, end_stop_id, departure_time, max_transfers=None, live=True):
+        """
+        Runs RAPTOR from start to end leaving at departure_time (seconds or "HH:MM:SS").
+        Returns one journey per number of trips that improves the arrival time,
+        fewest transfers first.
+        live: route on the latest apply_realtime overlay when there is one.
+        """
+        sources = self.stops_for(start_stop_id)
+        targets = self.stops_for(end_stop_id)
+        if not sources or not targets:
+            return []
+        departure = to_seconds(departure_time)
+        if max_transfers is None:
+            max_transfers = self.max_transfers
+
+        timetable = self._timetable(live)
+        labels = self._run(sources, set(targets), departure, max_transfers + 1, timetable)
+
+        journeys = []
+        best_arrival = INF
+        for k in range(1, len(labels)):
+            round_labels = labels[k]
+            reached = [(round_labels[t][0], t) for t in targets if t in round_labels]
+            if not reached:
+                continue
+            arrival, target = min(reached)
+            if arrival < best_arrival:
+                best_arrival = arrival
+                journeys.append(self._build_journey(labels, k, target, departure, timetable))
+        return journeys
+
+    def _run(self, sources, targets, departure, max_rounds, timetable=None):
+        """
+        Core RAPTOR loop. labels[k][stop] = (arrival, how) where how is
+        ('trip', trip, board_stop, board_pos, alight_pos) or ('transfer', from_stop, seconds).
+        """
+        pattern_stops = self._pattern_stops
+        stop_offsets = self._pattern_stop_offsets
+        trip_offsets = self._pattern_trip_offsets
+        time_offsets = self._pattern_time_offsets
+        arrivals, departures, unordered, _ = timetable or self._timetable(False)
+
+        best = {}
+        labels = [{}]
+        for s in sources:
+            labels[0][s] = (departure, ('origin',))
+            best[s] = departure
+        marked = set(sources)
+        self._relax_transfers(labels[0], best, marked, targets)
+
+        for k in range(1, max_rounds + 1):
+            prev = labels[k - 1]
+            # Labels carry over: reaching a stop with fewer trips still counts in later rounds
+            current = dict(prev)
+            labels.append(current)
+
+            # Earliest marked position on each pattern serving a marked stop
+            queue = {}
+            for stop in marked:
+                for i in range(self._stop_pattern_offsets[stop], self._stop_pattern_offsets[stop + 1]):
+                    pattern = self._stop_pattern_ids[i]
+                    pos = self._stop_pattern_pos[i]
+                    if pos < queue.get(pattern, INF):
+                        queue[pattern] = pos
+            marked = set()
+            target_best = min((best.get(t, INF) for t in targets), default=INF)
+
+            for pattern, first_pos in queue.items():
+                n_trips = trip_offsets[pattern + 1] - trip_offsets[pattern]
+                base = time_offsets[pattern]
+                stops_start = stop_offsets[pattern]
+                n_stops = stop_offsets[pattern + 1] - stops_start
+                trip = None
+                board_stop = board_pos = None
+                if pattern in unordered:
+                    # Live delays made trips overtake, so "earliest trip" depends on the stop
+                    target_best = self._scan_unordered(pattern, first_pos, prev, current, best, marked,
+                                                       targets, target_best, arrivals, departures)
+                    continue
+
+                for pos in range(first_pos, n_stops):
+                    stop = pattern_stops[stops_start + pos]
+                    col = base + pos * n_trips
+
+                    if trip is not None:
+                        arrival = int(arrivals[col + trip])
+                        if arrival < min(best.get(stop, INF), target_best):
+                            current[stop] = (arrival, ('trip', trip_offsets[pattern] + trip, board_stop, board_pos, pos))
+                            best[stop] = arrival
+                            marked.add(stop)
+                            if stop in targets:
+                                target_best = min(target_best, arrival)
+
+                    # Can we catch an earlier trip here?
+                    ready = prev.get(stop)
+                    if ready is not None and (trip is None or ready[0] <= departures[col + trip]):
+                        hi = n_trips if trip is None else trip
+                        found = int(np.searchsorted(departures[col:col + hi], ready[0], side='left'))
+                        # Unboardable (NO_SERVICE) times sort last
+                        if found < hi and departures[col + found] != NO_SERVICE:
+                            trip = found
+                            board_stop = stop
+                            board_pos = pos
+
+            if not marked:
+                break
+            self._relax_transfers(current, best, marked, targets)
+        return labels
+
+    def _scan_unordered(self, pattern, first_pos, prev, current, best, marked, targets, target_best, arrivals, departures):
+        """
+        Route scan for a pattern whose trips no longer run in order. Every trip boards at the first
+        stop where it can be caught, then the earliest arrival at each later stop over all trips
+        is taken. Returns the updated best arrival at any target.
+        """
+        n_trips = self._pattern_trip_offsets[pattern + 1] - self._pattern_trip_offsets[pattern]
+        stops_start = self._pattern_stop_offsets[pattern]
+        n_stops = self._pattern_stop_offsets[pattern + 1] - stops_start
+        base = self._pattern_time_offsets[pattern]
+        stops = self._pattern_stops[stops_start:stops_start + n_stops]
+        dep = departures[base:base + n_stops * n_trips].reshape(n_stops, n_trips)[first_pos:]
+        arr = arrivals[base:base + n_stops * n_trips].reshape(n_stops, n_trips)[first_pos:]
+
+        ready = np.array([prev[stop][0] if stop in prev else INF for stop in stops[first_pos:]])
+        catchable = (ready[:, None] <= dep) & (dep != NO_SERVICE)
+        boarded = catchable.any(axis=0)
+        if not boarded.any():
+            return target_best
+        board = np.where(boarded, catchable.argmax(axis=0), len(ready))
+        # A trip can only be left after the stop it was boarded at
+        riding = np.arange(len(ready))[:, None] > board[None, :]
+        candidates = np.where(riding & (arr != NO_SERVICE), arr, INF)
+        fastest = candidates.argmin(axis=1)
+
+        for offset, trip in enumerate(fastest.tolist()):
+            arrival = candidates[offset, trip]
+            if arrival == INF:
+                continue
+            arrival = int(arrival)
+            stop = stops[first_pos + offset]
+            if arrival < min(best.get(stop, INF), target_best):
+                board_pos = first_pos + int(board[trip])
+                current[stop] = (arrival, ('trip', self._pattern_trip_offsets[pattern] + trip,
+                                           stops[board_pos], board_pos, first_pos + offset))
+                best[stop] = arrival
+                marked.add(stop)
+                if stop in targets:
+                    target_best = min(target_best, arrival)
+        return target_best
+
+    def _relax_transfers(self, round_labels, best, marked, targets):
+        """Walks transfers from the stops improved in this round (one footpath, no chaining)."""
+        for stop, arrival in [(stop, round_labels[stop][0]) for stop in marked]:
+            for i in range(self._transfer_offsets[stop], self._transfer_offsets[stop + 1]):
+                q = self._transfer_targets[i]
+                t = arrival + self._transfer_times[i]
+                if t < best.get(q, INF):
+                    round_labels[q] = (t, ('transfer', stop, self._transfer_times[i]))
+                    best[q] = t
+                    marked.add(q)
+
+    def _build_journey(self, labels, k, target, departure, timetable=None):
+        """Backtracks labels from target in round k into the journey step format."""
+        arrivals, departures, _, live_version = timetable or self._timetable(False)
+        legs = []
+        stop = target
+        while True:
+            arrival, how = labels[k][stop]
+            if how[0] == 'origin':
+                break
+            if how[0] == 'transfer':
+                legs.append(('transfer', how[1], stop, how[2], arrival))
+                stop = how[1]
+            else:
+                _, trip, board_stop, board_pos, alight_pos = how
+                legs.append(('trip', trip, board_pos, alight_pos))
+                stop = board_stop
+                k -= 1
+        legs.reverse()
+
+        steps = []
+        clock = departure
+        for leg in legs:
+            if leg[0] == 'transfer':
+                _, u, v, seconds, arrival = leg
+                steps.append(self._step(u, v, seconds, 'transfer', []))
+                clock += seconds
+                continue
+
+            _, trip, board_pos, alight_pos = leg
+            pattern = int(np.searchsorted(self.pattern_trip_offsets, trip, side='right')) - 1
+            n_trips = self._pattern_trip_offsets[pattern + 1] - self._pattern_trip_offsets[pattern]
+            local = trip - self._pattern_trip_offsets[pattern]
+            base = self._pattern_time_offsets[pattern]
+            stops_start = self._pattern_stop_offsets[pattern]
+            route = self.trip_routes[trip]
+
+            board_stop = self._pattern_stops[stops_start + board_pos]
+            dep = int(departures[base + board_pos * n_trips + local])
+            if dep > clock:
+                steps.append(self._step(board_stop, board_stop, dep - clock, 'wait', []))
+            for pos in range(board_pos, alight_pos):
+                u = self._pattern_stops[stops_start + pos]
+                v = self._pattern_stops[stops_start + pos + 1]
+                leave = int(departures[base + pos * n_trips + local])
+                arrive = int(arrivals[base + (pos + 1) * n_trips + local])
+                step = self._step(u, v, arrive - leave, 'transit', [route] if route is not None else [])
+                step['trip_id'] = self.trip_ids[trip]
+                step['departure_time'] = format_time(leave)
+                step['arrival_time'] = format_time(arrive)
+                if live_version is not None:
+                    step['delay_seconds'] = leave - int(self.departures[base + pos * n_trips + local])
+                steps.append(step)
+                # Dwell at intermediate stops is part of the ride
+                if pos + 1 < alight_pos:
+                    next_leave = int(departures[base + (pos + 1) * n_trips + local])
+                    step['duration'] += next_leave - arrive
+            clock = int(arrivals[base + alight_pos * n_trips + local])
+
+        return {
+            'total_time_seconds': clock - departure,
+            'departure_time': format_time(departure),
+            'arrival_time': format_time(clock),
+            'transfers': max(0, sum(1 for leg in legs if leg[0] == 'trip') - 1),
+            'realtime_version': live_version,
+            'steps': steps
+        }
+
+    def _step(self, u, v, duration, step_type, routes):
+        from_id = self.stop_ids[u]
+        to_id = self.stop_ids[v]
+        return {
+            'from': self.loader.get_station_name(from_id),
+            'from_id': from_id,
+            'to': self.loader.get_station_name(to_id),
+            'to_id': to_id,
+            'duration': duration,
+            'type': step_type,
+            'routes': routes
+        }
@@ -1,56 +1,441 @@
+import asyncio
+import bisect
 import requests
+import httpx
 from google.transit import gtfs_realtime_pb2
-from .config import GTFS_REALTIME_URLS
+import pandas as pd
+from .config import GTFS_REALTIME_URLS, ROUTE_FEED_OVERRIDES
 import time
 
-class RealTimeHandler:
+# Seconds to wait for a single feed before giving up on it
+FEED_TIMEOUT = 10
+
+def parse_feed(content):
+    """Parses raw GTFS-RT bytes into a FeedMessage."""
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(content)
+    return feed
+
+def station_of(stop_id):
+    """Parent station of a platform id: '101N' -> '101'."""
+    if stop_id and stop_id[-1] in ('N', 'S'):
+        return stop_id[:-1]
+    return stop_id
+
+def feed_for_route(route_id, urls=GTFS_REALTIME_URLS):
+    """Returns the key of the feed that carries route_id, or None if no feed does."""
+    route_id = str(route_id)
+    if route_id in ROUTE_FEED_OVERRIDES:
+        feed_id = ROUTE_FEED_OVERRIDES[route_id]
+        return feed_id if feed_id in urls else None
+    for feed_id in urls:
+        # SIR's letters aren't route names
+        if feed_id != 'SIR' and route_id[:1] in feed_id:
+            return feed_id
+    return None
+
+def build_station_feeds(loader, urls=GTFS_REALTIME_URLS):
+    """
+    Maps each parent station to the feeds that can have arrivals for it,
+    from the routes that stop there in loader.trips/stop_times.
+    """
+    route_by_trip = loader.trips.set_index('trip_id')['route_id']
+    served = pd.DataFrame({
+        'stop_id': loader.stop_times['stop_id'].astype(str),
+        'route_id': loader.stop_times['trip_id'].map(route_by_trip),
+    }).dropna().drop_duplicates()
+
+    feed_by_route = {route_id: feed_for_route(route_id, urls) for route_id in served['route_id'].unique()}
+    station_feeds = {}
+    for stop_id, route_id in zip(served['stop_id'], served['route_id']):
+        stop = loader.get_stop(stop_id)
+        station = stop['parent'] if stop and stop['parent'] else station_of(stop_id)
+        feed_id = feed_by_route[route_id]
+        if feed_id is not None:
+            station_feeds.setdefault(station, set()).add(feed_id)
+    return station_feeds
+
+def feed_trips(feed):
+    """
+    Reads a feed's trip updates into {trip_id: (time, route, direction, stop_id) tuples}.
+    Tuples compare cheaply, so the previous poll's state can be diffed without reparsing it.
+    """
+    trips = {}
+    for entity in feed.entity:
+        if not entity.HasField('trip_update'):
+            continue
+        trip = entity.trip_update.trip
+        route_id = trip.route_id
+        entries = []
+        for stop_time_update in entity.trip_update.stop_time_update:
+            stop_id = stop_time_update.stop_id
+            if not stop_id:
+                continue
+            # Determine direction from stop_id (usually ends in N or S)
+            direction = stop_id[-1] if stop_id[-1] in ['N', 'S'] else '?'
+            entries.append((stop_time_update.arrival.time, route_id, direction, stop_id))
+        trips[trip.trip_id or entity.id] = tuple(entries)
+    return trips
+
+def trip_predictions(feed):
+    """
+    Reads a feed's trip updates into {trip_id: (start_date, canceled, stops)} for live routing,
+    where stops is a tuple of (stop_id, arrival, departure, skipped) with POSIX times (0 when absent)
+    and start_date is the trip's 'YYYYMMDD' service date ('' when absent).
+    """
+    canceled_status = gtfs_realtime_pb2.TripDescriptor.CANCELED
+    skipped_status = gtfs_realtime_pb2.TripUpdate.StopTimeUpdate.SKIPPED
+    predictions = {}
+    for entity in feed.entity:
+        if not entity.HasField('trip_update'):
+            continue
+        trip_update = entity.trip_update
+        trip = trip_update.trip
+        stops = tuple(
+            (u.stop_id, u.arrival.time, u.departure.time, u.schedule_relationship == skipped_status)
+            for u in trip_update.stop_time_update if u.stop_id
+        )
+        predictions[trip.trip_id or entity.id] = (trip.start_date, trip.schedule_relationship == canceled_status, stops)
+    return predictions
+
+def group_by_station(entries):
+    """Splits a trip's (time, route, direction, stop_id) entries by parent station."""
+    by_station = {}
+    for entry in entries:
+        by_station.setdefault(station_of(entry[3]), []).append(entry)
+    return by_station
+
+class FeedDelta:
+    """What changed in one feed between two polls."""
+
+    def __init__(self, feed_id, added, updated, removed, stations):
+        self.feed_id = feed_id
+        self.added = added       # trip_ids new in this poll
+        self.updated = updated   # trip_ids whose predictions changed
+        self.removed = removed   # trip_ids no longer in the feed
+        self.stations = stations # parent stations whose arrivals changed
+        self.timestamp = time.time()
+
+    def __bool__(self):
+        return bool(self.added or self.updated or self.removed)
+
+    def to_dict(self):
+        return {
+            'feed_id': self.feed_id,
+            'added': sorted(self.added),
+            'updated': sorted(self.updated),
+            'removed': sorted(self.removed),
+            'stations': sorted(self.stations),
+            'timestamp': self.timestamp,
+        }
+
+class FeedIngestor:
+    """
+    Keeps the last state of every trip per feed and applies each new poll as a diff.
+    Only stations touched by added, changed or removed trips get their arrivals re-sorted,
+    so the work per poll follows the churn rather than the feed size.
+    Subscribers receive every non-empty FeedDelta on an asyncio.Queue.
+    """
+
     def __init__(self):
+        self.trips = {}          # feed_id -> {trip_id: entries}
+        self.station_trips = {}  # station -> {(feed_id, trip_id): entries at that station}
+        self.arrivals_index = {} # station -> entries of every trip, sorted by time
+        self._subscribers = set()
+
+    def ingest(self, feed_id, feed):
+        """Applies a freshly parsed feed and returns the FeedDelta against the previous poll."""
+        new = feed_trips(feed)
+        old = self.trips.get(feed_id, {})
+
+        added = new.keys() - old.keys()
+        removed = old.keys() - new.keys()
+        updated = {trip_id for trip_id in new.keys() & old.keys() if new[trip_id] != old[trip_id]}
+
+        stations = set()
+        for trip_id in added | updated | removed:
+            old_by_station = group_by_station(old.get(trip_id, ()))
+            new_by_station = group_by_station(new.get(trip_id, ()))
+            for station in old_by_station.keys() | new_by_station.keys():
+                entries = new_by_station.get(station)
+                if entries == old_by_station.get(station):
+                    continue # This trip's predictions at this station didn't change
+                if entries:
+                    self.station_trips.setdefault(station, {})[(feed_id, trip_id)] = entries
+                else:
+                    self.station_trips.get(station, {}).pop((feed_id, trip_id), None)
+                stations.add(station)
+
+        for station in stations:
+            trips = self.station_trips.get(station)
+            if trips:
+                self.arrivals_index[station] = sorted(entry for entries in trips.values() for entry in entries)
+            else:
+                self.station_trips.pop(station, None)
+                self.arrivals_index.pop(station, None)
+
+        self.trips[feed_id] = new
+        delta = FeedDelta(feed_id, added, updated, removed, stations)
+        if delta:
+            self._publish(delta)
+        return delta
+
+    def subscribe(self, maxsize=100):
+        """Returns a queue that receives every future FeedDelta."""
+        queue = asyncio.Queue(maxsize=maxsize)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def _publish(self, delta):
+        for queue in self._subscribers:
+            if queue.full():
+                # A slow consumer loses its oldest delta rather than blocking ingestion
+                queue.get_nowait()
+            queue.put_nowait(delta)
+
+class AsyncFeedClient:
+    """
+    Fetches GTFS-RT feeds concurrently over one pooled keep-alive connection.
+    Each feed has its own timeout; a feed that fails is left out of the result
+    instead of failing the whole batch.
+    """
+
+    def __init__(self, urls=GTFS_REALTIME_URLS, timeout=FEED_TIMEOUT):
+        self.urls = urls
+        self.timeout = timeout
+        self._client = None
+
+    def _get_client(self):
+        # Created lazily so it binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_keepalive_connections=len(self.urls), keepalive_expiry=60),
+            )
+        return self._client
+
+    async def fetch_feed(self, feed_id):
+        """Fetches and parses one feed. Returns None on any error."""
+        url = self.urls.get(feed_id)
+        if not url:
+            print(f"Feed ID {feed_id} not found.")
+            return None
+        try:
+            response = await self._get_client().get(url)
+            response.raise_for_status()
+            return parse_feed(response.content)
+        except Exception as e:
+            print(f"Error fetching feed {feed_id}: {e!r}")
+            return None
+
+    async def fetch_all(self, feed_ids=None):
+        """Fetches feeds concurrently. Returns {feed_id: FeedMessage} for the feeds that succeeded."""
+        if feed_ids is None:
+            feed_ids = list(self.urls.keys())
+        feeds = await asyncio.gather(*(self.fetch_feed(feed_id) for feed_id in feed_ids))
+        return {feed_id: feed for feed_id, feed in zip(feed_ids, feeds) if feed is not None}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+class RealTimeHandler:
+    def __init__(self, urls=GTFS_REALTIME_URLS, timeout=FEED_TIMEOUT, loader=None):
+        """
+        loader: if given, arrivals lookups only fetch and scan the feeds of the routes
+        that serve the requested station (see build_station_feeds).
+        """
+        self.urls = urls
+        self.timeout = timeout
+        self.client = AsyncFeedClient(urls, timeout)
         # Cache feeds briefly to avoid spamming MTA API
         self.feed_cache = {}
         self.cache_ttl = 30 # seconds
+        # feed_id -> Task, so concurrent requests on a cold cache share one fetch
+        self._inflight = {}
+        # Filled by FeedPoller: parent station -> sorted (time, route, direction, stop_id).
+        # While it is None, requests scan the feeds directly.
+        self.ingestor = FeedIngestor()
+        self.arrivals_index = None
+        # feed_id -> trip_predictions() of its latest poll, for live routing
+        self.predictions = {}
+        # Called as listener(handler, deltas) after a refresh that changed something
+        self.listeners = []
+        self.station_feeds = build_station_feeds(loader, urls) if loader is not None else None
+
+    def _cached(self, feed_id):
+        if feed_id in self.feed_cache:
+            timestamp, feed = self.feed_cache[feed_id]
+            if time.time() - timestamp < self.cache_ttl:
+                return feed
+        return None
 
     def get_feed(self, feed_id):
         """Fetches and parses a GTFS-RT feed."""
-        url = GTFS_REALTIME_URLS.get(feed_id)
+        url = self.urls.get(feed_id)
         if not url:
             print(f"Feed ID {feed_id} not found.")
             return None
 
         # Check cache
-        if feed_id in self.feed_cache:
-            timestamp, feed = self.feed_cache[feed_id]
-            if time.time() - timestamp < self.cache_ttl:
-                return feed
-        
+        feed = self._cached(feed_id)
+        if feed is not None:
+            return feed
+
         try:
-            response = requests.get(url)
+            response = requests.get(url, timeout=self.timeout)
             response.raise_for_status()
-            
-            feed = gtfs_realtime_pb2.FeedMessage()
-            feed.ParseFromString(response.content)
-            
+
+            feed = parse_feed(response.content)
+
             self.feed_cache[feed_id] = (time.time(), feed)
             return feed
         except Exception as e:
             print(f"Error fetching feed {feed_id}: {e}")
             return None
 
+    async def get_feeds_async(self, feed_ids=None):
+        """
+        Returns {feed_id: FeedMessage}, fetching every stale feed concurrently.
+        Feeds that fail are missing from the result.
+        """
+        if feed_ids is None:
+            feed_ids = list(self.urls.keys())
+
+        feeds = {}
+        tasks = {}
+        for feed_id in feed_ids:
+            feed = self._cached(feed_id)
+            if feed is not None:
+                feeds[feed_id] = feed
+                continue
+            if feed_id not in self._inflight:
+                self._inflight[feed_id] = asyncio.ensure_future(self._refresh(feed_id))
+            tasks[feed_id] = self._inflight[feed_id]
+
+        results = await asyncio.gather(*tasks.values())
+        for feed_id, feed in zip(tasks, results):
+            if feed is not None:
+                feeds[feed_id] = feed
+        return feeds
+
+    async def _refresh(self, feed_id):
+        try:
+            feed = await self.client.fetch_feed(feed_id)
+            if feed is not None:
+                self.feed_cache[feed_id] = (time.time(), feed)
+            return feed
+        finally:
+            self._inflight.pop(feed_id, None)
+
     def get_arrivals(self, station_id):
         """
         Get live arrivals for a specific station ID.
         Returns a list of dictionaries: {'route': 'A', 'time': timestamp, 'direction': 'N'}
         """
-        # We need to check all feeds because we don't strictly know which feed a station is on 
-        # without a mapping. For MVP, we'll check a few common ones or all.
-        # Optimization: Map lines to feeds.
-        
-        arrivals = []
-        
-        # Iterate over all configured feeds
-        for feed_key in GTFS_REALTIME_URLS.keys():
+        feeds = []
+        for feed_key in self.feeds_for_station(station_id):
             feed = self.get_feed(feed_key)
-            if not feed: continue
-            
+            if feed:
+                feeds.append(feed)
+        return self._find_arrivals(feeds, station_id)
+
+    async def get_arrivals_async(self, station_id):
+        """
+        Same as get_arrivals, but fetches the feeds concurrently without blocking the event loop.
+        Once a FeedPoller is running this is a dictionary lookup.
+        """
+        if self.arrivals_index is not None:
+            return self.lookup_arrivals(station_id)
+        feeds = await self.get_feeds_async(self.feeds_for_station(station_id))
+        return self._find_arrivals(feeds.values(), station_id)
+
+    def feeds_for_station(self, station_id):
+        """
+        Feeds that can carry arrivals for station_id. Falls back to every feed
+        when there is no station mapping or the station isn't in it.
+        """
+        if self.station_feeds is not None:
+            feed_ids = self.station_feeds.get(station_of(station_id))
+            if feed_ids:
+                return [feed_id for feed_id in self.urls if feed_id in feed_ids]
+        return list(self.urls.keys())
+
+    def update_feeds(self, feeds):
+        """
+        Stores freshly fetched feeds and applies them to the arrivals index as diffs.
+        Feeds missing from this batch keep their previous state until they succeed again.
+        Returns the list of non-empty FeedDeltas.
+        """
+        now = time.time()
+        deltas = []
+        predictions_changed = False
+        for feed_id, feed in feeds.items():
+            self.feed_cache[feed_id] = (now, feed)
+            delta = self.ingestor.ingest(feed_id, feed)
+            if delta:
+                deltas.append(delta)
+            # Compared separately: a cancellation, a skipped stop or a new departure time
+            # changes the predictions without changing any arrival
+            predictions = trip_predictions(feed)
+            if predictions != self.predictions.get(feed_id):
+                self.predictions[feed_id] = predictions
+                predictions_changed = True
+        self.arrivals_index = self.ingestor.arrivals_index
+
+        if deltas or predictions_changed:
+            for listener in self.listeners:
+                try:
+                    listener(self, deltas)
+                except Exception as e:
+                    print(f"Feed listener failed: {e!r}")
+        return deltas
+
+    def add_listener(self, listener):
+        """
+        Registers listener(handler, deltas), called after every refresh that changed a feed's
+        arrivals or predictions (deltas is empty if only the predictions changed).
+        """
+        self.listeners.append(listener)
+
+    def trip_predictions(self):
+        """Latest predictions of every feed merged into one {trip_id: (start_date, canceled, stops)}."""
+        merged = {}
+        for predictions in self.predictions.values():
+            merged.update(predictions)
+        return merged
+
+    def lookup_arrivals(self, station_id):
+        """Upcoming arrivals for a parent station or platform id from the precomputed index."""
+        arrivals = self.arrivals_index.get(station_of(station_id), [])
+        now = time.time()
+        # Arrivals are sorted by time, so skip the past ones with a binary search.
+        # The max-codepoint route sorts after any real route, so arrivals at exactly `now` are skipped too.
+        start = bisect.bisect_right(arrivals, (now, '\U0010ffff'))
+
+        results = []
+        for arrival_time, route_id, direction, stop_id in arrivals[start:]:
+            if station_id != station_of(station_id) and stop_id != station_id:
+                continue # A platform id was requested; skip the other direction
+            results.append({
+                'route': route_id,
+                'time': arrival_time,
+                'minutes_away': int((arrival_time - now) / 60),
+                'direction': direction,
+                'stop_id': stop_id
+            })
+        return results
+
+    def _find_arrivals(self, feeds, station_id):
+        """Scans parsed feeds for upcoming arrivals at station_id, sorted by time."""
+        arrivals = []
+        now = time.time()
+
+        for feed in feeds:
             for entity in feed.entity:
                 if entity.HasField('trip_update'):
                     for stop_time_update in entity.trip_update.stop_time_update:
@@ -58,21 +443,66 @@ class RealTimeHandler:
                             # Found a match!
                             route_id = entity.trip_update.trip.route_id
                             arrival_time = stop_time_update.arrival.time
-                            
+
                             # Determine direction from stop_id (usually ends in N or S)
                             direction = stop_time_update.stop_id[-1] if stop_time_update.stop_id[-1] in ['N', 'S'] else '?'
-                            
+
                             # Only future arrivals
-                            if arrival_time > time.time():
+                            if arrival_time > now:
                                 arrivals.append({
                                     'route': route_id,
                                     'time': arrival_time,
-                                    'minutes_away': int((arrival_time - time.time()) / 60),
+                                    'minutes_away': int((arrival_time - now) / 60),
                                     'direction': direction,
                                     'stop_id': stop_time_update.stop_id
                                 })
-                                
+
         # Sort by time
         arrivals.sort(key=lambda x: x['time'])
         return arrivals
 
+    async def aclose(self):
+        await self.client.aclose()
+
+class FeedPoller:
+    """
+    Refreshes every feed in the background once per interval (the handler's cache_ttl by default)
+    and keeps the handler's arrivals_index up to date, so requests never fetch or scan feeds.
+    """
+
+    def __init__(self, handler, interval=None):
+        self.handler = handler
+        self.interval = interval if interval is not None else handler.cache_ttl
+        self._task = None
+
+    async def poll_once(self):
+        """Fetches all feeds concurrently and applies the ones that succeeded. Returns the deltas."""
+        feeds = await self.handler.client.fetch_all(list(self.handler.urls.keys()))
+        return self.handler.update_feeds(feeds)
+
+    async def start(self):
+        """
+        Starts polling in a background task; the first poll runs right away.
+        Until it completes, requests fall back to fetching the feeds themselves.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                await self.poll_once()
+            except Exception as e:
+                print(f"Feed poll failed: {e!r}")
+            # Keep a steady cadence regardless of how long the fetch took
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
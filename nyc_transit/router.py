@@ -1,47 +1,373 @@
+import threading
+from collections import OrderedDict
 import networkx as nx
+import numpy as np
+from .compact import INF
+from .station_graph import PLATFORM_WALK_TIME, MAX_PARETO_TRANSFERS, MAX_EXTRA_TIME
+
+BACKENDS = ('networkx', 'compact', 'astar', 'ch', 'stations')
+
+# Routes kept per Router; commuter traffic is dominated by a small set of station pairs
+ROUTE_CACHE_SIZE = 4096
+
+# Shortest-path trees kept per Router. Each holds a distance and a predecessor for every stop.
+TREE_CACHE_SIZE = 256
+
+class RouteCache:
+    """
+    Bounded LRU of routing results, tied to one graph version.
+    Stored journeys are shared between callers, so treat them as read-only.
+    """
+
+    def __init__(self, maxsize=ROUTE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.version = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Sync API endpoints run in a thread pool
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        """Returns (found, value). Everything cached for another graph version is dropped first."""
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, version):
+        with self.lock:
+            if version != self.version:
+                return # The graph was rebuilt while this route was computed
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Counters as one consistent snapshot."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+class ShortestPathTree:
+    """
+    Shortest paths from one origin to every reachable stop.
+    distances maps stop id -> seconds; predecessors maps stop id -> whatever edge_details
+    needs to describe the edge used to reach it as a (u, v, weight, type, routes) tuple.
+    """
+
+    def __init__(self, origin, distances, predecessors, edge_details):
+        self.origin = origin
+        self.distances = distances
+        self.predecessors = predecessors
+        self.edge_details = edge_details
+
+    def travel_time(self, stop_id):
+        """Seconds from the origin, or None if stop_id is unreachable."""
+        return self.distances.get(stop_id)
+
+    def edges_to(self, stop_id):
+        """(u, v, weight, type, routes) tuples from the origin to stop_id, or None if it is unreachable."""
+        if stop_id not in self.distances:
+            return None
+        edges = []
+        while stop_id != self.origin:
+            edge = self.edge_details(self.predecessors[stop_id])
+            edges.append(edge)
+            stop_id = edge[0]
+        edges.reverse()
+        return edges
+
+class StationPathTree(ShortestPathTree):
+    """
+    ShortestPathTree over a StationGraph, searched from every node of the origin's station.
+    Every stop id (station or platform) is answered for its station.
+    """
+
+    def __init__(self, origin, station_graph):
+        self.station_graph = station_graph
+        self.origin_station = station_graph.station_of[origin]
+        dist, self.pred = station_graph.compact.shortest_path_tree_multi(station_graph.entry_costs(self.origin_station))
+
+        # Each station is reached through its cheapest node, plus the walk out
+        self.exits = {}
+        station_times = {self.origin_station: 0.0}
+        for station, nodes in station_graph.station_nodes.items():
+            if station == self.origin_station:
+                continue
+            node = min(nodes, key=dist.__getitem__)
+            if dist[node] != INF:
+                self.exits[station] = node
+                station_times[station] = dist[node] + PLATFORM_WALK_TIME
+        distances = {
+            stop_id: station_times[station]
+            for stop_id, station in station_graph.station_of.items() if station in station_times
+        }
+        super().__init__(origin, distances, None, station_graph.edge)
+
+    def edges_to(self, stop_id):
+        if stop_id not in self.distances:
+            return None
+        station = self.station_graph.station_of[stop_id]
+        if station == self.origin_station:
+            return []
+        path = []
+        node = self.exits[station]
+        while self.pred[node] >= 0:
+            path.append(self.pred[node])
+            node = self.station_graph.compact.edge_source(self.pred[node])
+        path.reverse()
+        return self.station_graph.journey_edges(path, self.origin_station, station)
 
 class Router:
-    def __init__(self, graph_wrapper):
+    def __init__(self, graph_wrapper, backend=None, cache_size=ROUTE_CACHE_SIZE, tree_cache_size=TREE_CACHE_SIZE):
+        """
+        backend: 'networkx' runs nx.shortest_path on graph_wrapper.graph,
+        'compact' runs bidirectional Dijkstra over graph_wrapper.compact,
+        'astar' runs A* with a great-circle heuristic over graph_wrapper.compact,
+        'ch' runs a bidirectional contraction hierarchy query over graph_wrapper.ch,
+        'stations' runs bidirectional Dijkstra over the collapsed graph_wrapper.station_graph
+        (station to station; changing trains always shows up as a 'transfer' step).
+        Defaults to 'ch' when the TransitGraph was built with contract=True, else to
+        'compact' when it was built with compact=True.
+        cache_size: routes kept in the LRU route cache (0 disables it).
+        tree_cache_size: shortest-path trees kept per origin (0 disables it).
+        Both caches are emptied whenever graph_wrapper is rebuilt.
+        """
         self.graph_wrapper = graph_wrapper
-        self.graph = graph_wrapper.graph
+        self.cache = RouteCache(cache_size) if cache_size else None
+        self.tree_cache = RouteCache(tree_cache_size) if tree_cache_size else None
+
+        if backend is None:
+            if self.graph_wrapper.ch is not None:
+                backend = 'ch'
+            else:
+                backend = 'compact' if self.compact is not None else 'networkx'
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+        if backend in ('compact', 'astar') and self.compact is None:
+            raise ValueError(f"The {backend} backend needs TransitGraph(loader, compact=True)")
+        if backend == 'ch' and self.graph_wrapper.ch is None:
+            raise ValueError("The ch backend needs TransitGraph(loader, contract=True)")
+        if backend == 'stations' and self.graph_wrapper.station_graph is None:
+            raise ValueError("The stations backend needs TransitGraph(loader, stations=True)")
+        if backend == 'networkx' and self.graph is None:
+            raise ValueError("The networkx graph was dropped (keep_networkx=False)")
+        self.backend = backend
+
+    @property
+    def graph(self):
+        return self.graph_wrapper.graph
+
+    @property
+    def compact(self):
+        return self.graph_wrapper.compact
 
     def get_shortest_path(self, start_stop_id, end_stop_id):
         """
         Finds the shortest path between two stops.
         Returns a list of steps.
         """
+        return self._cached(self.cache, ('shortest', start_stop_id, end_stop_id, self.backend),
+                            lambda: self._shortest_path(start_stop_id, end_stop_id))
+
+    def _cached(self, cache, key, compute):
+        """Result of compute() for key, from cache when the graph hasn't changed since."""
+        if cache is None:
+            return compute()
+        version = self.graph_wrapper.version
+        found, result = cache.get(key, version)
+        if not found:
+            result = compute()
+            cache.put(key, result, version)
+        return result
+
+    def shortest_path_tree(self, origin):
+        """
+        One single-source search from origin, cached per origin.
+        Returns a ShortestPathTree, or None if origin is not in the graph.
+        """
+        return self._cached(self.tree_cache, ('tree', origin, self.backend),
+                            lambda: self._build_tree(origin))
+
+    def _build_tree(self, origin):
+        if self.backend == 'stations':
+            station_graph = self.graph_wrapper.station_graph
+            if station_graph.station_of.get(origin) not in station_graph.station_nodes:
+                return None
+            return StationPathTree(origin, station_graph)
+
+        # A* and CH queries need a target, so every compact backend shares the compact Dijkstra tree
+        if self.backend in ('compact', 'astar', 'ch'):
+            compact = self.compact
+            source = compact.node_index.get(origin)
+            if source is None:
+                return None
+            dist, pred = compact.shortest_path_tree(source)
+            node_ids = compact.node_ids
+            distances = {node_ids[i]: d for i, d in enumerate(dist) if d != INF}
+            predecessors = {node_ids[i]: e for i, e in enumerate(pred) if e >= 0}
+            return ShortestPathTree(origin, distances, predecessors, self._compact_edge)
+
+        if origin not in self.graph:
+            return None
+        pred, distances = nx.dijkstra_predecessor_and_distance(self.graph, origin, weight='weight')
+        predecessors = {v: (us[0], v) for v, us in pred.items() if us}
+        return ShortestPathTree(origin, distances, predecessors, lambda uv: self._networkx_edge(*uv))
+
+    def get_pareto_paths(self, start_stop_id, end_stop_id, max_transfers=MAX_PARETO_TRANSFERS,
+                         max_extra_time=MAX_EXTRA_TIME, max_transfer_time=None):
+        """
+        Journeys that trade travel time against transfers: fastest first, then each further one
+        slower but with fewer transfers (see StationGraph.pareto_paths for the limits).
+        Every journey gets a 'transfers' count. Runs on the station-level graph whatever the
+        backend, since only there is every change of train an explicit transfer.
+        Returns None if no journey is found.
+        """
+        station_graph = self.graph_wrapper.station_graph
+        if station_graph is None:
+            raise ValueError("Pareto routing needs TransitGraph(loader, stations=True)")
+
+        def compute():
+            options = station_graph.pareto_paths(start_stop_id, end_stop_id, max_transfers,
+                                                 max_extra_time, max_transfer_time)
+            if options is None:
+                return None
+            if not options: # Same station
+                return [dict(self._build_journey([]), transfers=0)]
+            return [dict(self._build_journey(edges), transfers=transfers) for _, transfers, edges in options]
+
+        key = ('pareto', start_stop_id, end_stop_id, max_transfers, max_extra_time, max_transfer_time)
+        return self._cached(self.cache, key, compute)
+
+    def travel_times(self, origin, destinations=None):
+        """
+        Seconds from origin to each destination (every reachable stop if None), from one cached search.
+        Unreachable destinations are left out; None if origin is not in the graph.
+        """
+        tree = self.shortest_path_tree(origin)
+        if tree is None:
+            return None
+        if destinations is None:
+            return dict(tree.distances)
+        return {d: tree.distances[d] for d in destinations if d in tree.distances}
+
+    def get_shortest_paths(self, origin, destinations):
+        """Journeys from origin to each destination (None if unreachable), from one cached search."""
+        tree = self.shortest_path_tree(origin)
+        journeys = {}
+        for destination in destinations:
+            edges = tree.edges_to(destination) if tree is not None else None
+            journeys[destination] = self._build_journey(edges) if edges is not None else None
+        return journeys
+
+    def travel_time_matrix(self, origins, destinations):
+        """
+        Travel times in seconds as a (len(origins), len(destinations)) array, inf where unreachable.
+        Runs one search per origin, so N x N costs N searches rather than N^2.
+        """
+        matrix = np.full((len(origins), len(destinations)), np.inf)
+        for row, origin in enumerate(origins):
+            tree = self.shortest_path_tree(origin)
+            if tree is None:
+                continue
+            distances = tree.distances
+            matrix[row] = [distances.get(d, np.inf) for d in destinations]
+        return matrix
+
+    def _shortest_path(self, start_stop_id, end_stop_id):
+        if self.backend == 'stations':
+            edges = self.graph_wrapper.station_graph.shortest_path(start_stop_id, end_stop_id)
+            return self._build_journey(edges) if edges is not None else None
+        if self.backend == 'compact':
+            return self._compact_shortest_path(start_stop_id, end_stop_id)
+        if self.backend == 'astar':
+            return self._compact_shortest_path(start_stop_id, end_stop_id, self.compact.astar_path)
+        if self.backend == 'ch':
+            # Shortcuts are unpacked into compact edges, so steps come out as for 'compact'
+            return self._compact_shortest_path(start_stop_id, end_stop_id, self.graph_wrapper.ch.shortest_path)
+
         try:
             path = nx.shortest_path(self.graph, source=start_stop_id, target=end_stop_id, weight='weight')
-            
-            # Reconstruct journey details
-            journey = []
-            total_time = 0
-            
-            for i in range(len(path) - 1):
-                u = path[i]
-                v = path[i+1]
-                edge_data = self.graph[u][v]
-                weight = edge_data['weight']
-                total_time += weight
-                
-                step = {
-                    'from': self.graph_wrapper.loader.get_station_name(u),
-                    'from_id': u,
-                    'to': self.graph_wrapper.loader.get_station_name(v),
-                    'to_id': v,
-                    'duration': weight,
-                    'type': edge_data.get('type', 'unknown'),
-                    'routes': list(edge_data.get('routes', []))
-                }
-                journey.append(step)
-                
-            return {
-                'total_time_seconds': total_time,
-                'steps': journey
-            }
-            
         except nx.NetworkXNoPath:
             return None
         except nx.NodeNotFound:
             return None
 
+        edges = [self._networkx_edge(u, v) for u, v in zip(path, path[1:])]
+        return self._build_journey(edges)
+
+    def _networkx_edge(self, u, v):
+        edge_data = self.graph[u][v]
+        return (u, v, edge_data['weight'], edge_data.get('type', 'unknown'), edge_data.get('routes', []))
+
+    def _compact_edge(self, e):
+        compact = self.compact
+        return (
+            compact.node_ids[compact.edge_source(e)],
+            compact.node_ids[compact.targets[e]],
+            compact.weights[e].item(),
+            compact.edge_type(e),
+            compact.edge_routes(e),
+        )
+
+    def _compact_shortest_path(self, start_stop_id, end_stop_id, search=None):
+        compact = self.compact
+        source = compact.node_index.get(start_stop_id)
+        target = compact.node_index.get(end_stop_id)
+        if source is None or target is None:
+            return None
+
+        path = (search or compact.shortest_path)(source, target)
+        if path is None:
+            return None
+
+        return self._build_journey([self._compact_edge(e) for e in path])
+
+    def _build_journey(self, edges):
+        """
+        Reconstructs journey details from (u, v, weight, type, routes) tuples.
+        Both backends produce the same output format.
+        """
+        journey = []
+        total_time = 0
+        loader = self.graph_wrapper.loader
+
+        for u, v, weight, edge_type, routes in edges:
+            total_time += weight
+
+            step = {
+                'from': loader.get_station_name(u),
+                'from_id': u,
+                'to': loader.get_station_name(v),
+                'to_id': v,
+                'duration': weight,
+                'type': edge_type,
+                'routes': list(routes)
+            }
+            journey.append(step)
+
+        return {
+            'total_time_seconds': total_time,
+            'steps': journey
+        }
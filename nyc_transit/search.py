@@ -1,30 +1,245 @@
-import pandas as pd
+import re
+import bisect
+from collections import defaultdict
+
+# Name words that are spelled several ways; both station names and queries use the long form
+ABBREVIATIONS = {
+    'st': 'street',
+    'sts': 'streets',
+    'av': 'avenue',
+    'ave': 'avenue',
+    'avs': 'avenues',
+    'sq': 'square',
+    'pkwy': 'parkway',
+    'blvd': 'boulevard',
+    'rd': 'road',
+    'pl': 'place',
+    'hts': 'heights',
+    'ctr': 'center',
+    'jct': 'junction',
+    'tpke': 'turnpike',
+    'hwy': 'highway',
+    'ft': 'fort',
+}
+
+# Match quality of a query word against a name word
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.8
+SUBSTRING_SCORE = 0.6
+# A typo match scores at most this, less per edit
+FUZZY_SCORE = 0.7
+
+# Autocomplete results for prefixes up to this many characters are computed up front
+SHORT_PREFIX_LENGTH = 3
+AUTOCOMPLETE_LIMIT = 8
+
+def max_edits(word):
+    """Typos tolerated in a query word; short words have to match exactly."""
+    if len(word) <= 2:
+        return 0
+    if len(word) <= 5:
+        return 1
+    return 2
+
+def normalize_words(text, expand_last=True):
+    """
+    Lowercase words with punctuation removed, ordinals stripped ('42nd' -> '42') and abbreviations expanded.
+    expand_last=False keeps the last word as typed, for queries whose last word may be unfinished.
+    """
+    words = re.sub(r"[^a-z0-9]+", " ", text.lower()).split()
+    words = [re.sub(r"^(\d+)(st|nd|rd|th)$", r"\1", word) for word in words]
+    expanded = [ABBREVIATIONS.get(word, word) for word in words]
+    if words and not expand_last:
+        expanded[-1] = words[-1]
+    return expanded
+
+def trigrams(word):
+    # Padded so short words and word starts still produce trigrams
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def bounded_edit_distance(a, b, limit):
+    """
+    Edit distance between a and b counting a swap of adjacent letters as one edit,
+    or limit + 1 once it is known to exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
 
 class StationSearch:
+    """
+    Station name search over a prebuilt word index.
+    Names are split into normalized words; each query word is matched exactly, as a prefix,
+    as a substring or within a few typos (found through trigram postings), so a lookup only
+    touches the words that share trigrams with the query, not every station.
+    Results are ranked by match quality, then by how many trains stop at the station.
+    """
+
     def __init__(self, loader):
         self.loader = loader
         self.stations = loader.parent_stations
+        self.station_ids = [str(stop_id) for stop_id in self.stations['stop_id']]
+        self.names = list(self.stations['stop_name'])
+        self.train_counts = self._train_counts()
+
+        # word -> stations whose name contains it
+        self.word_stations = defaultdict(set)
+        for i, name in enumerate(self.names):
+            for word in normalize_words(name):
+                self.word_stations[word].add(i)
+        self.words = sorted(self.word_stations) # For prefix ranges
+
+        # trigram -> words containing it
+        self.trigram_words = defaultdict(set)
+        for word in self.words:
+            for gram in trigrams(word):
+                self.trigram_words[gram].add(word)
+
+        self._build_prefix_index()
+
+    def _train_counts(self):
+        """Scheduled train stops per parent station, used to rank otherwise equal matches."""
+        counts = [0] * len(self.station_ids)
+        stop_times = self.loader.stop_times
+        if stop_times is None:
+            return counts
+        position = {stop_id: i for i, stop_id in enumerate(self.station_ids)}
+        for stop_id, count in stop_times['stop_id'].astype(str).value_counts().items():
+            stop = self.loader.get_stop(stop_id)
+            parent = stop['parent'] if stop and stop['parent'] else stop_id
+            if parent in position:
+                counts[position[parent]] += int(count)
+        return counts
+
+    def _build_prefix_index(self):
+        """
+        Sorted normalized names for autocomplete. Each station appears once per word of its
+        name, so "Times Sq-42 St" is found by typing "times", "square" or "42".
+        """
+        keys = []
+        for i, name in enumerate(self.names):
+            words = normalize_words(name)
+            for start in range(len(words)):
+                keys.append((' '.join(words[start:]), start > 0, i))
+        keys.sort()
+        self.prefix_keys = [key for key, _, _ in keys]
+        self.prefix_entries = [(later_word, i) for _, later_word, i in keys]
+
+        # Short prefixes match the most stations and are typed the most
+        short = {key[:n] for key in self.prefix_keys for n in range(1, SHORT_PREFIX_LENGTH + 1)}
+        self.short_prefixes = {
+            prefix: self._complete(prefix, AUTOCOMPLETE_LIMIT)
+            for prefix in short if not prefix.endswith(' ')
+        }
+
+    def _complete(self, prefix, limit):
+        """
+        Stations with a name (or a later part of it) starting with prefix, best first.
+        The last word of prefix may be unfinished, so it matches as typed and, if it is an
+        abbreviation, expanded: "st" finds "Steinway St" as well as "14 St".
+        """
+        words = prefix.split(' ')
+        expanded = ' '.join(words[:-1] + [ABBREVIATIONS.get(words[-1], words[-1])])
+        best = {}
+        for form in {prefix, expanded}:
+            start = bisect.bisect_left(self.prefix_keys, form)
+            # '~' sorts after every character normalize_words keeps
+            end = bisect.bisect_left(self.prefix_keys, form + '~', start)
+            for later_word, i in self.prefix_entries[start:end]:
+                best[i] = min(best.get(i, True), later_word)
+        ranked = sorted(best, key=lambda i: (best[i], -self.train_counts[i], len(self.names[i]), self.names[i]))
+        return ranked[:limit]
+
+    def autocomplete(self, query, limit=AUTOCOMPLETE_LIMIT):
+        """
+        Prefix completion for as-you-type station inputs, as (id, name) pairs.
+        Names that start with the query come before names where a later word does.
+        """
+        prefix = ' '.join(normalize_words(query or '', expand_last=False))
+        if not prefix:
+            return []
+        indices = self.short_prefixes.get(prefix) if limit <= AUTOCOMPLETE_LIMIT else None
+        if indices is None:
+            # Longer, or a short abbreviation no name starts with as typed ('pl' for 'place')
+            indices = self._complete(prefix, limit)
+        indices = indices[:limit]
+        return [(self.station_ids[i], self.names[i]) for i in indices]
+
+    def _match_word(self, query_word):
+        """Best score of query_word against each matching name word, as {word: score}."""
+        matches = {}
+        if query_word in self.word_stations:
+            matches[query_word] = EXACT_SCORE
+
+        # Prefix: a contiguous range of the sorted vocabulary
+        start = bisect.bisect_left(self.words, query_word)
+        for word in self.words[start:]:
+            if not word.startswith(query_word):
+                break
+            matches.setdefault(word, PREFIX_SCORE)
+
+        # Substring and typo candidates share trigrams with the query word
+        grams = trigrams(query_word)
+        shared = defaultdict(int)
+        for gram in grams:
+            for word in self.trigram_words.get(gram, ()):
+                shared[word] += 1
+        limit = max_edits(query_word)
+        for word, count in shared.items():
+            if word in matches:
+                continue
+            if len(query_word) >= 3 and query_word in word:
+                matches[word] = SUBSTRING_SCORE
+                continue
+            # Each edit changes at most 4 of the query's trigrams
+            if limit and count >= len(grams) - 4 * limit:
+                edits = bounded_edit_distance(query_word, word, limit)
+                if edits <= limit:
+                    matches[word] = FUZZY_SCORE * (1 - edits / (len(query_word) + 1))
+        return matches
 
     def search(self, query, limit=10):
         """
         Fuzzy search for stations by name.
+        Every query word has to match a word of the station name.
         """
-        if not query:
+        query_words = normalize_words(query or '')
+        if not query_words:
             return []
-        
-        query = query.lower()
-        
-        # Simple substring match for now. 
-        # Could upgrade to Levenshtein distance later.
-        matches = self.stations[self.stations['stop_name'].str.lower().str.contains(query)]
-        
+
+        scores = None
+        for query_word in query_words:
+            word_scores = defaultdict(float)
+            for word, score in self._match_word(query_word).items():
+                for i in self.word_stations[word]:
+                    word_scores[i] = max(word_scores[i], score)
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {i: scores[i] + word_scores[i] for i in scores.keys() & word_scores.keys()}
+            if not scores:
+                return []
+
+        ranked = sorted(scores, key=lambda i: (-scores[i], -self.train_counts[i], len(self.names[i]), self.names[i]))
         results = []
-        for _, row in matches.head(limit).iterrows():
+        for i in ranked[:limit]:
+            stop = self.loader.get_stop(self.station_ids[i])
             results.append({
-                'id': row['stop_id'],
-                'name': row['stop_name'],
-                'lat': row['stop_lat'],
-                'lon': row['stop_lon']
+                'id': self.station_ids[i],
+                'name': stop['name'],
+                'lat': stop['lat'],
+                'lon': stop['lon']
             })
-            
         return results
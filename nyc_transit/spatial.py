@@ -0,0 +1,199 @@
+import heapq
+import numpy as np
+import h3
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_M = 6371000.0
+
+# Approx 0.1km^2, ~200m edge length (same as h3_analysis.py)
+H3_RESOLUTION = 9
+
+# Rings to expand before handing a query to the KD-tree (e.g. a point far outside the city)
+MAX_H3_RINGS = 50
+
+# Shrinks the measured cell size so small H3 cell distortions can't break the stopping bound
+CELL_SIZE_SAFETY = 0.98
+
+def latlng_to_cell(lat, lon, res):
+    # h3.geo_to_h3 is the old (v3) name of latlng_to_cell
+    try:
+        return h3.latlng_to_cell(lat, lon, res)
+    except AttributeError:
+        return h3.geo_to_h3(lat, lon, res)
+
+def grid_ring(cell, k):
+    # h3.hex_ring is the old (v3) name of grid_ring
+    try:
+        return h3.grid_ring(cell, k)
+    except AttributeError:
+        return h3.hex_ring(cell, k)
+
+def cell_center(cell):
+    try:
+        return h3.cell_to_latlng(cell)
+    except AttributeError:
+        return h3.h3_to_geo(cell)
+
+def cell_boundary(cell):
+    try:
+        return h3.cell_to_boundary(cell)
+    except AttributeError:
+        return h3.h3_to_geo_boundary(cell)
+
+def cell_radius(cell):
+    """Smallest distance in meters from a cell's center to one of its vertices (the edge length of a regular hexagon)."""
+    lat, lon = cell_center(cell)
+    boundary = np.array(cell_boundary(cell))
+    return float(haversine(lat, lon, boundary[:, 0], boundary[:, 1]).min())
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters. Works on scalars or broadcastable NumPy arrays."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def to_unit_vectors(lats, lons):
+    """Points on the unit sphere. Straight-line (chord) distance between them grows with great-circle distance."""
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lats)
+    return np.stack([cos_lat * np.cos(lons), cos_lat * np.sin(lons), np.sin(lats)], axis=-1)
+
+def chord_to_meters(chord):
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.clip(chord / 2, 0.0, 1.0))
+
+def meters_to_chord(meters):
+    return 2 * np.sin(np.minimum(meters / EARTH_RADIUS_M, np.pi) / 2)
+
+class StationLocator:
+    """
+    Nearest-station queries over the parent stations.
+    Stations are kept in a KD-tree on the unit sphere, so k-nearest and radius
+    results are exact by great-circle (haversine) distance. An H3 cell -> stations
+    table is built alongside for cacheable cell lookups.
+    """
+
+    def __init__(self, loader, h3_resolution=H3_RESOLUTION):
+        stations = loader.parent_stations
+        self.station_ids = stations['stop_id'].astype(str).to_numpy()
+        self.names = stations['stop_name'].to_numpy()
+        self.lats = stations['stop_lat'].to_numpy(dtype=np.float64)
+        self.lons = stations['stop_lon'].to_numpy(dtype=np.float64)
+        self.tree = cKDTree(to_unit_vectors(self.lats, self.lons))
+
+        self.h3_resolution = h3_resolution
+        self.cells = [latlng_to_cell(lat, lon, h3_resolution) for lat, lon in zip(self.lats, self.lons)]
+        self.cell_stations = {}
+        for i, cell in enumerate(self.cells):
+            self.cell_stations.setdefault(cell, []).append(i)
+
+    def __len__(self):
+        return len(self.station_ids)
+
+    def nearest_batch(self, lats, lons, k=1):
+        """
+        k nearest stations for N points at once.
+        Returns (distances in meters, station indices), both shaped (N, k).
+        """
+        k = min(k, len(self))
+        n = np.asarray(lats).size
+        if k == 0:
+            return np.empty((n, 0)), np.empty((n, 0), dtype=np.intp) # No stations (or k=0): cKDTree needs k >= 1
+        chords, indices = self.tree.query(to_unit_vectors(lats, lons), k=k)
+        chords = np.asarray(chords).reshape(-1, k)
+        indices = np.asarray(indices).reshape(-1, k)
+        return chord_to_meters(chords), indices
+
+    def within_batch(self, lats, lons, radius_m):
+        """
+        Stations within radius_m of each of N points.
+        Returns a list of N (distances in meters, station indices) pairs, sorted by distance.
+        """
+        points = to_unit_vectors(lats, lons).reshape(-1, 3)
+        results = []
+        for point, hits in zip(points, self.tree.query_ball_point(points, meters_to_chord(radius_m))):
+            hits = np.asarray(hits, dtype=np.intp)
+            distances = chord_to_meters(np.linalg.norm(self.tree.data[hits] - point, axis=1))
+            order = np.argsort(distances, kind='stable')
+            results.append((distances[order], hits[order]))
+        return results
+
+    def nearest(self, lat, lon, k=1):
+        """The k nearest stations to a point, closest first."""
+        distances, indices = self.nearest_batch([lat], [lon], k)
+        return self._describe(distances[0], indices[0])
+
+    def within(self, lat, lon, radius_m):
+        """All stations within radius_m of a point, closest first."""
+        distances, indices = self.within_batch([lat], [lon], radius_m)[0]
+        return self._describe(distances, indices)
+
+    def nearest_h3(self, lat, lon, k=1):
+        """
+        Exact k nearest stations using H3 ring expansion, closest first.
+        Same result as nearest(), but only touches the station lists of the cells it expands,
+        which are the cacheable keys of cell_stations.
+        """
+        distances, indices, _ = self._nearest_h3(lat, lon, k)
+        return self._describe(distances, indices)
+
+    def _nearest_h3(self, lat, lon, k):
+        """
+        Expands rings around the query cell until the nearest point outside the expanded disk
+        is farther than the current k-th best distance.
+
+        grid_disk(center, r) covers a hexagon-shaped patch whose closest boundary points
+        are the notches between its outer cells, (3r + 1) / 2 edge lengths from the center
+        cell's center. Every station outside the disk is therefore at least
+        (3r + 1) / 2 * edge - distance(query, center) away from the query.
+        Returns (distances, indices, rings expanded).
+        """
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty(0), np.empty(0, dtype=np.intp), 0
+        center = latlng_to_cell(lat, lon, self.h3_resolution)
+        center_lat, center_lon = cell_center(center)
+        offset = float(haversine(lat, lon, center_lat, center_lon))
+        edge = cell_radius(center) * CELL_SIZE_SAFETY
+
+        best = [] # max-heap of (-distance, index), at most k entries
+        seen = 0
+        for ring in range(MAX_H3_RINGS + 1):
+            try:
+                cells = [center] if ring == 0 else grid_ring(center, ring)
+            except Exception:
+                break # Pentagon distortion; let the KD-tree answer
+
+            candidates = [i for cell in cells for i in self.cell_stations.get(cell, ())]
+            if candidates:
+                seen += len(candidates)
+                distances = haversine(lat, lon, self.lats[candidates], self.lons[candidates])
+                for d, i in zip(distances.tolist(), candidates):
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, i))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, i))
+
+            bound = (3 * ring + 1) / 2 * edge - offset
+            if len(best) == k and (-best[0][0] <= bound or seen == len(self)):
+                found = sorted((-d, i) for d, i in best)
+                return np.array([d for d, _ in found]), np.array([i for _, i in found]), ring
+
+        distances, indices = self.nearest_batch([lat], [lon], k)
+        return distances[0], indices[0], MAX_H3_RINGS
+
+    def stations_in_cell(self, cell):
+        """Indices of the stations inside an H3 cell (at h3_resolution)."""
+        return self.cell_stations.get(cell, [])
+
+    def _describe(self, distances, indices):
+        return [
+            {
+                'id': self.station_ids[i],
+                'name': self.names[i],
+                'lat': float(self.lats[i]),
+                'lon': float(self.lons[i]),
+                'distance_m': round(float(d), 1),
+            }
+            for d, i in zip(distances, indices)
+        ]
@@ -0,0 +1,303 @@
+import heapq
+import networkx as nx
+from .compact import CompactGraph, EDGE_TYPES, INF
+
+# Walking between the station entrance and a platform, as in TransitGraph's parent-child edges
+PLATFORM_WALK_TIME = 30
+
+# Changing trains at a station transfers.txt doesn't list (same default as TransitGraph)
+DEFAULT_TRANSFER_TIME = 180
+
+# Most transfers a Pareto search considers; it keeps at most this + 1 labels per node
+MAX_PARETO_TRANSFERS = 4
+
+# Options this much slower than the fastest journey aren't offered (nor searched for)
+MAX_EXTRA_TIME = 20 * 60
+
+TRANSFER = EDGE_TYPES.index('transfer')
+
+class StationGraph:
+    """
+    Collapsed transit graph with one node per (platform, route), i.e. per station, route
+    and direction, instead of one per stop.
+    Riding on is free while staying on a route's node; changing route or platform is an
+    explicit 'transfer' edge priced from transfers.txt. Stations are not nodes at all: a
+    search starts from every node of the origin station and ends at any node of the
+    destination, so it can't pass through a parent node the way the stop-level graph's
+    spurious transfers did, and there are no parent nodes to explore.
+    The search runs on a CompactGraph; node_stops maps its nodes back to stop ids.
+    """
+
+    def __init__(self, compact, node_stops, station_of, station_nodes):
+        self.compact = compact
+        self.node_stops = node_stops
+        self.station_of = station_of # Any stop id -> its station (parent) id
+        self.station_nodes = station_nodes # Station id -> its nodes
+        self._edge_types = compact.edge_types.tolist()
+        # Whether each edge leaves its station (a walk to another complex, not a platform change)
+        stations = [station_of.get(stop_id, stop_id) for stop_id in node_stops]
+        self._leaves_station = [stations[u] != stations[v] for u, v in zip(compact._sources, compact._targets)]
+
+    @classmethod
+    def build(cls, loader, segments):
+        """
+        Builds the graph from TransitGraph._segment_durations() output and the loader's transfers.
+        A ride edge weighs the median time of its route over that segment.
+        """
+        stops = loader.stops
+        has_parent = stops['parent_station'].notna()
+        station_of = dict(zip(stops['stop_id'], stops['stop_id']))
+        station_of.update(zip(stops.loc[has_parent, 'stop_id'], stops.loc[has_parent, 'parent_station']))
+        coords = dict(zip(stops['stop_id'], zip(stops['stop_lat'], stops['stop_lon'])))
+
+        graph = nx.DiGraph()
+        node_stops = {}
+
+        # Ride edges, one per route over each segment
+        rides = segments.groupby(['stop_id', 'next_stop_id', 'route_id'], sort=False)['duration'].median()
+        nodes_at = {} # stop or station id -> ride nodes there
+        for (u, v, route), weight in rides.items():
+            ends = []
+            for stop_id in (u, v):
+                node_id = f"{stop_id}|{route}"
+                if node_id not in node_stops:
+                    lat, lon = coords.get(stop_id, (float('nan'), float('nan')))
+                    graph.add_node(node_id, lat=lat, lon=lon)
+                    node_stops[node_id] = stop_id
+                    station = station_of.get(stop_id, stop_id)
+                    station_of.setdefault(stop_id, station)
+                    nodes_at.setdefault(stop_id, []).append(node_id)
+                    if station != stop_id:
+                        nodes_at.setdefault(station, []).append(node_id)
+                ends.append(node_id)
+            graph.add_edge(ends[0], ends[1], weight=float(weight), type='transit', routes={route})
+
+        # Transfers between different (platform, route) nodes; the cheapest rule wins
+        transfers = {}
+        listed = set()
+        for a, b, weight in loader.usable_transfers(DEFAULT_TRANSFER_TIME):
+            if station_of.get(a, a) == station_of.get(b, b):
+                listed.add(station_of.get(a, a))
+            for u in nodes_at.get(a, ()):
+                for v in nodes_at.get(b, ()):
+                    if u != v and weight < transfers.get((u, v), float('inf')):
+                        transfers[(u, v)] = weight
+        for station, nodes in nodes_at.items():
+            if station in listed or station_of.get(station) != station:
+                continue
+            for u in nodes:
+                for v in nodes:
+                    if u != v:
+                        transfers.setdefault((u, v), DEFAULT_TRANSFER_TIME)
+        graph.add_edges_from((u, v, {'weight': w, 'type': 'transfer'}) for (u, v), w in transfers.items())
+
+        compact = CompactGraph.from_networkx(graph)
+        index = compact.node_index
+        station_nodes = {
+            station: [index[node_id] for node_id in nodes]
+            for station, nodes in nodes_at.items() if station_of.get(station) == station
+        }
+        return cls(compact, [node_stops[node_id] for node_id in compact.node_ids], station_of, station_nodes)
+
+    def number_of_nodes(self):
+        return self.compact.number_of_nodes()
+
+    def number_of_edges(self):
+        return self.compact.number_of_edges()
+
+    def edge(self, e):
+        """(u, v, weight, type, routes) of an edge, with u and v as stop ids like the stop-level graph."""
+        compact = self.compact
+        return (
+            self.node_stops[compact.edge_source(e)],
+            self.node_stops[compact.targets[e]],
+            compact.weights[e].item(),
+            compact.edge_type(e),
+            compact.edge_routes(e),
+        )
+
+    def entry_costs(self, station):
+        """{node: cost} for starting (or ending) a search at a station: the walk to each platform."""
+        return {node: PLATFORM_WALK_TIME for node in self.station_nodes.get(station, ())}
+
+    def journey_edges(self, path, start, end):
+        """Edge tuples for a path of edges between two stations, with the platform walks at both ends."""
+        compact = self.compact
+        first = self.node_stops[compact.edge_source(path[0])]
+        last = self.node_stops[compact.targets[path[-1]]]
+        return (
+            [(start, first, float(PLATFORM_WALK_TIME), 'parent_child', [])]
+            + [self.edge(e) for e in path]
+            + [(last, end, float(PLATFORM_WALK_TIME), 'child_parent', [])]
+        )
+
+    def shortest_path(self, start_stop_id, end_stop_id, stats=None):
+        """
+        Edge tuples of the fastest journey between the stations of two stop ids (platform ids
+        resolve to their station). [] within one station, None if either is unknown or unreachable.
+        """
+        start = self.station_of.get(start_stop_id)
+        end = self.station_of.get(end_stop_id)
+        if start is None or end is None:
+            return None
+        if start == end:
+            return []
+        path = self.compact.shortest_path_multi(self.entry_costs(start), self.entry_costs(end), stats)
+        if not path:
+            return None # Unreachable, or a station no train stops at
+        return self.journey_edges(path, start, end)
+
+    def _remaining_times(self, end_nodes, start_nodes):
+        """
+        Lower bounds on the time from every node to the nearest of end_nodes, or None if no
+        start node reaches an end node.
+        A backward Dijkstra that stops once the closest start node is settled: settled nodes get
+        their exact time, every other node the radius the search reached, which no path from it
+        can beat. Searching further would tighten the bounds of detours but costs more than the
+        labels it saves.
+        """
+        compact = self.compact
+        rev_offsets, rev_edges, sources, weights = compact._rev_offsets, compact._rev_edges, compact._sources, compact._weights
+        n = compact.number_of_nodes()
+        dist = [INF] * n
+        done = [False] * n
+        heap = []
+        for node in end_nodes:
+            dist[node] = 0.0
+            heap.append((0.0, node))
+        starts = set(start_nodes)
+        fastest = INF
+        radius = INF # Stays INF if the search runs out: unsettled nodes can't reach the end
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue # Stale heap entry
+            if d > fastest:
+                radius = d
+                break
+            done[u] = True
+            if u in starts and fastest == INF:
+                fastest = d
+            for i in range(rev_offsets[u], rev_offsets[u + 1]):
+                e = rev_edges[i]
+                v = sources[e]
+                nd = d + weights[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        if fastest == INF:
+            return None
+        return [d if settled else radius for d, settled in zip(dist, done)]
+
+    def pareto_paths(self, start_stop_id, end_stop_id, max_transfers=MAX_PARETO_TRANSFERS,
+                     max_extra_time=MAX_EXTRA_TIME, max_transfer_time=None, stats=None):
+        """
+        Every journey between two stations that no other journey beats on both travel time and
+        number of transfers, as (seconds, transfers, edge tuples) fastest first (so with the
+        fewest transfers last). Only journeys with at most max_transfers transfers and at most
+        max_extra_time seconds slower than the fastest are considered, and transfers between
+        two stations longer than max_transfer_time seconds (long walks between station
+        complexes) are not used; platform changes within a station always are.
+        [] within one station, None if the stations are unknown or unreachable.
+
+        A label-setting search over (time, transfers), ordered like A* by time plus a lower
+        bound on the time left (from _remaining_times): each node keeps at most one label per
+        transfer count, and labels beaten by one with fewer transfers at the same node, or that
+        can't arrive before an already found journey with no more transfers, are dropped.
+        """
+        start = self.station_of.get(start_stop_id)
+        end = self.station_of.get(end_stop_id)
+        if start is None or end is None:
+            return None
+        if start == end:
+            return []
+        end_nodes = self.station_nodes.get(end, ())
+        if not end_nodes:
+            return None
+
+        compact = self.compact
+        offsets, targets, weights = compact._offsets, compact._targets, compact._weights
+        edge_types = self._edge_types
+        leaves_station = self._leaves_station
+        targets_at_end = set(end_nodes)
+        start_nodes = self.station_nodes.get(start, ())
+        h = self._remaining_times(end_nodes, start_nodes)
+        if h is None:
+            if stats is not None:
+                stats['settled'] = stats['labels'] = 0
+            return None
+
+        # best[node][k]: arrival time of the label at node with k transfers
+        best = {}
+        # Labels as (node, time, transfers, edge into it, previous label), for unwinding journeys
+        labels = []
+        heap = []
+        for node in start_nodes:
+            best[node] = [INF] * (max_transfers + 1)
+            best[node][0] = PLATFORM_WALK_TIME
+            labels.append((node, float(PLATFORM_WALK_TIME), 0, -1, -1))
+            heapq.heappush(heap, (PLATFORM_WALK_TIME + h[node], 0, len(labels) - 1))
+
+        arrivals = [] # (seconds, transfers, label), improving transfers as the search goes on
+        fewest = max_transfers + 1 # Transfers of the best arrival found so far
+        # Latest arrival still worth offering, once the fastest journey is known. (The bounds'
+        # fastest journey may need more than max_transfers transfers, so it can't be used.)
+        cutoff = INF
+        settled = 0
+        while heap:
+            f, k, label = heapq.heappop(heap)
+            if f + PLATFORM_WALK_TIME > cutoff:
+                break # Everything left arrives too late
+            node, t, _, _, _ = labels[label]
+            times = best[node]
+            if t > times[k] or (k and min(times[:k]) <= t):
+                continue # Replaced, or beaten by a label with fewer transfers
+            if k >= fewest:
+                continue # A journey with no more transfers arrives no later
+            settled += 1
+
+            if node in targets_at_end:
+                # Popped in bound order, so this is the fastest way to arrive with k transfers
+                arrivals.append((t + PLATFORM_WALK_TIME, k, label))
+                fewest = k
+                if k == 0:
+                    break # Nothing later can beat a direct journey
+                if cutoff == INF:
+                    cutoff = t + PLATFORM_WALK_TIME + max_extra_time
+                continue
+
+            for e in range(offsets[node], offsets[node + 1]):
+                nk = k
+                if edge_types[e] == TRANSFER:
+                    nk = k + 1
+                    if nk >= fewest:
+                        continue
+                    if max_transfer_time is not None and leaves_station[e] and weights[e] > max_transfer_time:
+                        continue
+                v = targets[e]
+                nt = t + weights[e]
+                v_times = best.get(v)
+                if v_times is None:
+                    v_times = best[v] = [INF] * (max_transfers + 1)
+                # Only keep a label that beats every label at v with as few or fewer transfers
+                if min(v_times[:nk + 1]) <= nt or nt + h[v] + PLATFORM_WALK_TIME > cutoff or h[v] == INF:
+                    continue
+                v_times[nk] = nt
+                labels.append((v, nt, nk, e, label))
+                heapq.heappush(heap, (nt + h[v], nk, len(labels) - 1))
+
+        if stats is not None:
+            stats['settled'] = settled
+            stats['labels'] = len(labels)
+        if not arrivals:
+            return None
+
+        journeys = []
+        for seconds, transfers, label in arrivals:
+            path = []
+            while labels[label][3] >= 0:
+                path.append(labels[label][3])
+                label = labels[label][4]
+            path.reverse()
+            journeys.append((seconds, transfers, self.journey_edges(path, start, end)))
+        return journeys
@@ -0,0 +1,116 @@
+import os
+import csv
+import random
+from nyc_transit import GTFSLoader
+
+# A small synthetic subway: four lines and a shuttle meeting at transfer stations, with weekday,
+# Saturday and Sunday service. The reference checks (test_*.py) route over it so they
+# run in seconds and don't need the MTA download.
+LINES = {
+    '1': [f"1{i:02d}" for i in range(1, 31)],
+    'A': [f"A{i:02d}" for i in range(1, 31)],
+    'L': [f"L{i:02d}" for i in range(1, 25)],
+    'G': [f"G{i:02d}" for i in range(1, 20)],
+}
+ORIGINS = {'1': (40.70, -74.00), 'A': (40.68, -73.95), 'L': (40.72, -73.99), 'G': (40.66, -73.97)}
+STEPS = {'1': (0.01, 0.0), 'A': (0.008, 0.003), 'L': (0.0, 0.012), 'G': (0.01, 0.004)}
+
+# A weekday-only shuttle between two stations of other lines, stopping at their platforms:
+# changing to it is a platform change within the station. Its realtime feed is set by
+# ROUTE_FEED_OVERRIDES (ACE), not by its first letter.
+SHUTTLE = ('FS', ["A20", "G18"])
+
+# Station pairs linked by transfers.txt (a walk between two neighbouring station complexes,
+# under a kilometer apart, so no walk covers ground faster than the trains)
+TRANSFERS = [("103", "L01"), ("A05", "L05"), ("L05", "G07"), ("A17", "G16")]
+# Timed transfers (type 1): the A waits for the L at A06/L06, 2 minutes apart
+TIMED_TRANSFERS = [("A06", "L06")]
+TIMED_TRANSFER_TIME = 120
+# Station whose platform changes are a timed transfer without a minimum time
+TIMED_STATION = "G10"
+
+NAMES = {
+    '115': "Times Sq-42 St", 'A15': "Times Sq-42 St", '101': "Van Cortlandt Park-242 St",
+    'L01': "8 Av", 'A20': "14 St", 'L10': "1 Av", 'G05': "Court Sq", 'L05': "Bedford Av",
+    'G01': "Steinway St", 'A30': "Stillwell Av",
+}
+
+# Weekday trips on the 1 every 4th departure leave this stop's times blank (a non-timepoint)
+UNTIMED_STOP = '105'
+
+# Thanksgiving: weekday service is replaced by the Sunday timetable
+HOLIDAY = 20261126
+
+def hhmmss(seconds):
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def write_sample_feed(directory, seed=1):
+    """Writes the sample feed's GTFS files into directory."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+
+    def write(name, header, rows):
+        with open(os.path.join(directory, name), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    stops = []
+    for route, stations in LINES.items():
+        for j, station in enumerate(stations):
+            lat = ORIGINS[route][0] + STEPS[route][0] * j
+            lon = ORIGINS[route][1] + STEPS[route][1] * j
+            name = NAMES.get(station, f"Station {station} St")
+            stops.append([station, name, lat, lon, 1, ""])
+            for direction in "NS":
+                stops.append([station + direction, name, lat, lon, "", station])
+    write("stops.txt", ["stop_id", "stop_name", "stop_lat", "stop_lon", "location_type", "parent_station"], stops)
+
+    write("routes.txt", ["agency_id", "route_id", "route_short_name", "route_long_name", "route_type", "route_color"],
+          [["MTA NYCT", route, route, f"{route} Line", 1, "EE352E"] for route in [*LINES, SHUTTLE[0]]])
+
+    trips = []
+    stop_times = []
+    for service_id in ("Weekday", "Saturday", "Sunday"):
+        headway = 300 if service_id == "Weekday" else 600
+        for route, stations in [*LINES.items(), SHUTTLE] if service_id == "Weekday" else LINES.items():
+            for direction in "NS":
+                order = stations if direction == "N" else stations[::-1]
+                for n, first in enumerate(range(5 * 3600, 25 * 3600, headway)):
+                    trip_id = f"AFA23GEN-{route}-{service_id}-00_{first // 6:06d}_{route}..{direction}01R"
+                    trips.append([route, trip_id, service_id, 1 if direction == "S" else 0])
+                    t = first
+                    for seq, station in enumerate(order, 1):
+                        if station == UNTIMED_STOP and service_id == "Weekday" and n % 4 == 0:
+                            stop_times.append([trip_id, "", "", station + direction, seq])
+                        else:
+                            stop_times.append([trip_id, hhmmss(t), hhmmss(t + 30 if seq > 1 else t), station + direction, seq])
+                        t += 90 + rng.randint(0, 60)
+    write("trips.txt", ["route_id", "trip_id", "service_id", "direction_id"], trips)
+    write("stop_times.txt", ["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"], stop_times)
+
+    transfers = []
+    for a, b in TRANSFERS:
+        transfers += [[a, b, 2, 180], [b, a, 2, 180]]
+    for a, b in TIMED_TRANSFERS:
+        transfers += [[a, b, 1, TIMED_TRANSFER_TIME], [b, a, 1, TIMED_TRANSFER_TIME]]
+    # Every station lists its own platform changes; A20's has no minimum time
+    stations = [station for stations in LINES.values() for station in stations]
+    transfers += [[station, station, 1 if station == TIMED_STATION else 2, "" if station in ("A20", TIMED_STATION) else 0]
+                  for station in stations]
+    write("transfers.txt", ["from_stop_id", "to_stop_id", "transfer_type", "min_transfer_time"], transfers)
+
+    write("calendar.txt", ["service_id", "monday", "tuesday", "wednesday", "thursday", "friday",
+                           "saturday", "sunday", "start_date", "end_date"],
+          [["Weekday", 1, 1, 1, 1, 1, 0, 0, 20260101, 20271231],
+           ["Saturday", 0, 0, 0, 0, 0, 1, 0, 20260101, 20271231],
+           ["Sunday", 0, 0, 0, 0, 0, 0, 1, 20260101, 20271231]])
+    write("calendar_dates.txt", ["service_id", "date", "exception_type"],
+          [["Weekday", HOLIDAY, 2], ["Sunday", HOLIDAY, 1]])
+
+def load_sample_feed(directory, **kwargs):
+    """Writes the sample feed into directory and returns a loaded GTFSLoader for it (snapshots go there too)."""
+    write_sample_feed(directory)
+    loader = GTFSLoader(directory, snapshot_dir=directory, **kwargs)
+    loader.load_data()
+    return loader
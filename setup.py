@@ -17,12 +17,16 @@ setup(
         "fastapi",
         "uvicorn",
         "pandas",
+        "numpy",
+        "scipy",
+        "h3",
         "networkx",
         "requests",
+        "httpx",
         "gtfs-realtime-bindings",
         "protobuf",
         "python-dotenv",
         "geopy"
     ],
-    python_requires=">=3.8",
+    python_requires=">=3.9",
 )
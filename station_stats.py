@@ -1,25 +1,43 @@
 import pandas as pd
 import os
+import datetime
 from nyc_transit import GTFSLoader
 from nyc_transit.config import RAW_DATA_DIR
 
+def typical_weekday(loader, day):
+    """
+    Returns the first Monday-Friday from day on that runs a regular weekday timetable:
+    one with service, and no calendar_dates exceptions (holidays run another timetable).
+    """
+    exception_dates = set()
+    if loader.calendar_dates is not None:
+        exception_dates = set(loader.calendar_dates['date'].astype(int))
+    candidate = day
+    for _ in range(366):
+        if candidate.weekday() < 5 and int(candidate.strftime('%Y%m%d')) not in exception_dates \
+                and loader.active_service_ids(candidate) != set():
+            return candidate
+        candidate += datetime.timedelta(days=1)
+    return day
+
 def main():
+    # Stats are for a typical weekday; the loader resolves which services run on it from the calendar
     print("Loading GTFS data...")
     loader = GTFSLoader()
     loader.load_data()
+    target_date = typical_weekday(loader, datetime.date.today())
+    # Only the trips of that day, without the previous night's still running after midnight
+    loader.filter_service_date(target_date, overnight=False)
+    print(f"Service date {target_date}.")
     
     # helper to get full path
     data_dir = loader.data_dir
     
-    # Load calendar to confirm weekday service_id
-    target_service_id = "Weekday"
-    print(f"Filtering for service_id: {target_service_id}")
-    
-    # 1. Filter trips for the target day
-    weekday_trips = loader.trips[loader.trips['service_id'] == target_service_id]
+    # 1. Trips for the target day (already filtered by the loader)
+    weekday_trips = loader.trips
     
     if weekday_trips.empty:
-        print(f"No trips found for service_id '{target_service_id}'. Unique service_ids: {loader.trips['service_id'].unique()}")
+        print(f"No trips found for {target_date}.")
         return
 
     print(f"Found {len(weekday_trips)} weekday trips.")
@@ -0,0 +1,86 @@
+import argparse
+import collections
+import os
+import time
+import requests
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from nyc_transit.config import GTFS_REALTIME_URLS
+
+# Serves recorded GTFS-RT protobuf files so RealTimeHandler can be exercised offline:
+#   python stub_feed_server.py record feeds/      # save the live feeds as feeds/<feed_id>.pb
+#   python stub_feed_server.py serve feeds/       # serve them on http://127.0.0.1:8765/<feed_id>
+# then point the handler at it:
+#   RealTimeHandler(urls=stub_urls("http://127.0.0.1:8765"))
+
+def stub_urls(base_url, feed_ids=GTFS_REALTIME_URLS.keys()):
+    """Feed URL map for a running stub server."""
+    return {feed_id: f"{base_url}/{feed_id}" for feed_id in feed_ids}
+
+def record(feed_dir):
+    os.makedirs(feed_dir, exist_ok=True)
+    for feed_id, url in GTFS_REALTIME_URLS.items():
+        try:
+            response = requests.get(url, timeout=10)
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Skipping {feed_id}: {e}")
+            continue
+        with open(os.path.join(feed_dir, f"{feed_id}.pb"), 'wb') as f:
+            f.write(response.content)
+        print(f"Recorded {feed_id} ({len(response.content)} bytes)")
+
+def make_server(feed_dir, port, delay=0.0, delays=None):
+    """
+    An HTTP server for the recorded feeds (port 0 picks a free one). delays overrides delay per
+    feed_id. server.requests counts the requests per feed_id.
+    """
+    delays = delays or {}
+    requests_seen = collections.Counter()
+
+    class FeedHandler(BaseHTTPRequestHandler):
+        # Keep-alive, like the real endpoint
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            feed_id = self.path.strip('/')
+            requests_seen[feed_id] += 1
+            path = os.path.join(feed_dir, f"{feed_id}.pb")
+            if not os.path.exists(path):
+                self.send_error(404, f"No recorded feed {feed_id}")
+                return
+            with open(path, 'rb') as f:
+                body = f.read()
+            wait = delays.get(feed_id, delay)
+            if wait:
+                time.sleep(wait) # Simulate upstream latency
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-protobuf')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), FeedHandler)
+    server.daemon_threads = True
+    server.requests = requests_seen
+    return server
+
+def serve(feed_dir, port, delay=0.0):
+    server = make_server(feed_dir, port, delay)
+    print(f"Serving {feed_dir} on http://127.0.0.1:{port}")
+    server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or serve GTFS-RT feeds for offline testing")
+    parser.add_argument("mode", choices=["record", "serve"])
+    parser.add_argument("feed_dir")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before each response")
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        record(args.feed_dir)
+    else:
+        serve(args.feed_dir, args.port, args.delay)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+import gzip
+import json
+import tempfile
+import time
+from sample_feed import write_sample_feed, SHUTTLE
+from test_realtime import make_feed
+from nyc_transit import api
+from nyc_transit.api import StaticPayload, accepts_gzip
+from nyc_transit.realtime import RealTimeHandler
+
+# Checks for the API's cached payloads (ETags and content negotiation) and for the service day
+# rollover, on the sample feed. Run with pytest or `python test_api.py`.
+
+# The sample feed's shuttle only runs on weekdays
+SUNDAY = datetime.date(2026, 10, 18)
+MONDAY = datetime.date(2026, 10, 19)
+
+class FakeRequest:
+    def __init__(self, **headers):
+        self.headers = {name.replace('_', '-'): value for name, value in headers.items()}
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+def test_accept_encoding_q_values():
+    assert accepts_gzip("gzip, deflate, br")
+    assert accepts_gzip("br;q=1.0, gzip;q=0.5")
+    assert accepts_gzip("*")
+    assert not accepts_gzip("gzip;q=0")
+    assert not accepts_gzip("identity")
+    assert not accepts_gzip("*;q=0.5, gzip;q=0")
+
+def test_each_encoding_has_its_own_etag():
+    payload = StaticPayload({"stations": [{"id": "101", "name": "Van Cortlandt Park-242 St"}]})
+    plain = payload.response(FakeRequest(accept_encoding="identity"))
+    zipped = payload.response(FakeRequest(accept_encoding="gzip"))
+    assert plain.headers["etag"] != zipped.headers["etag"]
+    assert json.loads(gzip.decompress(zipped.body)) == json.loads(plain.body)
+    assert "content-encoding" not in payload.response(FakeRequest(accept_encoding="gzip;q=0")).headers
+
+    # Revalidation needs the ETag of the same representation; W/ validators compare weakly
+    etag = zipped.headers["etag"]
+    assert payload.response(FakeRequest(accept_encoding="gzip", if_none_match=etag)).status_code == 304
+    assert payload.response(FakeRequest(accept_encoding="gzip", if_none_match=f'"x", W/{etag}')).status_code == 304
+    assert payload.response(FakeRequest(accept_encoding="identity", if_none_match=etag)).status_code == 200
+    assert payload.response(FakeRequest(if_none_match="*")).status_code == 304
+
+def test_rollover_swaps_the_whole_day():
+    with tempfile.TemporaryDirectory() as directory:
+        write_sample_feed(directory)
+        api.service_day = api.ServiceDay(SUNDAY, directory, directory)
+        api.rt_handler = RealTimeHandler()
+        api.rt_handler.station_feeds = api.service_day.station_feeds
+
+        def shuttle_rides():
+            journey = api.get_route('A20', 'G18', depart='08:00', live=False)
+            return [step for step in journey['steps'] if SHUTTLE[0] in step['routes']]
+
+        sunday = json.loads(api.autocomplete("station g1", 3).body)
+        assert api.rt_handler.station_feeds['G18'] == {'G'}
+        assert not shuttle_rides()
+
+        assert asyncio.run(api.roll_over(MONDAY))
+        assert api.service_day.loader.service_date == MONDAY
+        # The shuttle's trains rank G18 first and add its feed (ACE, by ROUTE_FEED_OVERRIDES)
+        assert api.autocomplete_payload.cache_info().currsize == 0
+        monday = json.loads(api.autocomplete("station g1", 3).body)
+        assert sunday[0][0] != 'G18' and monday[0][0] == 'G18'
+        assert api.search_stations("Station G1 St")["results"][0]["id"] == 'G18'
+        assert api.rt_handler.station_feeds['G18'] == {'G', 'ACE'}
+        assert shuttle_rides()
+        assert api.get_travel_times('A20', max_minutes=None)["stations"]
+    api.realtime_executor.submit(lambda: None).result()
+
+def test_arrival_stream():
+    now = time.time()
+    handler = RealTimeHandler(urls={'L': 'unused'})
+    handler.update_feeds({'L': make_feed({'t1': ('L', [('L02N', now + 60), ('L05N', now + 200)])})})
+    api.rt_handler = handler
+    keepalive = api.STREAM_KEEPALIVE
+    api.STREAM_KEEPALIVE = 0.05
+
+    async def stream():
+        request = FakeRequest()
+        events = (await api.stream_arrivals(request, stations="L02N")).body_iterator
+        received = [await anext(events)]
+        assert len(handler.ingestor._subscribers) == 1
+
+        # A poll that changes L02 sends its arrivals; one that only changes L05 doesn't
+        handler.update_feeds({'L': make_feed({'t1': ('L', [('L02N', now + 90), ('L05N', now + 200)])})})
+        received.append(await anext(events))
+        handler.update_feeds({'L': make_feed({'t1': ('L', [('L02N', now + 90), ('L05N', now + 260)])})})
+        received.append(await anext(events))
+
+        request.disconnected = True
+        async for event in events:
+            received.append(event)
+        return received
+
+    try:
+        first, changed, idle, *rest = asyncio.run(stream())
+    finally:
+        api.STREAM_KEEPALIVE = keepalive
+    payload = lambda event: json.loads(event.split("data: ", 1)[1])
+    assert first.startswith("event: arrivals\n") and payload(first)["station_id"] == "L02N"
+    assert [a['time'] for a in payload(first)['arrivals']] == [int(now + 60)]
+    assert [a['time'] for a in payload(changed)['arrivals']] == [int(now + 90)]
+    assert idle == ": keepalive\n\n"
+    # A disconnected client ends the stream and drops its queue
+    assert all(event == ": keepalive\n\n" for event in rest)
+    assert not handler.ingestor._subscribers
+
+if __name__ == "__main__":
+    test_accept_encoding_q_values()
+    test_each_encoding_has_its_own_etag()
+    test_rollover_swaps_the_whole_day()
+    test_arrival_stream()
+    print("Payloads ok.")
@@ -0,0 +1,38 @@
+import tempfile
+import numpy as np
+import pandas as pd
+from sample_feed import load_sample_feed
+from nyc_transit import TransitGraph
+from nyc_transit.data_loader import parse_gtfs_times, format_gtfs_times, MISSING_TIME
+
+# Checks for parsing GTFS times and for the memory-optimized loader: a graph built from it must
+# be the one built from the plain loader. Run with pytest or `python test_loader.py`.
+
+def test_parse_gtfs_times():
+    times = pd.Series(["05:00:00", "25:10:00", "", None, np.nan, "05:00:00", "23:59:59", "bad"], index=range(10, 18))
+    parsed = parse_gtfs_times(times)
+    assert list(parsed.index) == list(times.index)
+    assert parsed.dtype == 'int32'
+    # Times past midnight aren't wrapped; blank, missing and unreadable ones are MISSING_TIME
+    assert parsed.tolist() == [18000, 90600, MISSING_TIME, MISSING_TIME, MISSING_TIME, 18000, 86399, MISSING_TIME]
+    assert format_gtfs_times(parsed[:2]).tolist() == ["05:00:00", "25:10:00"]
+    assert format_gtfs_times(parsed).isna().tolist() == [False, False, True, True, True, False, False, True]
+
+def test_parse_empty_times():
+    assert parse_gtfs_times(pd.Series([], dtype=object)).tolist() == []
+    assert parse_gtfs_times(pd.Series([None, None])).tolist() == [MISSING_TIME, MISSING_TIME]
+
+def edge_weights(directory, optimize_memory):
+    graph = TransitGraph(load_sample_feed(directory, optimize_memory=optimize_memory))
+    return {(u, v): data['weight'] for u, v, data in graph.graph.edges(data=True)}
+
+def test_optimized_loader_builds_the_same_graph():
+    with tempfile.TemporaryDirectory() as plain, tempfile.TemporaryDirectory() as optimized:
+        expected = edge_weights(plain, False)
+        assert edge_weights(optimized, True) == expected
+
+if __name__ == "__main__":
+    test_parse_gtfs_times()
+    test_parse_empty_times()
+    test_optimized_loader_builds_the_same_graph()
+    print("Loader ok.")
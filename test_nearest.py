@@ -0,0 +1,54 @@
+import random
+import tempfile
+import numpy as np
+import pandas as pd
+from sample_feed import load_sample_feed
+from nyc_transit import StationLocator
+from nyc_transit.spatial import haversine
+
+# Reference checks for StationLocator: its answers must equal a brute-force haversine scan
+# over every station. Run with pytest or `python test_nearest.py`.
+
+QUERIES = 200
+
+class EmptyLoader:
+    parent_stations = pd.DataFrame({'stop_id': [], 'stop_name': [], 'stop_lat': [], 'stop_lon': []})
+
+def random_points(locator, seed=7):
+    """Query points around (and a little beyond) the stations' bounding box."""
+    rng = random.Random(seed)
+    lat_range = (locator.lats.min() - 0.02, locator.lats.max() + 0.02)
+    lon_range = (locator.lons.min() - 0.02, locator.lons.max() + 0.02)
+    return [(rng.uniform(*lat_range), rng.uniform(*lon_range)) for _ in range(QUERIES)]
+
+def brute_force(locator, lat, lon):
+    """Distances to every station, and the stations by distance."""
+    distances = haversine(lat, lon, locator.lats, locator.lons)
+    return distances, np.argsort(distances, kind='stable')
+
+def test_nearest_matches_brute_force():
+    with tempfile.TemporaryDirectory() as directory:
+        locator = StationLocator(load_sample_feed(directory))
+    for lat, lon in random_points(locator):
+        distances, order = brute_force(locator, lat, lon)
+        found = locator.nearest(lat, lon, k=5)
+        assert np.allclose([s['distance_m'] for s in found], distances[order[:5]], atol=0.1)
+
+        for k in (1, 5, 12):
+            assert locator.nearest_h3(lat, lon, k) == locator.nearest(lat, lon, k)
+
+        inside = locator.within(lat, lon, 800)
+        assert sorted(s['id'] for s in inside) == sorted(locator.station_ids[distances <= 800])
+
+def test_empty_locator():
+    locator = StationLocator(EmptyLoader())
+    distances, indices = locator.nearest_batch([40.7, 40.8], [-74.0, -74.0], k=3)
+    assert distances.shape == indices.shape == (2, 0)
+    assert locator.nearest(40.7, -74.0, k=5) == []
+    assert locator.within(40.7, -74.0, 500) == []
+    assert locator.nearest_h3(40.7, -74.0, k=5) == []
+
+if __name__ == "__main__":
+    test_nearest_matches_brute_force()
+    test_empty_locator()
+    print("StationLocator matches the brute-force scan.")
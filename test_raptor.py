@@ -0,0 +1,148 @@
+import datetime
+import random
+import tempfile
+from sample_feed import load_sample_feed
+from nyc_transit import RaptorRouter
+from nyc_transit.raptor import NO_SERVICE, realtime_trip_key, service_day_start
+
+# Reference check for RaptorRouter: its earliest arrivals must equal those of a plain
+# connection scan over the same timetable arrays, static or with live predictions applied.
+# Run with pytest or `python test_raptor.py`.
+
+QUERIES = 60
+MONDAY = datetime.date(2026, 10, 19)
+
+def connections(raptor, arrivals, departures):
+    """
+    Every ride between two consecutive stops a trip serves as (departure, arrival, from, to, trip),
+    by departure. Stops the trip no longer serves (NO_SERVICE) are ridden through.
+    """
+    rides = []
+    for p in range(len(raptor._pattern_stop_offsets) - 1):
+        n_trips = raptor._pattern_trip_offsets[p + 1] - raptor._pattern_trip_offsets[p]
+        first = raptor._pattern_stop_offsets[p]
+        n_stops = raptor._pattern_stop_offsets[p + 1] - first
+        base = raptor._pattern_time_offsets[p]
+        for trip in range(n_trips):
+            served = [pos for pos in range(n_stops) if departures[base + pos * n_trips + trip] != NO_SERVICE]
+            for pos, following in zip(served, served[1:]):
+                departure = int(departures[base + pos * n_trips + trip])
+                arrival = int(arrivals[base + following * n_trips + trip])
+                rides.append((departure, arrival, raptor._pattern_stops[first + pos],
+                              raptor._pattern_stops[first + following], (p, trip)))
+    rides.sort()
+    return rides
+
+def connection_scan(raptor, rides, sources, targets, departure):
+    """Earliest arrival at any of targets (timetable stop indices) leaving any of sources at departure."""
+    best = {}
+
+    def reach(stop, t):
+        if t < best.get(stop, float('inf')):
+            best[stop] = t
+            for i in range(raptor._transfer_offsets[stop], raptor._transfer_offsets[stop + 1]):
+                q = raptor._transfer_targets[i]
+                best[q] = min(best.get(q, float('inf')), t + raptor._transfer_times[i])
+
+    for stop in sources:
+        reach(stop, departure)
+    boarded = set()
+    for dep, arr, u, v, trip in rides:
+        if dep < departure:
+            continue
+        if trip in boarded or best.get(u, float('inf')) <= dep:
+            boarded.add(trip)
+            reach(v, arr)
+    return min(best.get(stop, float('inf')) for stop in targets)
+
+def check_against_connection_scan(raptor, live, seed=3):
+    """Runs random queries and returns the ones whose arrival differs from the connection scan."""
+    arrivals, departures, _, _ = raptor._timetable(live)
+    rides = connections(raptor, arrivals, departures)
+    rng = random.Random(seed)
+    stations = [str(s) for s in raptor.loader.parent_stations['stop_id']]
+    mismatches = []
+    for _ in range(QUERIES):
+        a, b = rng.sample(stations, 2)
+        departure = rng.randint(5 * 3600, 24 * 3600)
+        journey = raptor.get_earliest_arrival(a, b, departure, live=live)
+        expected = connection_scan(raptor, rides, raptor.stops_for(a), raptor.stops_for(b), departure)
+        got = departure + journey['total_time_seconds'] if journey else float('inf')
+        if got != expected:
+            mismatches.append((a, b, departure, got, expected))
+        if journey:
+            assert sum(step['duration'] for step in journey['steps']) == journey['total_time_seconds']
+    return mismatches
+
+def test_earliest_arrival_matches_connection_scan():
+    with tempfile.TemporaryDirectory() as directory:
+        raptor = RaptorRouter(load_sample_feed(directory, optimize_memory=True), max_transfers=8)
+        assert check_against_connection_scan(raptor, live=False) == []
+
+def random_predictions(raptor, seed=5):
+    """
+    Predictions for a sample of trips as RealTimeHandler.trip_predictions returns them: some
+    canceled, the rest running early or late with some stops skipped.
+    """
+    rng = random.Random(seed)
+    day_start = service_day_start(MONDAY)
+    predictions = {}
+    for trip in rng.sample(range(len(raptor.trip_ids)), len(raptor.trip_ids) // 3):
+        key = realtime_trip_key(raptor.trip_ids[trip])
+        if rng.random() < 0.1:
+            predictions[key] = ('20261019', True, ())
+            continue
+        pattern, slots = raptor._trip_slots(trip)
+        stops = raptor._pattern_stops[raptor._pattern_stop_offsets[pattern]:raptor._pattern_stop_offsets[pattern + 1]]
+        delay = rng.randint(-30, 240)
+        updates = []
+        for pos in range(rng.randrange(len(stops)), len(stops)):
+            if rng.random() < 0.3:
+                delay += rng.randint(-20, 120)
+                arrival = day_start + int(raptor.arrivals[slots[pos]]) + delay
+                updates.append((raptor.stop_ids[stops[pos]], arrival, 0, rng.random() < 0.1))
+        predictions[key] = ('20261019', False, tuple(updates))
+    return predictions
+
+def test_live_arrival_matches_connection_scan():
+    with tempfile.TemporaryDirectory() as directory:
+        raptor = RaptorRouter(load_sample_feed(directory, optimize_memory=True), max_transfers=8)
+        assert raptor.apply_realtime(random_predictions(raptor), MONDAY) > 0
+        assert check_against_connection_scan(raptor, live=True) == []
+
+def test_predictions_apply_to_the_running_schedule():
+    with tempfile.TemporaryDirectory() as directory:
+        raptor = RaptorRouter(load_sample_feed(directory, optimize_memory=True))
+    # The Weekday and Saturday copies of a trip share its realtime id
+    key = realtime_trip_key('AFA23GEN-1-Weekday-00_003100_1..N01R')
+    by_service = {raptor.trip_services[trip]: trip for trip in raptor.trip_keys[key]}
+    assert {'Weekday', 'Saturday', 'Sunday'} <= by_service.keys()
+
+    def live_arrivals(service):
+        _, slots = raptor._trip_slots(by_service[service])
+        return raptor.live[1][slots]
+
+    # Canceled on a Monday: only the weekday trip stops running
+    assert raptor.apply_realtime({key: ('20261019', True, ())}) == 1
+    assert (live_arrivals('Weekday') == NO_SERVICE).all()
+    assert (live_arrivals('Saturday') != NO_SERVICE).all() and (live_arrivals('Sunday') != NO_SERVICE).all()
+    # Without a start date the prediction is for service_date's schedule
+    assert raptor.apply_realtime({key: ('', True, ())}, datetime.date(2026, 10, 17)) == 1
+    assert (live_arrivals('Saturday') == NO_SERVICE).all() and (live_arrivals('Weekday') != NO_SERVICE).all()
+
+def test_journeys_trade_time_for_transfers():
+    with tempfile.TemporaryDirectory() as directory:
+        raptor = RaptorRouter(load_sample_feed(directory, optimize_memory=True))
+        journeys = raptor.get_journeys('101', 'L20', '08:00')
+        assert journeys
+        # Each extra transfer must buy an earlier arrival
+        for earlier, later in zip(journeys, journeys[1:]):
+            assert later['transfers'] > earlier['transfers']
+            assert later['total_time_seconds'] < earlier['total_time_seconds']
+
+if __name__ == "__main__":
+    test_earliest_arrival_matches_connection_scan()
+    test_live_arrival_matches_connection_scan()
+    test_predictions_apply_to_the_running_schedule()
+    test_journeys_trade_time_for_transfers()
+    print("RAPTOR matches the connection scan.")
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from google.transit import gtfs_realtime_pb2
+from sample_feed import load_sample_feed
+from stub_feed_server import make_server, stub_urls
+from nyc_transit import api
+from nyc_transit.realtime import RealTimeHandler, AsyncFeedClient, FeedPoller
+
+# Checks for applying GTFS-RT polls as diffs and for fetching feeds, on hand-built feeds
+# (served by stub_feed_server.py where they are fetched). Run with pytest or `python test_realtime.py`.
+
+def make_feed(trips, canceled=()):
+    """A FeedMessage from {trip_id: (route_id, [(stop_id, arrival time)])}, with the canceled trip_ids marked so."""
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "1.0"
+    for trip_id, (route_id, stops) in trips.items():
+        entity = feed.entity.add()
+        entity.id = trip_id
+        entity.trip_update.trip.trip_id = trip_id
+        entity.trip_update.trip.route_id = route_id
+        if trip_id in canceled:
+            entity.trip_update.trip.schedule_relationship = gtfs_realtime_pb2.TripDescriptor.CANCELED
+        for stop_id, arrival in stops:
+            update = entity.trip_update.stop_time_update.add()
+            update.stop_id = stop_id
+            update.arrival.time = int(arrival)
+    return feed
+
+def serve_feeds(directory, **kwargs):
+    """
+    Writes a small ACE, G and L feed into directory and serves them with the stub server.
+    G18 has arrivals in G (on the G) and ACE (on the FS shuttle). Returns (server, urls).
+    """
+    now = time.time()
+    feeds = {
+        'ACE': make_feed({'fs1': ('FS', [('G18S', now + 120)]), 'a1': ('A', [('A05N', now + 60)])}),
+        'G': make_feed({'g1': ('G', [('G18N', now + 90)])}),
+        'L': make_feed({'l1': ('L', [('L01N', now + 30)])}),
+    }
+    for feed_id, feed in feeds.items():
+        with open(os.path.join(directory, f"{feed_id}.pb"), 'wb') as f:
+            f.write(feed.SerializeToString())
+    server = make_server(directory, 0, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stub_urls(f"http://127.0.0.1:{server.server_address[1]}", feeds)
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+
+def test_polls_apply_as_diffs():
+    now = time.time()
+    handler = RealTimeHandler(urls={'L': 'unused'})
+    queue = handler.ingestor.subscribe()
+
+    deltas = handler.update_feeds({'L': make_feed({
+        't1': ('L', [('L01N', now + 60), ('L02N', now + 120)]),
+        't2': ('L', [('L02S', now + 90)]),
+    })})
+    assert [(d.added, d.stations) for d in deltas] == [({'t1', 't2'}, {'L01', 'L02'})]
+
+    # t1 is later at L02, t2 is gone and t3 is new; L01 didn't change
+    deltas = handler.update_feeds({'L': make_feed({
+        't1': ('L', [('L01N', now + 60), ('L02N', now + 180)]),
+        't3': ('L', [('L05N', now + 300)]),
+    })})
+    (delta,) = deltas
+    assert (delta.added, delta.updated, delta.removed) == ({'t3'}, {'t1'}, {'t2'})
+    assert delta.stations == {'L02', 'L05'}
+    assert [a['time'] for a in handler.lookup_arrivals('L02')] == [int(now + 180)]
+    assert [a['direction'] for a in handler.lookup_arrivals('L01N')] == ['N']
+
+    # An identical poll is not a change
+    assert handler.update_feeds({'L': make_feed({
+        't1': ('L', [('L01N', now + 60), ('L02N', now + 180)]),
+        't3': ('L', [('L05N', now + 300)]),
+    })}) == []
+    assert queue.qsize() == 2
+
+def test_prediction_only_changes_reach_listeners():
+    now = time.time()
+    trips = {'t1': ('L', [('L01N', now + 60), ('L02N', now + 120)])}
+    handler = RealTimeHandler(urls={'L': 'unused'})
+    calls = []
+    handler.add_listener(lambda h, deltas: calls.append(deltas))
+    handler.update_feeds({'L': make_feed(trips)})
+    assert len(calls) == 1
+
+    # Same arrivals, but the trip is now canceled: no arrivals delta, new predictions
+    assert handler.update_feeds({'L': make_feed(trips, canceled={'t1'})}) == []
+    assert calls[-1] == [] and len(calls) == 2
+    assert handler.trip_predictions()['t1'][1]
+
+    handler.update_feeds({'L': make_feed(trips, canceled={'t1'})})
+    assert len(calls) == 2
+
+def test_slow_feed_doesnt_hold_up_the_others():
+    async def fetch(client):
+        started = time.monotonic()
+        try:
+            return await client.fetch_all(), time.monotonic() - started
+        finally:
+            await client.aclose()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server, urls = serve_feeds(directory, delays={'G': 2})
+        try:
+            feeds, elapsed = asyncio.run(fetch(AsyncFeedClient(urls, timeout=0.3)))
+        finally:
+            stop(server)
+    assert sorted(feeds) == ['ACE', 'L']
+    assert elapsed < 1
+
+def test_poller_fetches_once_per_interval():
+    async def read_while_polling(handler, poller, server):
+        await poller.start()
+        while handler.arrivals_index is None:
+            await asyncio.sleep(0.01)
+        server.requests.clear()
+
+        async def reader():
+            answers = []
+            deadline = time.monotonic() + 1
+            while time.monotonic() < deadline:
+                answers.append(await handler.get_arrivals_async('G18'))
+                await asyncio.sleep(0.005)
+            return answers
+
+        try:
+            return await asyncio.gather(*(reader() for _ in range(50)))
+        finally:
+            await poller.stop()
+            await handler.aclose()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server, urls = serve_feeds(directory)
+        handler = RealTimeHandler(urls=urls)
+        try:
+            readers = asyncio.run(read_while_polling(handler, FeedPoller(handler, interval=0.2), server))
+        finally:
+            stop(server)
+    # A second of 50 busy readers still costs one fetch per feed per interval
+    assert all(3 <= server.requests[feed_id] <= 7 for feed_id in urls), server.requests
+    assert all(len(answer) == 2 for answers in readers for answer in answers)
+
+def test_arrivals_fetch_only_the_stations_feeds():
+    async def arrivals(station_id):
+        try:
+            return await api.get_arrivals(station_id)
+        finally:
+            await api.rt_handler.aclose()
+
+    with tempfile.TemporaryDirectory() as directory:
+        loader = load_sample_feed(directory)
+        server, urls = serve_feeds(directory)
+        api.rt_handler = RealTimeHandler(urls=urls, loader=loader)
+        try:
+            body = asyncio.run(arrivals('G18'))
+        finally:
+            stop(server)
+    # The G, and the FS shuttle whose feed is ACE by ROUTE_FEED_OVERRIDES; not the L
+    assert dict(server.requests) == {'ACE': 1, 'G': 1}
+    assert sorted(arrival['route'] for arrival in body['arrivals']) == ['FS', 'G']
+
+if __name__ == "__main__":
+    test_polls_apply_as_diffs()
+    test_prediction_only_changes_reach_listeners()
+    test_slow_feed_doesnt_hold_up_the_others()
+    test_poller_fetches_once_per_interval()
+    test_arrivals_fetch_only_the_stations_feeds()
+    print("Realtime diffs ok.")
@@ -0,0 +1,264 @@
+import heapq
+import random
+import tempfile
+from sample_feed import load_sample_feed, TIMED_TRANSFERS, TIMED_TRANSFER_TIME, TIMED_STATION, SHUTTLE
+from nyc_transit import TransitGraph, Router
+from nyc_transit.station_graph import PLATFORM_WALK_TIME, TRANSFER
+
+# Checks for the static routing backends on the sample feed: each must find journeys as short
+# as networkx's Dijkstra. Run with pytest or `python test_routing.py`.
+
+PAIRS = [('101', '130'), ('101', 'L20'), ('A01', 'G19'), ('L24', '115'), ('G01', 'A30')]
+QUERIES = 400
+
+def build_graph(directory):
+    """Sample graph with every backend's structures; the hierarchy is saved in directory."""
+    graph = TransitGraph(load_sample_feed(directory, optimize_memory=True), compact=True, stations=True)
+    graph.build_contraction(directory)
+    return graph
+
+def check_against_dijkstra(graph, backend, nodes=None, seed=1):
+    """
+    Routes random pairs of nodes (default: every node) with backend and networkx's Dijkstra.
+    Returns the pairs whose total times differ, or that only one of them can connect; every
+    journey found must be a connected walk from start to end.
+    """
+    reference = Router(graph, backend='networkx', cache_size=0)
+    router = Router(graph, backend=backend, cache_size=0)
+    rng = random.Random(seed)
+    nodes = list(graph.compact.node_ids) if nodes is None else nodes
+    mismatches = []
+    for _ in range(QUERIES):
+        a, b = rng.sample(nodes, 2)
+        expected = reference.get_shortest_path(a, b)
+        journey = router.get_shortest_path(a, b)
+        if (journey is None) != (expected is None) or (
+                journey and abs(journey['total_time_seconds'] - expected['total_time_seconds']) > 1e-6):
+            mismatches.append((a, b))
+        if journey:
+            steps = journey['steps']
+            assert steps[0]['from_id'] == a and steps[-1]['to_id'] == b
+            assert all(step['to_id'] == following['from_id'] for step, following in zip(steps, steps[1:]))
+    return mismatches
+
+def test_compact_matches_networkx():
+    with tempfile.TemporaryDirectory() as directory:
+        graph = build_graph(directory)
+    # A stop that no trip or transfer reaches
+    graph.graph.add_node('island', name="Island", lat=40.75, lon=-73.9, parent=None)
+    graph.build_compact()
+    assert check_against_dijkstra(graph, 'compact') == []
+    # Between stations, which route through their platforms
+    stations = [str(s) for s in graph.loader.parent_stations['stop_id']] + ['island']
+    assert check_against_dijkstra(graph, 'compact', stations) == []
+    for backend in ('networkx', 'compact'):
+        router = Router(graph, backend=backend)
+        assert router.get_shortest_path('101', 'island') is None
+        assert router.get_shortest_path('island', '101') is None
+
+def test_astar_matches_dijkstra():
+    with tempfile.TemporaryDirectory() as directory:
+        graph = build_graph(directory)
+    # A zero speed bound would fall back to plain Dijkstra and check nothing
+    assert graph.compact.max_speed() > 0
+    assert check_against_dijkstra(graph, 'astar') == []
+
+def settled_nodes(compact, heuristic=True, seed=1):
+    """Nodes settled by QUERIES random A* searches on compact, or by Dijkstra without the heuristic."""
+    rng = random.Random(seed)
+    speed = compact.max_speed()
+    if not heuristic:
+        compact._max_speed = 0.0
+    settled = 0
+    try:
+        for _ in range(QUERIES):
+            stats = {}
+            compact.astar_path(*rng.sample(range(compact.number_of_nodes()), 2), stats)
+            settled += stats['settled']
+    finally:
+        compact._max_speed = speed
+    return settled
+
+def test_astar_settles_fewer_nodes():
+    with tempfile.TemporaryDirectory() as directory:
+        graph = build_graph(directory)
+    speed = graph.compact.max_speed()
+    # The walks are slower than the trains, so they don't weaken the bound
+    assert graph.compact.head_start() == 0
+    assert settled_nodes(graph.compact) < 0.8 * settled_nodes(graph.compact, heuristic=False)
+
+    # A free transfer between two stations takes a head start off the bound instead of
+    # dropping it to plain Dijkstra
+    a, b = TIMED_TRANSFERS[0]
+    graph.graph.add_edge(a, b, weight=0, type='transfer')
+    graph.build_compact()
+    assert graph.compact.max_speed() == speed and 0 < graph.compact.head_start() < 60
+    assert check_against_dijkstra(graph, 'astar') == []
+    assert settled_nodes(graph.compact) < 0.8 * settled_nodes(graph.compact, heuristic=False)
+
+def test_contraction_matches_dijkstra():
+    with tempfile.TemporaryDirectory() as directory:
+        graph = build_graph(directory)
+    assert check_against_dijkstra(graph, 'ch') == []
+
+def station_transfers(station_graph):
+    """{(from station, to station): cheapest transfer} over the station graph's transfer edges."""
+    station_of = station_graph.station_of
+    cheapest = {}
+    for e in range(station_graph.number_of_edges()):
+        u, v, weight, edge_type, _ = station_graph.edge(e)
+        if edge_type == 'transfer':
+            key = (station_of[u], station_of[v])
+            cheapest[key] = min(weight, cheapest.get(key, float('inf')))
+    return cheapest
+
+def test_timed_transfers_are_usable():
+    with tempfile.TemporaryDirectory() as directory:
+        graph = build_graph(directory)
+    transfers = station_transfers(graph.station_graph)
+    for a, b in TIMED_TRANSFERS:
+        assert graph.graph[a][b]['weight'] == TIMED_TRANSFER_TIME
+        assert transfers[(a, b)] == transfers[(b, a)] == TIMED_TRANSFER_TIME
+    # Without a minimum time, trains wait for a timed transfer
+    assert transfers[(TIMED_STATION, TIMED_STATION)] == 0
+
+def test_station_graph_agrees_with_stop_graph():
+    with tempfile.TemporaryDirectory() as directory:
+        graph = build_graph(directory)
+    stops = Router(graph, backend='compact', cache_size=0)
+    stations = Router(graph, backend='stations', cache_size=0)
+    rng = random.Random(2)
+    names = sorted(graph.station_graph.station_nodes)
+    for _ in range(QUERIES):
+        a, b = rng.sample(names, 2)
+        journey = stations.get_shortest_path(a, b)
+        expected = stops.get_shortest_path(a, b)
+        assert (journey is None) == (expected is None)
+        if journey is None:
+            continue
+        steps = journey['steps']
+        assert steps[0]['from_id'] == a and steps[-1]['to_id'] == b
+        assert all(step['to_id'] == following['from_id'] for step, following in zip(steps, steps[1:]))
+
+    times = stations.travel_times(names[0])
+    for b in names[1:]:
+        journey = stations.get_shortest_path(names[0], b)
+        assert (journey is None) == (b not in times)
+        if journey:
+            assert abs(journey['total_time_seconds'] - times[b]) < 1e-6
+
+def brute_force_pareto(station_graph, a, b, max_transfers, max_extra_time, max_transfer_time):
+    """
+    (seconds, transfers) of the Pareto journeys from a to b, fastest first, by a plain Dijkstra
+    over (node, transfers so far) states. None if b can't be reached.
+    """
+    compact = station_graph.compact
+    station_of = station_graph.station_of
+    dist = {}
+    heap = []
+    for node in station_graph.station_nodes[a]:
+        dist[(node, 0)] = PLATFORM_WALK_TIME
+        heap.append((PLATFORM_WALK_TIME, node, 0))
+    heapq.heapify(heap)
+    while heap:
+        t, u, k = heapq.heappop(heap)
+        if t > dist[(u, k)]:
+            continue
+        for e in range(compact._offsets[u], compact._offsets[u + 1]):
+            v = compact._targets[e]
+            nk = k + (compact.edge_types[e] == TRANSFER)
+            if nk > max_transfers:
+                continue
+            between = station_of[station_graph.node_stops[u]] != station_of[station_graph.node_stops[v]]
+            if (compact.edge_types[e] == TRANSFER and max_transfer_time is not None and between
+                    and compact._weights[e] > max_transfer_time):
+                continue
+            nt = t + compact._weights[e]
+            if nt < dist.get((v, nk), float('inf')):
+                dist[(v, nk)] = nt
+                heapq.heappush(heap, (nt, v, nk))
+
+    front = []
+    for k in range(max_transfers + 1):
+        t = min(dist.get((node, k), float('inf')) for node in station_graph.station_nodes[b]) + PLATFORM_WALK_TIME
+        if t < min([seconds for seconds, _ in front], default=float('inf')):
+            front.append((t, k))
+    if not front:
+        return None
+    fastest = min(seconds for seconds, _ in front)
+    return sorted((seconds, k) for seconds, k in front if seconds <= fastest + max_extra_time)
+
+def test_pareto_matches_brute_force():
+    with tempfile.TemporaryDirectory() as directory:
+        graph = build_graph(directory)
+    station_graph = graph.station_graph
+    names = sorted(station_graph.station_nodes)
+    rng = random.Random(4)
+    for max_transfers, max_extra_time, max_transfer_time in ((4, 1200, None), (2, 1200, None), (0, 1200, None),
+                                                             (4, 60, None), (4, 1200, 150), (4, 1200, 1)):
+        for _ in range(QUERIES // 4):
+            a, b = rng.sample(names, 2)
+            journeys = station_graph.pareto_paths(a, b, max_transfers, max_extra_time, max_transfer_time)
+            got = None if journeys is None else [(seconds, k) for seconds, k, _ in journeys]
+            assert got == brute_force_pareto(station_graph, a, b, max_transfers, max_extra_time, max_transfer_time), (a, b)
+            for seconds, k, edges in journeys or ():
+                assert abs(sum(edge[2] for edge in edges) - seconds) < 1e-6
+                assert sum(edge[3] == 'transfer' for edge in edges) == k
+                assert edges[0][0] == a and edges[-1][1] == b
+
+def test_transfer_limit_spares_platform_changes():
+    with tempfile.TemporaryDirectory() as directory:
+        graph = build_graph(directory)
+    # Too short for any walk between stations, but the change to the shuttle at A20 (which
+    # takes the 180 s default) is within the station, so the G line is still reachable
+    journeys = graph.station_graph.pareto_paths('A01', 'G19', max_transfer_time=100)
+    assert journeys
+    for _, _, edges in journeys:
+        assert any(edge[3] == 'transfer' and edge[2] > 100 for edge in edges)
+        assert SHUTTLE[0] in {route for edge in edges for route in edge[4]}
+
+def test_rebuild_keeps_every_backend():
+    with tempfile.TemporaryDirectory() as directory:
+        graph = build_graph(directory)
+        routers = {backend: Router(graph, backend=backend) for backend in ('networkx', 'compact', 'astar', 'ch', 'stations')}
+        before = {backend: [router.get_shortest_path(a, b) for a, b in PAIRS] for backend, router in routers.items()}
+        version = graph.version
+
+        graph.build_graph()
+        assert graph.version != version
+        assert graph.compact is not None and graph.ch is not None and graph.station_graph is not None
+        for backend, router in routers.items():
+            assert [router.get_shortest_path(a, b) for a, b in PAIRS] == before[backend], backend
+
+def test_build_computes_segments_once():
+    with tempfile.TemporaryDirectory() as directory:
+        graph = build_graph(directory)
+        calls = []
+        segment_durations = graph._segment_durations
+        graph._segment_durations = lambda: calls.append(1) or segment_durations()
+        graph.build_graph()
+    assert len(calls) == 1 and graph.station_graph is not None
+
+def test_travel_times_tell_unknown_from_unreachable():
+    with tempfile.TemporaryDirectory() as directory:
+        graph = build_graph(directory)
+    for backend in ('networkx', 'compact', 'stations'):
+        router = Router(graph, backend=backend)
+        assert router.travel_times('nowhere') is None
+        # A known origin that reaches none of the destinations is not an unknown one
+        assert router.travel_times('101', []) == {}
+        assert router.travel_times('101', ['nowhere']) == {}
+
+if __name__ == "__main__":
+    test_compact_matches_networkx()
+    test_astar_matches_dijkstra()
+    test_astar_settles_fewer_nodes()
+    test_contraction_matches_dijkstra()
+    test_timed_transfers_are_usable()
+    test_station_graph_agrees_with_stop_graph()
+    test_pareto_matches_brute_force()
+    test_transfer_limit_spares_platform_changes()
+    test_rebuild_keeps_every_backend()
+    test_build_computes_segments_once()
+    test_travel_times_tell_unknown_from_unreachable()
+    print("Routing backends ok.")
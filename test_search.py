@@ -0,0 +1,64 @@
+import tempfile
+from sample_feed import load_sample_feed
+from nyc_transit import StationSearch
+
+# Checks for station search and autocomplete on the sample feed.
+# Run with pytest or `python test_search.py`.
+
+def make_search():
+    with tempfile.TemporaryDirectory() as directory:
+        return StationSearch(load_sample_feed(directory))
+
+def names(results):
+    return [name for _, name in results]
+
+def test_autocomplete_keeps_the_typed_prefix():
+    search = make_search()
+    # Names starting with "st" as typed come first, then names with a later "St(reet)" word
+    results = names(search.autocomplete("st", limit=200))
+    starting = [name for name in results if name.lower().startswith("st")]
+    assert {"Steinway St", "Stillwell Av"} <= set(starting)
+    assert results[:len(starting)] == starting
+    assert "14 St" in results
+    # Same order from the precomputed short prefixes
+    assert names(search.autocomplete("st")) == results[:8]
+    assert names(search.autocomplete("stei")) == ["Steinway St"]
+    # A complete abbreviation still finds the long form
+    assert "Times Sq-42 St" in names(search.autocomplete("times sq"))
+    assert "Times Sq-42 St" in names(search.autocomplete("times square"))
+
+def test_search_tolerates_typos():
+    search = make_search()
+    assert search.search("tmes squre")[0]['name'] == "Times Sq-42 St"
+    assert search.search("bedferd av")[0]['name'] == "Bedford Av"
+
+def test_search_expands_abbreviations():
+    search = make_search()
+    for short, long in [("bedford av", "bedford avenue"), ("court sq", "court square"),
+                        ("steinway st", "steinway street"), ("14 st", "14 street")]:
+        assert [r['id'] for r in search.search(short)] == [r['id'] for r in search.search(long)]
+    assert search.search("bedford avenue")[0]['name'] == "Bedford Av"
+    assert search.search("14 street")[0]['name'] == "14 St"
+
+def test_transposition_is_one_edit():
+    search = make_search()
+    # Five letters allow one edit; swapping "ur" would be two without counting transpositions
+    assert search.search("corut sq")[0]['name'] == "Court Sq"
+    assert search.search("stienway")[0]['name'] == "Steinway St"
+
+def test_ties_go_to_the_busier_station():
+    search = make_search()
+    # "Station G10 St" .. "Station G19 St" match "station g1" equally well; G18 also has the
+    # shuttle's trains, so it comes first and the rest follow by name
+    position = {station_id: i for i, station_id in enumerate(search.station_ids)}
+    assert search.train_counts[position['G18']] > search.train_counts[position['G10']]
+    assert [r['id'] for r in search.search("station g1")][:3] == ['G18', 'G10', 'G11']
+    assert [station_id for station_id, _ in search.autocomplete("station g1", 3)] == ['G18', 'G10', 'G11']
+
+if __name__ == "__main__":
+    test_autocomplete_keeps_the_typed_prefix()
+    test_search_tolerates_typos()
+    test_search_expands_abbreviations()
+    test_transposition_is_one_edit()
+    test_ties_go_to_the_busier_station()
+    print("Search ok.")
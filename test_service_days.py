@@ -0,0 +1,60 @@
+import datetime
+import tempfile
+from sample_feed import load_sample_feed, HOLIDAY
+from nyc_transit import RaptorRouter
+from nyc_transit.data_loader import split_overnight_trip_id, MISSING_TIME
+from nyc_transit.raptor import realtime_trip_key, service_day_start
+
+# Checks for service-day filtering on the sample feed: the calendar, holidays, and the previous
+# day's trips that are still running after midnight. Run with pytest or `python test_service_days.py`.
+
+FRIDAY = datetime.date(2026, 10, 16)
+SATURDAY = datetime.date(2026, 10, 17)
+
+def test_holiday_runs_its_exception_services():
+    with tempfile.TemporaryDirectory() as directory:
+        loader = load_sample_feed(directory)
+        assert loader.active_service_ids(FRIDAY) == {"Weekday"}
+        assert loader.active_service_ids(HOLIDAY) == {"Sunday"}
+
+def test_previous_day_runs_past_midnight():
+    with tempfile.TemporaryDirectory() as directory:
+        loader = load_sample_feed(directory, optimize_memory=True, service_date=SATURDAY)
+        days = {split_overnight_trip_id(trip_id)[1] for trip_id in loader.trips['trip_id']}
+        assert days == {None, FRIDAY}
+        # Friday's late trips are on Saturday's clock, from their first stop after midnight
+        carried = loader.stop_times['trip_id'].astype(str).str.endswith('@20261016')
+        arrivals = loader.stop_times.loc[carried, 'arrival_time']
+        assert carried.any() and (arrivals[arrivals != MISSING_TIME] >= 0).all()
+
+        # Saturday's first trips leave at 05:00, so a ride just after midnight is Friday's
+        raptor = RaptorRouter(loader)
+        journey = raptor.get_earliest_arrival('101', '130', '00:10')
+        trip_ids = {step['trip_id'] for step in journey['steps'] if step.get('trip_id')}
+        assert trip_ids and all(split_overnight_trip_id(trip_id)[1] == FRIDAY for trip_id in trip_ids)
+
+def test_predictions_apply_to_the_trip_of_their_day():
+    with tempfile.TemporaryDirectory() as directory:
+        loader = load_sample_feed(directory, optimize_memory=True, service_date=SATURDAY)
+        raptor = RaptorRouter(loader)
+        # The same realtime id names Friday's carried-over 24:10 trip and Saturday's own
+        friday = raptor.trip_ids.index('AFA23GEN-1-Weekday-00_014500_1..N01R@20261016')
+        key = realtime_trip_key(raptor.trip_ids[friday])
+        saturday = next(trip for trip in raptor.trip_keys[key] if trip != friday)
+
+        pattern, slots = raptor._trip_slots(friday)
+        stop_id = raptor.stop_ids[raptor._pattern_stops[raptor._pattern_stop_offsets[pattern]]]
+        delayed = service_day_start(SATURDAY) + int(raptor.arrivals[slots[0]]) + 600
+        predictions = {key: ('20261016', False, ((stop_id, delayed, 0, False),))}
+        assert raptor.apply_realtime(predictions) == 1
+
+        _, arrivals, _, _ = raptor.live
+        assert int(arrivals[slots[0]]) == int(raptor.arrivals[slots[0]]) + 600
+        _, saturday_slots = raptor._trip_slots(saturday)
+        assert (arrivals[saturday_slots] == raptor.arrivals[saturday_slots]).all()
+
+if __name__ == "__main__":
+    test_holiday_runs_its_exception_services()
+    test_previous_day_runs_past_midnight()
+    test_predictions_apply_to_the_trip_of_their_day()
+    print("Service days ok.")